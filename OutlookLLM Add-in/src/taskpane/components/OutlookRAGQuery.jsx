@@ -76,6 +76,11 @@ const OutlookRAGQuery = () => {
         return typeof Office !== 'undefined' && Office.context;
     };
 
+    // Mailbox address, so the backend keeps every user's data in its own index shard
+    const getMailbox = () => {
+        return isInOffice() && Office.context.mailbox ? Office.context.mailbox.userProfile.emailAddress : undefined;
+    };
+
     // Sync with Outlook data
     const syncOutlookData = async () => {
         if (!isInOffice()) {
@@ -255,6 +260,7 @@ const OutlookRAGQuery = () => {
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({
+                    mailbox: getMailbox(),
                     emails: emails,
                     events: events
                 })
@@ -303,6 +309,7 @@ const OutlookRAGQuery = () => {
                 },
                 body: JSON.stringify({ 
                     query: query,
+                    mailbox: getMailbox(),
                     use_outlook_data: isInOffice()
                 })
             });
@@ -1,14 +1,21 @@
+import time
+started_at = time.perf_counter()
 import argparse
 
 from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
+# None of these import torch / transformers / tensorrt_llm; they are imported when the models load
 from trt_llama_api import TrtLlmAPI
-from utils import messages_to_prompt, completion_to_prompt
-from outlook_rag import OutlookRAGSystem
+from utils import messages_to_prompt, completion_to_prompt, completion_prompt_prefix
+from outlook_rag import OutlookRAGSystem, load_embedding_model
+from context_builder import token_counter
+from shard_manager import DEFAULT_SHARD, ShardManager
+from startup import StartupPhases
 from sample_data_generator import generate_sample_emails, generate_sample_calendar_events
 import json
 import logging
 import os
+import threading
 
 # Create an argument parser
 parser = argparse.ArgumentParser(description='OutlookLLM Inference Server')
@@ -24,6 +31,23 @@ parser.add_argument("--port", type=int, help="Set the port to listen.(default: 8
 
 parser.add_argument("--max_output_tokens", type=int, help="Maximum output tokens.(default: 2048)")
 parser.add_argument("--max_input_tokens", type=int, help="Maximum input tokens.(default: 2048)")
+parser.add_argument("--embedding_batch_size", type=int, help="Batch size used when embedding documents for RAG.(default: 32)")
+parser.add_argument("--index_mode", type=str, choices=["flat", "ivf"], help="RAG vector index: exact 'flat' scan or approximate 'ivf'.(default: flat)")
+parser.add_argument("--query_cache_size", type=int, help="Query embeddings kept in the RAG LRU cache, 0 disables it.(default: 1024)")
+parser.add_argument("--retrieval_mode", type=str, choices=["vector", "keyword", "hybrid"], help="RAG retrieval: embeddings, BM25 keywords or both fused.(default: vector)")
+parser.add_argument("--fusion", type=str, choices=["rrf", "weighted"], help="How hybrid retrieval fuses the two rankings.(default: rrf)")
+parser.add_argument("--vector_storage", type=str, choices=["float32", "float16", "int8"], help="RAG vectors scanned as float32, or as compressed float16/int8 with exact re-ranking.(default: float32)")
+parser.add_argument("--shard_memory_mb", type=int, help="RAM budget for the per-mailbox RAG shards kept open; least recently used ones are closed beyond it.(default: 2048)")
+parser.add_argument("--passage_tokens", type=int, help="Longer email and event bodies are embedded as overlapping passages of this many tokens.(default: 200)")
+parser.add_argument("--context_tokens", type=int, help="Prompt tokens the retrieved emails or events of a query may fill.(default: max_input_tokens minus the instructions and question)")
+parser.add_argument("--embedder", type=str, choices=["auto", "sentence_transformers", "transformers", "onnx", "hashing"], help="RAG embedding backend; 'onnx' runs an int8-quantized ONNX Runtime export on CPU.(default: auto)")
+parser.add_argument("--embedder_threads", type=int, help="Intra-op threads of the onnx embedder.(default: all physical cores)")
+parser.add_argument("--reindex_workers", type=int, help="Embedder processes of a full reindex or embedding model migration, 0 embeds in the server process.(default: half the CPU cores)")
+parser.add_argument("--ivf_nprobe", type=int, help="Inverted lists scanned per query in ivf mode; higher means better recall.(default: 8)")
+parser.add_argument("--memory_watermark", type=float, help="Fraction of GPU memory in use above which the engine releases cached allocations after a completion.(default: 0.9)")
+parser.add_argument("--max_batch_size", type=int, help="Concurrent completions decoded together in one batch, capped at the engine's max batch size; 1 decodes each alone.(default: 8)")
+parser.add_argument("--batch_window_ms", type=float, help="How long a completion waits for others to share its batch.(default: 10)")
+parser.add_argument("--per_request_session", action="store_true", default=None, help="Set the TensorRT session up and empty the GPU cache on every completion, as before.")
 #parser.add_argument("--no_system_prompt", type=bool, help="Skip implicit top system prompt.", default=False)
 
 parser.add_argument('--cert_file', type=str, help="Path to the SSL Cert File.")
@@ -52,6 +76,26 @@ host = "127.0.0.1"
 port = "8385"
 max_output_tokens = 2048
 max_input_tokens = 2048
+embedding_batch_size = 32
+index_mode = "flat"
+ivf_nprobe = 8
+query_cache_size = 1024
+retrieval_mode = "vector"
+fusion = "rrf"
+passage_tokens = 200
+context_tokens = None
+vector_storage = "float32"
+shard_root = "outlook_shards"
+shard_memory_mb = 2048
+max_shards = None
+embedder = "auto"
+embedder_threads = None
+embedder_options = {}
+reindex_workers = None
+memory_watermark = 0.9
+persistent_session = True
+max_batch_size = 8
+batch_window_ms = 10
 
 # If a config file is present, config is loaded from file
 if os.path.exists("outlookllm_config.json"):
@@ -68,6 +112,26 @@ if os.path.exists("outlookllm_config.json"):
     port = config_data['port']
     max_output_tokens = config_data['max_output_tokens']
     max_input_tokens = config_data['max_input_tokens']
+    embedding_batch_size = config_data.get('embedding_batch_size', embedding_batch_size)
+    index_mode = config_data.get('index_mode', index_mode)
+    ivf_nprobe = config_data.get('ivf_nprobe', ivf_nprobe)
+    query_cache_size = config_data.get('query_cache_size', query_cache_size)
+    retrieval_mode = config_data.get('retrieval_mode', retrieval_mode)
+    fusion = config_data.get('fusion', fusion)
+    passage_tokens = config_data.get('passage_tokens', passage_tokens)
+    context_tokens = config_data.get('context_tokens', context_tokens)
+    vector_storage = config_data.get('vector_storage', vector_storage)
+    shard_root = config_data.get('shard_root', shard_root)
+    shard_memory_mb = config_data.get('shard_memory_mb', shard_memory_mb)
+    max_shards = config_data.get('max_shards', max_shards)
+    embedder = config_data.get('embedder', embedder)
+    embedder_threads = config_data.get('embedder_threads', embedder_threads)
+    embedder_options = config_data.get('embedder_options', embedder_options)
+    reindex_workers = config_data.get('reindex_workers', reindex_workers)
+    memory_watermark = config_data.get('memory_watermark', memory_watermark)
+    persistent_session = config_data.get('persistent_session', persistent_session)
+    max_batch_size = config_data.get('max_batch_size', max_batch_size)
+    batch_window_ms = config_data.get('batch_window_ms', batch_window_ms)
 
 
 # If arguments are provided in command line, arguments will override config.
@@ -77,6 +141,24 @@ if args.tokenizer_dir_path is not None: tokenizer_dir_path = args.tokenizer_dir_
 if args.verbose is not None: verbose = args.verbose
 if args.host is not None: host = args.host
 if args.port is not None: port = args.port
+if args.embedding_batch_size is not None: embedding_batch_size = args.embedding_batch_size
+if args.index_mode is not None: index_mode = args.index_mode
+if args.ivf_nprobe is not None: ivf_nprobe = args.ivf_nprobe
+if args.query_cache_size is not None: query_cache_size = args.query_cache_size
+if args.retrieval_mode is not None: retrieval_mode = args.retrieval_mode
+if args.fusion is not None: fusion = args.fusion
+if args.passage_tokens is not None: passage_tokens = args.passage_tokens
+if args.context_tokens is not None: context_tokens = args.context_tokens
+if args.vector_storage is not None: vector_storage = args.vector_storage
+if args.shard_memory_mb is not None: shard_memory_mb = args.shard_memory_mb
+if args.embedder is not None: embedder = args.embedder
+if args.embedder_threads is not None: embedder_threads = args.embedder_threads
+if args.reindex_workers is not None: reindex_workers = args.reindex_workers
+if args.memory_watermark is not None: memory_watermark = args.memory_watermark
+if args.per_request_session is not None: persistent_session = False
+if args.max_batch_size is not None: max_batch_size = args.max_batch_size
+if args.batch_window_ms is not None: batch_window_ms = args.batch_window_ms
+if embedder == "onnx" and embedder_threads: embedder_options = {**embedder_options, "intra_op_threads": embedder_threads}
 
 if (https_cert_file == "") or (https_key_file  == "") or (trt_engine_path == "") or (trt_engine_name == "") or (tokenizer_dir_path == ""):
      parser.print_help()
@@ -89,52 +171,165 @@ CORS(app) # to enable CORS from the Add-in
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-# Initialize RAG system
-rag_system = OutlookRAGSystem()
-
-# Load sample data if no real data is available
-if rag_system.get_stats()["total_emails"] == 0:
-    logging.info("Loading sample data for RAG system...")
-    sample_emails = generate_sample_emails()
-    sample_events = generate_sample_calendar_events()
-    
-    for email in sample_emails:
-        rag_system.add_email(email)
-    
-    for event in sample_events:
-        rag_system.add_calendar_event(event)
-    
-    rag_system.save_embeddings_cache()
-    logging.info(f"Loaded {len(sample_emails)} emails and {len(sample_events)} events")
-
-# create trt_llm engine object
-llm = TrtLlmAPI(
-    model_path=trt_engine_path,
-    engine_name=trt_engine_name,
-    tokenizer_dir=tokenizer_dir_path,
-    temperature=0.1,
-    max_new_tokens=max_output_tokens,
-    context_window=max_input_tokens,
-    messages_to_prompt=messages_to_prompt,
-    completion_to_prompt=completion_to_prompt,
-    verbose=False
-)
+startup = StartupPhases(started_at)
+startup.record("imports", time.perf_counter() - started_at)
+
+# Initialize RAG system: one shard per mailbox, opened on first use
+def create_rag_system(snapshot_dir):
+    return OutlookRAGSystem(embedding_batch_size=embedding_batch_size, snapshot_dir=snapshot_dir, index_mode=index_mode,
+                            ivf_nprobe=ivf_nprobe, query_cache_size=query_cache_size, retrieval_mode=retrieval_mode,
+                            fusion=fusion, passage_tokens=passage_tokens, vector_storage=vector_storage,
+                            embedder_backend=embedder, embedder_options=embedder_options)
+
+shards = ShardManager(create_rag_system, root=shard_root, memory_budget_bytes=shard_memory_mb * 1024 * 1024,
+                      max_shards=max_shards)
+
+def _mailbox(body):
+    """Mailbox whose shard serves the request: X-Mailbox header or "mailbox" field, else the default shard"""
+    mailbox = request.headers.get('X-Mailbox')
+    if not mailbox and isinstance(body, dict):
+        mailbox = body.get("mailbox")
+    return mailbox or DEFAULT_SHARD
+
+def load_embedder():
+    # Warm the model shared by every shard; keyword-only retrieval never embeds
+    if retrieval_mode != "keyword":
+        load_embedding_model(backend=embedder, **embedder_options)
+
+def start_reindex(mailbox, **options):
+    """Re-embed a shard in the background, holding it open until the new snapshot is swapped in"""
+    def run():
+        try:
+            with shards.lease(mailbox) as rag_system:
+                rag_system.reindex(**options)
+        except Exception as e:
+            logging.error(f"Reindex of {mailbox} failed: {e}")
+    options.setdefault("workers", reindex_workers)
+    threading.Thread(target=run, name=f"reindex-{mailbox}", daemon=True).start()
+
+def load_rag_index():
+    # Open the default shard and load sample data into it if no real data is available
+    with shards.lease(DEFAULT_SHARD) as rag_system:
+        if rag_system.pending_migration is not None:
+            # The snapshot holds vectors of another embedding model: serve them while migrating
+            logging.info(f"Migrating the RAG index to {rag_system.pending_migration['model_name']}")
+            start_reindex(DEFAULT_SHARD)
+        if rag_system.get_stats()["total_emails"] == 0:
+            logging.info("Loading sample data for RAG system...")
+            sample_emails = generate_sample_emails()
+            sample_events = generate_sample_calendar_events()
+            
+            # Embedded in the background; the journal makes them durable, so no snapshot is written here
+            rag_system.submit_emails(sample_emails)
+            rag_system.submit_calendar_events(sample_events)
+            logging.info(f"Queued {len(sample_emails)} emails and {len(sample_events)} events")
+
+# trt_llm engine object, created by the llm_engine startup phase
+llm = None
+
+def load_llm_engine():
+    global llm
+    llm = TrtLlmAPI(
+        model_path=trt_engine_path,
+        engine_name=trt_engine_name,
+        tokenizer_dir=tokenizer_dir_path,
+        temperature=0.1,
+        max_new_tokens=max_output_tokens,
+        context_window=max_input_tokens,
+        messages_to_prompt=messages_to_prompt,
+        completion_to_prompt=completion_to_prompt,
+        verbose=False,
+        persistent_session=persistent_session,
+        memory_watermark=memory_watermark,
+        max_batch_size=max_batch_size,
+        batch_window=batch_window_ms / 1000
+    )
+
+# The port is bound right away; the RAG chain (embedder, then default shard) and the GPU engine load concurrently
+startup.start([
+    [("embedding_model", load_embedder), ("rag_index", load_rag_index)],
+    [("llm_engine", load_llm_engine)]
+])
+
+# Startup phase each endpoint needs; until it is ready the endpoint answers 503 (see /ready)
+REQUIRED_PHASES = {
+    "query_inbox": "rag_index",
+    "query_calendar": "rag_index",
+    "add_email": "rag_index",
+    "add_event": "rag_index",
+    "ingest_status": "rag_index",
+    "add_emails": "rag_index",
+    "add_events": "rag_index",
+    "upsert_email": "rag_index",
+    "delete_email": "rag_index",
+    "upsert_event": "rag_index",
+    "delete_event": "rag_index",
+    "index_outlook": "rag_index",
+    "admin_reindex": "rag_index",
+    "admin_reindex_status": "rag_index",
+    "composeEmail": "llm_engine"
+}
+
+@app.before_request
+def require_startup_phase():
+    phase = REQUIRED_PHASES.get(request.endpoint)
+    if phase is None or startup.is_ready(phase):
+        return None
+    status = startup.status(phase)
+    response = jsonify({"error": f"Backend is not ready: {phase} is {status}", "phase": phase, "status": status})
+    response.status_code = 503
+    if status != "failed" and status != "skipped":
+        response.headers["Retry-After"] = "1"
+    return response
+
+INBOX_PROMPT = "Based on the following email context, answer the user's question.\n\nContext:\n{context}\n\nQuestion: {question}\n\nAnswer:"
+CALENDAR_PROMPT = "Based on the following calendar context, answer the user's question.\n\nContext:\n{context}\n\nQuestion: {question}\n\nAnswer:"
+
+def count_tokens(text):
+    """Tokens of a text for the serving model; estimated until the engine has loaded its tokenizer"""
+    return token_counter(llm._tokenizer if llm is not None else None)(text)
+
+def context_budget(template, question):
+    """Tokens left for the RAG context once the instructions and the question are in the prompt"""
+    available = max_input_tokens - count_tokens(template.format(context="", question=question))
+    return max(min(available, context_tokens or available), 0)
 
 def completions(prompt, temperature= 1.0, stop_strings = [], system_prompt=None):
     app.logger.info('llm completion with prompt=%s ', prompt)
+    if llm is None:
+        raise RuntimeError(f"TensorRT engine is not loaded ({startup.status('llm_engine')})")
     prompt_final = completion_to_prompt(prompt,system_prompt)
-    return llm.complete_common(prompt_final, False, temperature=temperature, formatted=True, stop_strings=stop_strings)
+    # Requests are served on threads; the engine batches concurrent completions or runs them one at a time.
+    # The system prompt framing is the same for every request of an endpoint, so its tokens are cached
+    return llm.complete_common(prompt_final, False, temperature=temperature, formatted=True, stop_strings=stop_strings,
+                               prompt_prefix=completion_prompt_prefix(system_prompt))
     
 
 @app.route('/health', methods=['GET'])
 def health():
-    rag_stats = rag_system.get_stats()
+    # Only a mailbox asked for explicitly is opened; otherwise the default shard is reported if it is resident
+    mailbox = request.headers.get('X-Mailbox') or request.args.get('mailbox')
+    if mailbox:
+        with shards.lease(mailbox) as rag_system:
+            rag_stats = rag_system.get_stats()
+    else:
+        rag_system = shards.resident(DEFAULT_SHARD)
+        rag_stats = rag_system.get_stats() if rag_system is not None else None
     return jsonify({
         "status": "healthy", 
         "message": "OutlookLLM backend is running",
-        "rag_system": rag_stats
+        "ready": startup.is_ready(),
+        "rag_system": rag_stats,
+        "shards": shards.get_stats(),
+        "llm": llm.get_stats() if llm is not None else None
     })
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Per-phase startup status and timings; 503 until every phase is ready"""
+    stats = startup.get_stats()
+    return jsonify(stats), 200 if stats["ready"] else 503
+
 @app.route('/query/inbox', methods=['POST'])
 def query_inbox():
     """Query inbox using RAG"""
@@ -146,11 +341,12 @@ def query_inbox():
         return jsonify({"error": "Question is required"}), 400
     
     try:
-        rag_result = rag_system.query_inbox(question)
+        with shards.lease(_mailbox(body)) as rag_system:
+            rag_result = rag_system.query_inbox(question, mode=body.get("mode"), filters=body.get("filters"),
+                                                token_budget=context_budget(INBOX_PROMPT, question), count_tokens=count_tokens)
         
         # Generate response using the context
-        context = rag_result["context"]
-        prompt = f"Based on the following email context, answer the user's question.\n\nContext:\n{context}\n\nQuestion: {question}\n\nAnswer:"
+        prompt = INBOX_PROMPT.format(context=rag_result["context"], question=question)
         
         # Mock response for now (replace with actual LLM when available)
         mock_answer = f"Based on your inbox, I found {len(rag_result['relevant_emails'])} relevant emails. "
@@ -162,12 +358,16 @@ def query_inbox():
             "question": question,
             "answer": mock_answer,
             "relevant_emails": rag_result["relevant_emails"],
-            "context_used": True
+            "context_used": True,
+            "context_tokens": rag_result["context_tokens"],
+            "prompt_tokens": count_tokens(prompt)
         }
         
         app.logger.info(f'Inbox query: {question}')
         return jsonify(response)
         
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         app.logger.error(f'Error in inbox query: {str(e)}')
         return jsonify({"error": "Internal server error"}), 500
@@ -183,11 +383,14 @@ def query_calendar():
         return jsonify({"error": "Question is required"}), 400
     
     try:
-        rag_result = rag_system.query_calendar(question)
+        # mode "window" / "upcoming" / "conflicts" answers from the event time index (optional start, end, limit)
+        with shards.lease(_mailbox(body)) as rag_system:
+            rag_result = rag_system.query_calendar(question, mode=body.get("mode"), filters=body.get("filters"),
+                                                   start=body.get("start"), end=body.get("end"), limit=body.get("limit", 5),
+                                                   token_budget=context_budget(CALENDAR_PROMPT, question), count_tokens=count_tokens)
         
         # Generate response using the context
-        context = rag_result["context"]
-        prompt = f"Based on the following calendar context, answer the user's question.\n\nContext:\n{context}\n\nQuestion: {question}\n\nAnswer:"
+        prompt = CALENDAR_PROMPT.format(context=rag_result["context"], question=question)
         
         # Mock response for now (replace with actual LLM when available)
         mock_answer = f"Based on your calendar, I found {len(rag_result['relevant_events'])} relevant events. "
@@ -199,43 +402,229 @@ def query_calendar():
             "question": question,
             "answer": mock_answer,
             "relevant_events": rag_result["relevant_events"],
-            "context_used": True
+            "context_used": True,
+            "context_tokens": rag_result["context_tokens"],
+            "prompt_tokens": count_tokens(prompt)
         }
         
         app.logger.info(f'Calendar query: {question}')
         return jsonify(response)
         
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         app.logger.error(f'Error in calendar query: {str(e)}')
         return jsonify({"error": "Internal server error"}), 500
 
 @app.route('/add/email', methods=['POST'])
 def add_email():
-    """Add new email to RAG system"""
+    """Queue a new email for the RAG system; poll /ingest/<ingest_id> until it is searchable"""
     assert request.headers.get('Content-Type') == 'application/json'
     body = request.get_json()
     
     try:
-        email_id = rag_system.add_email(body)
-        rag_system.save_embeddings_cache()
-        return jsonify({"message": "Email added successfully", "id": email_id})
+        with shards.lease(_mailbox(body)) as rag_system:
+            ingest_id = rag_system.submit_emails([body])
+            return jsonify({"message": "Email queued", "ingest_id": ingest_id, "id": body.get("id")}), 202
     except Exception as e:
         app.logger.error(f'Error adding email: {str(e)}')
         return jsonify({"error": "Failed to add email"}), 500
 
 @app.route('/add/event', methods=['POST'])
 def add_event():
-    """Add new calendar event to RAG system"""
+    """Queue a new calendar event for the RAG system; poll /ingest/<ingest_id> until it is searchable"""
     assert request.headers.get('Content-Type') == 'application/json'
     body = request.get_json()
     
     try:
-        event_id = rag_system.add_calendar_event(body)
-        rag_system.save_embeddings_cache()
-        return jsonify({"message": "Event added successfully", "id": event_id})
+        with shards.lease(_mailbox(body)) as rag_system:
+            ingest_id = rag_system.submit_calendar_events([body])
+            return jsonify({"message": "Event queued", "ingest_id": ingest_id, "id": body.get("id")}), 202
     except Exception as e:
         app.logger.error(f'Error adding event: {str(e)}')
         return jsonify({"error": "Failed to add event"}), 500
+
+@app.route('/ingest/<ingest_id>', methods=['GET'])
+def ingest_status(ingest_id):
+    """State of a queued ingestion ("queued", "running", "done" or "failed") with the ids of the added documents"""
+    with shards.lease(request.headers.get('X-Mailbox') or request.args.get('mailbox')) as rag_system:
+        status = rag_system.ingest_status(ingest_id)
+    if status is None:
+        return jsonify({"error": "Unknown ingest id"}), 404
+    return jsonify(status)
+
+def _bulk_payload(body, key):
+    """Accept either a bare JSON list or {key: [...], "batch_size": n}"""
+    if isinstance(body, list):
+        return body, None
+    return body.get(key, []), body.get("batch_size")
+
+@app.route('/add/emails', methods=['POST'])
+def add_emails():
+    """Add many emails to RAG system with batched embedding"""
+    assert request.headers.get('Content-Type') == 'application/json'
+    body = request.get_json()
+    emails, batch_size = _bulk_payload(body, "emails")
+    
+    try:
+        with shards.lease(_mailbox(body)) as rag_system:
+            email_ids = rag_system.add_emails(emails, batch_size=batch_size)
+            return jsonify({
+                "message": f"{len(email_ids)} emails added successfully",
+                "ids": email_ids,
+                "ingest": rag_system.get_stats()["last_ingest"]
+            })
+    except Exception as e:
+        app.logger.error(f'Error adding emails: {str(e)}')
+        return jsonify({"error": "Failed to add emails"}), 500
+
+@app.route('/add/events', methods=['POST'])
+def add_events():
+    """Add many calendar events to RAG system with batched embedding"""
+    assert request.headers.get('Content-Type') == 'application/json'
+    body = request.get_json()
+    events, batch_size = _bulk_payload(body, "events")
+    
+    try:
+        with shards.lease(_mailbox(body)) as rag_system:
+            event_ids = rag_system.add_calendar_events(events, batch_size=batch_size)
+            return jsonify({
+                "message": f"{len(event_ids)} events added successfully",
+                "ids": event_ids,
+                "ingest": rag_system.get_stats()["last_ingest"]
+            })
+    except Exception as e:
+        app.logger.error(f'Error adding events: {str(e)}')
+        return jsonify({"error": "Failed to add events"}), 500
+
+def _item_mailbox():
+    """Mailbox of a PUT/DELETE request: X-Mailbox header, "mailbox" query parameter or body field"""
+    return request.headers.get('X-Mailbox') or request.args.get('mailbox') or _mailbox(request.get_json(silent=True))
+
+@app.route('/email/<email_id>', methods=['PUT'])
+def upsert_email(email_id):
+    """Add or replace the email with this id; searchable once the response is sent"""
+    assert request.headers.get('Content-Type') == 'application/json'
+    body = dict(request.get_json(), id=email_id)
+
+    try:
+        with shards.lease(_item_mailbox()) as rag_system:
+            rag_system.upsert_email(body)
+            return jsonify({"message": "Email upserted", "id": email_id, "ingest": rag_system.get_stats()["last_ingest"]})
+    except Exception as e:
+        app.logger.error(f'Error upserting email: {str(e)}')
+        return jsonify({"error": "Failed to upsert email"}), 500
+
+@app.route('/email/<email_id>', methods=['DELETE'])
+def delete_email(email_id):
+    """Remove an email from search results; its rows are dropped by the next tombstone purge"""
+    try:
+        with shards.lease(_item_mailbox()) as rag_system:
+            deleted = rag_system.delete_email(email_id)
+    except Exception as e:
+        app.logger.error(f'Error deleting email: {str(e)}')
+        return jsonify({"error": "Failed to delete email"}), 500
+    if not deleted:
+        return jsonify({"error": "Unknown email id"}), 404
+    return jsonify({"message": "Email deleted", "id": email_id})
+
+@app.route('/event/<event_id>', methods=['PUT'])
+def upsert_event(event_id):
+    """Add or replace the calendar event with this id; searchable once the response is sent"""
+    assert request.headers.get('Content-Type') == 'application/json'
+    body = dict(request.get_json(), id=event_id)
+
+    try:
+        with shards.lease(_item_mailbox()) as rag_system:
+            rag_system.upsert_calendar_event(body)
+            return jsonify({"message": "Event upserted", "id": event_id, "ingest": rag_system.get_stats()["last_ingest"]})
+    except Exception as e:
+        app.logger.error(f'Error upserting event: {str(e)}')
+        return jsonify({"error": "Failed to upsert event"}), 500
+
+@app.route('/event/<event_id>', methods=['DELETE'])
+def delete_event(event_id):
+    """Remove a calendar event from search results; its rows are dropped by the next tombstone purge"""
+    try:
+        with shards.lease(_item_mailbox()) as rag_system:
+            deleted = rag_system.delete_calendar_event(event_id)
+    except Exception as e:
+        app.logger.error(f'Error deleting event: {str(e)}')
+        return jsonify({"error": "Failed to delete event"}), 500
+    if not deleted:
+        return jsonify({"error": "Unknown event id"}), 404
+    return jsonify({"message": "Event deleted", "id": event_id})
+
+@app.route('/admin/reindex', methods=['POST'])
+def admin_reindex():
+    """Start re-embedding a mailbox, by default into the configured embedding model; poll GET for progress"""
+    body = request.get_json(silent=True) or {}
+    mailbox = _mailbox(body)
+    options = {key: body[key] for key in ("backend", "model_name", "options", "workers", "threads_per_worker", "chunk_size")
+               if body.get(key) is not None}
+    try:
+        with shards.lease(mailbox) as rag_system:
+            if rag_system.reindexing():
+                return jsonify({"error": "A reindex is already running", "reindex": rag_system.reindex_status()}), 409
+        start_reindex(mailbox, **options)
+    except Exception as e:
+        app.logger.error(f'Error starting reindex: {str(e)}')
+        return jsonify({"error": "Failed to start reindex"}), 500
+    return jsonify({"message": "Reindex started", "mailbox": mailbox}), 202
+
+@app.route('/admin/reindex', methods=['GET'])
+def admin_reindex_status():
+    """Phase, progress and throughput of the running or last reindex of a mailbox"""
+    with shards.lease(request.headers.get('X-Mailbox') or request.args.get('mailbox')) as rag_system:
+        status = rag_system.reindex_status()
+    if status is None:
+        return jsonify({"error": "No reindex has run"}), 404
+    return jsonify(status)
+
+def _from_addin(item, field_map):
+    """Rename add-in fields to RAG fields, dropping empty values so defaults apply"""
+    converted = {}
+    for source, target in field_map.items():
+        value = item.get(source)
+        if not value:
+            continue
+        if target in ("date", "start_time", "end_time") and value.endswith("Z"):
+            # EWS timestamps are UTC with a 'Z' suffix, which fromisoformat() rejects before Python 3.11
+            value = value[:-1] + "+00:00"
+        converted[target] = value
+    return converted
+
+@app.route('/index/outlook', methods=['POST'])
+def index_outlook():
+    """Index the mailbox snapshot pushed by the add-in; unchanged items cost hashing only"""
+    assert request.headers.get('Content-Type') == 'application/json'
+    body = request.get_json()
+    emails = [_from_addin(email, {"id": "id", "subject": "subject", "sender": "sender", "body": "body", "received": "date"})
+              for email in body.get("emails", [])]
+    events = [_from_addin(event, {"id": "id", "subject": "subject", "start": "start_time", "end": "end_time",
+                                  "organizer": "organizer", "body": "body"})
+              for event in body.get("events", [])]
+
+    try:
+        with shards.lease(_mailbox(body)) as rag_system:
+            email_ids = rag_system.add_emails(emails, skip_unchanged=True)
+            email_ingest = rag_system.get_stats()["last_ingest"]
+            event_ids = rag_system.add_calendar_events(events, skip_unchanged=True)
+            stats = rag_system.get_stats()
+            return jsonify({
+                "success": True,
+                "indexed_emails": len(email_ids),
+                "indexed_events": len(event_ids),
+                "unchanged_emails": email_ingest["unchanged"],
+                "unchanged_events": stats["last_ingest"]["unchanged"],
+                "content_store": stats["content_store"],
+                "message": "Outlook data successfully indexed"
+            })
+    except Exception as e:
+        app.logger.error(f'Error indexing Outlook data: {str(e)}')
+        return jsonify({"success": False, "error": "Failed to index Outlook data"}), 500
+
+@app.route('/composeEmail', methods=['POST'])
 def composeEmail():
     assert request.headers.get('Content-Type') == 'application/json'
     body = request.get_json()
@@ -280,5 +669,6 @@ def composeEmail():
     return json.dumps(response)
 
 if __name__ == '__main__':
+    logging.info(f"Binding {host}:{port} {time.perf_counter() - started_at:.2f}s after process start")
     # Outlook add-ins can only call URLs under https, here we retrieve the https config and add it to Flask server
-    app.run(host, port=port, debug=True, use_reloader=False, threaded=False, ssl_context=(https_cert_file,https_key_file))
+    app.run(host, port=port, debug=True, use_reloader=False, threaded=True, ssl_context=(https_cert_file,https_key_file))
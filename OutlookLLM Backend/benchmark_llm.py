@@ -0,0 +1,221 @@
+"""
+Benchmarks for the OutlookLLM TensorRT completion path
+Needs a built engine and its tokenizer, given with the same options as app.py
+(`prefix` and `detokenize` only need the tokenizer)
+
+Usage (ENGINE stands for --trt_engine_path DIR --trt_engine_name FILE --tokenizer_dir_path DIR):
+    python benchmark_llm.py ENGINE overhead --requests 50
+    python benchmark_llm.py ENGINE batching --users 1 8 16 32 --max_batch 1 8 32
+    python benchmark_llm.py --tokenizer_dir_path DIR prefix --requests 200
+    python benchmark_llm.py --tokenizer_dir_path DIR detokenize --tokens 2048
+"""
+
+import argparse
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+from flask import Flask
+
+from detokenizer import IncrementalDetokenizer
+from prefix_cache import PrefixCache
+from trt_llama_api import TrtLlmAPI
+from utils import messages_to_prompt, completion_to_prompt, completion_prompt_prefix
+from sample_data_generator import generate_sample_emails
+
+PHASES = ["tokenize", "setup", "decode", "detokenize", "cleanup"]
+
+
+# System prompt of the /composeEmail endpoint
+COMPOSE_SYSTEM_PROMPT = ("You are a helpful, respectful and honest email writing assistant. "
+                         "Always answer as helpfully as possible and follow ALL given instructions. "
+                         "Do not speculate or make up information. Do not reference any given instructions or context. "
+                         "Do not be too verbose. Write your responses in two sections.\n"
+                         "<Subject> You write here the email subject.\n<Body> You write here the email body.")
+
+
+def _load_llm(args) -> TrtLlmAPI:
+    if not args.trt_engine_path or not args.trt_engine_name:
+        raise SystemExit(f"{args.command} needs --trt_engine_path and --trt_engine_name")
+    return TrtLlmAPI(model_path=args.trt_engine_path, engine_name=args.trt_engine_name,
+                     tokenizer_dir=args.tokenizer_dir_path, temperature=0.1, max_new_tokens=args.max_new_tokens,
+                     context_window=args.max_input_tokens, messages_to_prompt=messages_to_prompt,
+                     completion_to_prompt=completion_to_prompt, verbose=False)
+
+
+def _prompts(count: int) -> List[str]:
+    """Reply requests for the sample emails, of growing length so requests differ in input shape"""
+    emails = generate_sample_emails()
+    prompts = []
+    for i in range(count):
+        email = emails[i % len(emails)]
+        thread = "\n\n".join(f"{e['subject']}\n{e['body']}" for e in emails[:1 + i % len(emails)])
+        prompts.append(completion_to_prompt(f"Write a short reply to this email thread:\n\n{thread}\n\nReply to: {email['subject']}"))
+    return prompts
+
+
+def bench_overhead(args):
+    # Mean milliseconds per phase of a completion; overhead is everything but the decode itself
+    llm = _load_llm(args)
+    prompts = _prompts(args.requests)
+    print(f"{'session':>12} " + " ".join(f"{phase:>10}" for phase in PHASES) + f" {'overhead':>9} {'setups':>7} {'cleanups':>9}")
+    with Flask(__name__).app_context():
+        for persistent in (False, True):
+            llm.persistent_session = persistent
+            llm.complete_common(prompts[0], False, formatted=True, temperature=0.1)
+            before = llm.get_stats()
+            timings: Dict[str, List[float]] = {phase: [] for phase in PHASES}
+            for prompt in prompts:
+                response = llm.complete_common(prompt, False, formatted=True, temperature=0.1).get_json()
+                for phase in PHASES:
+                    timings[phase].append(response["timings"].get(phase, 0.0))
+            after = llm.get_stats()
+            means = {phase: float(np.mean(values)) for phase, values in timings.items()}
+            overhead = sum(means.values()) - means["decode"]
+            label = "persistent" if persistent else "per-request"
+            print(f"{label:>12} " + " ".join(f"{means[phase]:>10.2f}" for phase in PHASES) + f" {overhead:>9.2f} "
+                  f"{after['setups'] - before['setups']:>7} {after['cleanups'] - before['cleanups']:>9}")
+
+
+def bench_batching(args):
+    # Every user sends its requests back to back; throughput is completions/s and generated tokens/s for all users
+    llm = _load_llm(args)
+    prompts = _prompts(max(args.users) * args.requests)
+    print(f"{'users':>6} {'max batch':>10} {'req/s':>8} {'tok/s':>9} {'batch':>6} {'queue ms':>9} {'compute ms':>11} {'p99 ms':>8}")
+    with Flask(__name__).app_context():
+        for max_batch in args.max_batch:
+            llm.configure_batching(max_batch, args.batch_window_ms / 1000)
+            llm.complete_common(prompts[0], False, formatted=True, temperature=0.1)
+            for users in args.users:
+                responses: List[List[dict]] = [[] for _ in range(users)]
+                before = llm.get_stats()["batching"] or {"batches": 0, "requests": 0}
+
+                def user(number: int):
+                    for prompt in prompts[number * args.requests:(number + 1) * args.requests]:
+                        responses[number].append(llm.complete_common(prompt, False, formatted=True, temperature=0.1).get_json())
+
+                threads = [threading.Thread(target=user, args=(number,)) for number in range(users)]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - start
+                done = [response for user_responses in responses for response in user_responses]
+                tokens = sum(response["usage"]["completion_tokens"] for response in done)
+                queue = np.mean([response["timings"]["queue"] for response in done])
+                compute = np.mean([response["timings"]["compute"] for response in done])
+                total = [response["timings"]["queue"] + response["timings"]["compute"] for response in done]
+                after = llm.get_stats()["batching"] or {"batches": 1, "requests": 1}
+                batch = (after["requests"] - before["requests"]) / max(after["batches"] - before["batches"], 1)
+                print(f"{users:>6} {max_batch:>10} {len(done) / elapsed:>8.2f} {tokens / elapsed:>9.1f} {batch:>6.1f} "
+                      f"{queue:>9.1f} {compute:>11.1f} {np.percentile(total, 99):>8.1f}")
+    llm.configure_batching(1)
+
+
+def bench_prefix(args):
+    # Tokenization per request with the system prompt framing tokenized every time and taken from the cache
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer_dir_path, legacy=False)
+    encode = lambda text: tokenizer.encode(text, add_special_tokens=False)
+    emails = generate_sample_emails()
+    requests = [f"Reply to {emails[i % len(emails)]['sender']} about {emails[i % len(emails)]['subject']} (#{i})"
+                for i in range(args.requests)]
+    prefix = completion_prompt_prefix(COMPOSE_SYSTEM_PROMPT)
+    prompts = [completion_to_prompt(request, COMPOSE_SYSTEM_PROMPT) for request in requests]
+    cache = PrefixCache(encode)
+    # Every cached split must give the ids of the whole prompt
+    wrong = sum(cache.encode(prompt, prefix) != encode(prompt) for prompt in prompts)
+    print(f"prefix tokens {len(encode(prefix))}, mean prompt tokens {np.mean([len(encode(p)) for p in prompts]):.0f}, "
+          f"splits differing from whole-prompt tokenization: {wrong}")
+    print(f"{'tokenize':>10} {'mean ms':>8} {'p99 ms':>8}")
+    for label, tokenize in (("whole", encode), ("cached", lambda prompt: cache.encode(prompt, prefix))):
+        latencies = []
+        for prompt in prompts:
+            start = time.perf_counter()
+            tokenize(prompt)
+            latencies.append((time.perf_counter() - start) * 1000)
+        print(f"{label:>10} {np.mean(latencies):>8.3f} {np.percentile(latencies, 99):>8.3f}")
+    print(cache.get_stats())
+
+
+def bench_detokenize(args):
+    # Streaming text of a long completion token by token, as stream_complete_common did (the whole output read back
+    # and decoded every step) and with the incremental detokenizer; cost per token by position in the output
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer_dir_path, legacy=False)
+    emails = generate_sample_emails()
+    text = ""
+    while len(tokenizer.encode(text, add_special_tokens=False)) < args.tokens:
+        text += "\n\n".join(f"{email['subject']}\n{email['body']} Ünïcödé ✓ 数据 🙂" for email in emails)
+    tokens = tokenizer.encode(text, add_special_tokens=False)[:args.tokens]
+    # Output buffer as the engine returns it: the generated ids, then end-token padding
+    buffer = np.full(args.tokens + 1, 2, dtype=np.int32)
+    bounds = [bound for bound in (128, 256, 512, 1024, 2048, 4096) if bound <= args.tokens]
+    print(f"{'decode':>14} " + " ".join(f"{'us/tok @' + str(bound):>13}" for bound in bounds))
+
+    def whole():
+        outputs = buffer[:args.tokens].tolist()
+        outputs.reverse()
+        while outputs and outputs[0] == 2:
+            outputs.pop(0)
+        outputs.reverse()
+        return tokenizer.decode(outputs + [2])
+
+    streamed = {}
+    for label in ("whole", "incremental"):
+        buffer[:] = 2
+        detokenizer = IncrementalDetokenizer(tokenizer)
+        latencies, pieces = [], []
+        for step, token in enumerate(tokens):
+            buffer[step] = token
+            start = time.perf_counter()
+            if label == "whole":
+                pieces = [whole()]
+            else:
+                pieces.append(detokenizer.add([int(buffer[step])]))
+            latencies.append((time.perf_counter() - start) * 1e6)
+        streamed[label] = "".join(pieces).removesuffix("</s>") + (detokenizer.flush() if label == "incremental" else "")
+        # Mean over the tokens just before each position
+        means = [np.mean(latencies[max(bound - 64, 0):bound]) for bound in bounds]
+        print(f"{label:>14} " + " ".join(f"{mean:>13.1f}" for mean in means))
+    print(f"incremental text equals whole decode: {streamed['incremental'] == streamed['whole']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OutlookLLM completion benchmarks')
+    parser.add_argument('--trt_engine_path', type=str)
+    parser.add_argument('--trt_engine_name', type=str)
+    parser.add_argument('--tokenizer_dir_path', type=str, required=True)
+    parser.add_argument('--max_input_tokens', type=int, default=2048)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    overhead = subparsers.add_parser('overhead', help="Per-request time by phase, with the session set up per request and kept")
+    overhead.add_argument('--requests', type=int, default=50)
+    overhead.add_argument('--max_new_tokens', type=int, default=16, help="Short outputs make the fixed overhead visible")
+    overhead.set_defaults(func=bench_overhead)
+
+    batching = subparsers.add_parser('batching', help="Throughput of concurrent users with and without batched decoding")
+    batching.add_argument('--users', type=int, nargs='+', default=[1, 8, 16, 32])
+    batching.add_argument('--requests', type=int, default=4, help="Completions per user")
+    batching.add_argument('--max_batch', type=int, nargs='+', default=[1, 8, 32],
+                          help="Batch sizes to compare, capped at the engine's max batch size")
+    batching.add_argument('--batch_window_ms', type=float, default=10)
+    batching.add_argument('--max_new_tokens', type=int, default=128)
+    batching.set_defaults(func=bench_batching)
+
+    prefix = subparsers.add_parser('prefix', help="Prompt tokenization with and without the system prompt prefix cache")
+    prefix.add_argument('--requests', type=int, default=200)
+    prefix.set_defaults(func=bench_prefix)
+
+    detokenize = subparsers.add_parser('detokenize', help="Streaming detokenization cost per token, whole-output decode against incremental")
+    detokenize.add_argument('--tokens', type=int, default=2048)
+    detokenize.set_defaults(func=bench_detokenize)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""
+Benchmarks for the OutlookLLM RAG retrieval path
+Uses synthetic embeddings so no embedding model is required (except for `embedders`,
+which times the embedding backends themselves)
+
+Usage:
+    python benchmark_rag.py search --sizes 10000 100000 1000000
+    python benchmark_rag.py snapshot --sizes 10000 100000 1000000
+    python benchmark_rag.py ann --rows 1000000 --nprobe 4 8 16 32
+    python benchmark_rag.py quantized --rows 1000000
+    python benchmark_rag.py embedders --backends hashing transformers onnx --threads 1 4
+    python benchmark_rag.py documents --sizes 10000 100000
+    python benchmark_rag.py concurrency --readers 1 4 16 --seconds 10
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable, Iterator, List
+
+import numpy as np
+
+from vector_index import VectorIndex, normalize_rows
+from embedding_snapshot import DocumentList, load_snapshot, write_snapshot
+from ivf_index import IVFIndex
+from quantized_index import PRECISIONS, QuantizedIndex
+from embedders import DEFAULT_EMBEDDING_MODEL, EMBEDDER_BACKENDS, create_embedder
+from outlook_rag import EmailDocument, OutlookRAGSystem
+from sample_data_generator import generate_sample_emails
+
+
+def _random_vectors(rows: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((rows, dim), dtype=np.float32)
+
+
+def _clustered_vectors(rows: int, dim: int, clusters: int, spread: float = 1.0, seed: int = 0) -> np.ndarray:
+    """Mixture of Gaussians: closer to real embedding corpora than isotropic noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    labels = rng.integers(0, clusters, rows)
+    return centers[labels] + spread * rng.standard_normal((rows, dim), dtype=np.float32)
+
+
+def _time_queries(fn: Callable[[np.ndarray], object], queries: np.ndarray) -> List[float]:
+    """Run fn for every query and return latencies in milliseconds"""
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def _legacy_search(vectors: np.ndarray, query: np.ndarray, top_k: int):
+    """The original per-document Python loop, kept for comparison"""
+    similarities = []
+    for row, vector in enumerate(vectors):
+        similarity = np.dot(query, vector) / (np.linalg.norm(query) * np.linalg.norm(vector))
+        similarities.append((similarity, row))
+    similarities.sort(key=lambda x: x[0], reverse=True)
+    return similarities[:top_k]
+
+
+def bench_search(args):
+    print(f"{'rows':>10} {'mode':>8} {'p50 ms':>10} {'p99 ms':>10}")
+    for size in args.sizes:
+        vectors = _random_vectors(size, args.dim)
+        index = VectorIndex(dim=args.dim, initial_capacity=size)
+        index.add_batch(vectors, np.arange(size))
+        queries = _random_vectors(args.queries, args.dim, seed=1)
+
+        latencies = _time_queries(lambda q: index.search(q, args.top_k), queries)
+        print(f"{size:>10} {'matrix':>8} {np.percentile(latencies, 50):>10.2f} {np.percentile(latencies, 99):>10.2f}")
+
+        if size <= args.legacy_max_rows:
+            latencies = _time_queries(lambda q: _legacy_search(vectors, q, args.top_k), queries[:3])
+            print(f"{size:>10} {'legacy':>8} {np.percentile(latencies, 50):>10.2f} {np.percentile(latencies, 99):>10.2f}")
+
+
+def bench_snapshot(args):
+    print(f"{'rows':>10} {'write s':>10} {'open ms':>10} {'1st query ms':>13}")
+    for size in args.sizes:
+        index = VectorIndex(dim=args.dim, initial_capacity=size)
+        index.add_batch(_random_vectors(size, args.dim), np.arange(size))
+        documents = [{"id": f"email_{i}", "subject": f"Subject {i}"} for i in range(size)]
+
+        with tempfile.TemporaryDirectory() as root:
+            start = time.perf_counter()
+            write_snapshot(root, "benchmark", {"emails": (index, documents, dict)})
+            written = time.perf_counter() - start
+
+            start = time.perf_counter()
+            _, corpora = load_snapshot(root, {"emails": dict})
+            opened = (time.perf_counter() - start) * 1000
+
+            mapped_index, mapped_documents = corpora["emails"]
+            start = time.perf_counter()
+            _, rows = mapped_index.search(_random_vectors(1, args.dim, seed=1)[0], args.top_k)
+            [mapped_documents[int(owner)] for owner in mapped_index.owners_of(rows)]
+            first_query = (time.perf_counter() - start) * 1000
+            del mapped_index, mapped_documents, corpora
+
+        print(f"{size:>10} {written:>10.2f} {opened:>10.2f} {first_query:>13.2f}")
+
+
+def bench_ann(args):
+    vectors = _clustered_vectors(args.rows + args.queries, args.dim, args.clusters, args.spread)
+    queries, vectors = vectors[:args.queries], vectors[args.queries:]
+    index = VectorIndex(dim=args.dim, initial_capacity=args.rows)
+    index.add_batch(vectors, np.arange(args.rows))
+
+    start = time.perf_counter()
+    ivf = IVFIndex(nlist=args.nlist)
+    ivf.train(index)
+    print(f"trained {ivf.nlist} lists over {args.rows} rows in {time.perf_counter() - start:.2f}s")
+
+    exact = [set(index.search(q, args.top_k)[1]) for q in queries]
+    latencies = _time_queries(lambda q: index.search(q, args.top_k), queries)
+    print(f"{'mode':>10} {'recall@' + str(args.top_k):>10} {'p50 ms':>10} {'p99 ms':>10}")
+    print(f"{'flat':>10} {1.0:>10.3f} {np.percentile(latencies, 50):>10.2f} {np.percentile(latencies, 99):>10.2f}")
+    for nprobe in args.nprobe:
+        found = [set(ivf.search(q, index, args.top_k, nprobe=nprobe)[1]) for q in queries]
+        recall = np.mean([len(f & e) / len(e) for f, e in zip(found, exact)])
+        latencies = _time_queries(lambda q: ivf.search(q, index, args.top_k, nprobe=nprobe), queries)
+        print(f"{'ivf/' + str(nprobe):>10} {recall:>10.3f} {np.percentile(latencies, 50):>10.2f} {np.percentile(latencies, 99):>10.2f}")
+
+
+def bench_quantized(args):
+    vectors = _clustered_vectors(args.rows + args.queries, args.dim, args.clusters, args.spread)
+    queries, vectors = vectors[:args.queries], vectors[args.queries:]
+    index = VectorIndex(dim=args.dim, initial_capacity=args.rows)
+    index.add_batch(vectors, np.arange(args.rows))
+    del vectors
+
+    exact = [set(index.search(q, args.top_k)[1]) for q in queries]
+    latencies = _time_queries(lambda q: index.search(q, args.top_k), queries)
+    float32_mb = index.vectors.nbytes / 2**20
+    print(f"{'storage':>14} {'MB':>9} {'recall@' + str(args.top_k):>10} {'p50 ms':>10} {'p99 ms':>10}")
+    print(f"{'float32':>14} {float32_mb:>9.1f} {1.0:>10.3f} {np.percentile(latencies, 50):>10.2f} {np.percentile(latencies, 99):>10.2f}")
+    for precision in PRECISIONS:
+        quantized = QuantizedIndex.from_index(index, precision=precision)
+        megabytes = quantized.nbytes / 2**20
+        # rerank_factor 0 shows the compressed scan alone (rerank_min candidates are still re-scored)
+        for factor in [0] + args.rerank_factor:
+            quantized.rerank_factor, quantized.rerank_min = factor, args.top_k if factor == 0 else 50
+            found = [set(quantized.search(q, index, args.top_k)[1]) for q in queries]
+            recall = np.mean([len(f & e) / len(e) for f, e in zip(found, exact)])
+            latencies = _time_queries(lambda q: quantized.search(q, index, args.top_k), queries)
+            label = f"{precision}/{'scan' if factor == 0 else 'x' + str(factor)}"
+            print(f"{label:>14} {megabytes:>9.1f} {recall:>10.3f} {np.percentile(latencies, 50):>10.2f} {np.percentile(latencies, 99):>10.2f}")
+
+
+def bench_embedders(args):
+    emails = generate_sample_emails()
+    # The same corpus for every backend: sample emails, numbered so no two texts are identical
+    texts = [f"{OutlookRAGSystem._email_text(emails[i % len(emails)])} #{i}" for i in range(args.texts)]
+    configs = []
+    for backend in args.backends:
+        if backend == "onnx":
+            for threads in args.threads:
+                for quantize in ([True, False] if args.onnx_float else [True]):
+                    label = f"onnx/{'int8' if quantize else 'fp32'}/t{threads or 'auto'}"
+                    configs.append((label, backend, {"quantize": quantize, "intra_op_threads": threads or None}))
+        else:
+            configs.append((backend, backend, {}))
+
+    # Agreement is the mean cosine between each text's vectors from this and the first model backend
+    print(f"{'backend':>22} {'load s':>8} {'emb/s':>10} {'dim':>6} {'cosine':>8}")
+    reference = None
+    for label, backend, options in configs:
+        try:
+            start = time.perf_counter()
+            embedder = create_embedder(backend, args.model, **options)
+            loaded = time.perf_counter() - start
+            embedder.encode(texts[:args.batch_size], batch_size=args.batch_size)
+            start = time.perf_counter()
+            vectors = embedder.encode(texts, batch_size=args.batch_size)
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            print(f"{label:>22} unavailable: {e}")
+            continue
+        vectors = normalize_rows(vectors)
+        agreement = ""
+        if backend != "hashing":
+            if reference is None:
+                reference = vectors
+            elif reference.shape == vectors.shape:
+                agreement = f"{float(np.mean(np.sum(reference * vectors, axis=1))):.4f}"
+        print(f"{label:>22} {loaded:>8.2f} {len(texts) / elapsed:>10.1f} {vectors.shape[1]:>6} {agreement:>8}")
+
+
+def _synthetic_emails(size: int, correspondents: int) -> Iterator[EmailDocument]:
+    """Sample emails made distinct, from and to a pool of correspondents, one minute apart"""
+    emails = generate_sample_emails()
+    start = datetime(2024, 1, 1)
+    for i in range(size):
+        email = emails[i % len(emails)]
+        yield EmailDocument(id=f"email_{i}", subject=f"{email['subject']} #{i}", body=f"{email['body']} #{i}",
+                            sender=f"person{i % correspondents}@company.com",
+                            recipients=["user@company.com", f"person{(i * 7) % correspondents}@company.com"],
+                            date=start + timedelta(minutes=i), folder=email['folder'], importance=email['importance'])
+
+
+def bench_documents(args):
+    # Python heap allocated for the corpus, measured with tracemalloc; top-k is the time to build k document objects
+    print(f"{'documents':>10} {'store':>10} {'bytes/doc':>10} {'MB':>8} {'top-k ms':>9}")
+    positions = np.random.default_rng(0).integers(0, min(args.sizes), args.top_k).tolist()
+    for size in args.sizes:
+        for store in ("objects", "columnar"):
+            tracemalloc.start()
+            if store == "objects":
+                documents = list(_synthetic_emails(size, args.correspondents))
+            else:
+                documents = DocumentList()
+                documents.extend(_synthetic_emails(size, args.correspondents))
+            allocated, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            latencies = _time_queries(lambda _: [documents[p] for p in positions], np.zeros(args.queries))
+            print(f"{size:>10} {store:>10} {allocated / size:>10.1f} {allocated / 2**20:>8.1f} {np.percentile(latencies, 50):>9.3f}")
+            del documents
+
+
+def _marked_email(samples: List[dict], i: int, revision: int = 0) -> dict:
+    """Synthetic email i, its body ending in the tokens marker<i> and rev<revision>"""
+    email = samples[i % len(samples)]
+    return {"id": f"email_{i}", "subject": f"{email['subject']} #{i}", "body": f"{email['body']} marker{i} rev{revision}",
+            "sender": f"person{i % 50}@company.com", "recipients": ["user@company.com"],
+            "date": (datetime(2024, 1, 1) + timedelta(minutes=i)).isoformat(),
+            "folder": email['folder'], "importance": email['importance']}
+
+
+def _torn(email: EmailDocument) -> bool:
+    """Whether a returned email mixes fields of different documents or versions"""
+    i = email.id.split("_")[1]
+    return f"marker{i}" not in email.body.split() or not email.subject.endswith(f"#{i}")
+
+
+def bench_concurrency(args):
+    # Readers search while writers add, upsert, delete and purge; every result is checked against the invariants
+    samples = generate_sample_emails()
+    queries = [email['subject'] for email in samples] + ["budget review", "team meeting"]
+    print(f"{'readers':>8} {'queries/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'writes/s':>9} {'gens':>6} "
+          f"{'errors':>7} {'torn':>5} {'deleted':>8} {'unseen':>7}")
+    for readers in args.readers:
+        with tempfile.TemporaryDirectory() as directory:
+            rag = OutlookRAGSystem(snapshot_dir=directory, embedder_backend="hashing", query_cache_size=0,
+                                   retrieval_mode=args.mode, group_commit_interval=0.01)
+            rag.add_emails([_marked_email(samples, i) for i in range(args.initial)])
+            # Deleted before the readers start and never added again: no search may return them
+            deleted = {f"email_{i}" for i in range(0, args.initial, 10)}
+            for email_id in deleted:
+                rag.delete_email(email_id)
+            counts = {"errors": 0, "torn": 0, "deleted": 0, "unseen": 0, "writes": 0}
+            counts_lock = threading.Lock()
+            stop = threading.Event()
+            latencies: List[List[float]] = [[] for _ in range(readers)]
+            first_generation = rag.get_stats()["search_generation"]
+
+            def count(key: str, amount: int = 1):
+                with counts_lock:
+                    counts[key] += amount
+
+            def read(latency: List[float], seed: int):
+                rng = np.random.default_rng(seed)
+                while not stop.is_set():
+                    query = queries[rng.integers(len(queries))]
+                    try:
+                        start = time.perf_counter()
+                        emails = rag.search_emails(query, top_k=args.top_k)
+                        latency.append((time.perf_counter() - start) * 1000)
+                    except Exception:
+                        count("errors")
+                        continue
+                    count("torn", sum(_torn(email) for email in emails))
+                    count("deleted", sum(email.id in deleted for email in emails))
+
+            def write(writer: int):
+                rng = np.random.default_rng(1000 + writer)
+                next_id, revision, rounds = args.initial + writer, 0, 0
+                while not stop.is_set():
+                    try:
+                        batch = [_marked_email(samples, i) for i in range(next_id, next_id + args.writers * args.batch, args.writers)]
+                        rag.add_emails(batch)
+                        # An acknowledged add is searchable at once
+                        for email in batch[:2]:
+                            found = rag.search_emails(email["body"].split()[-2], top_k=1, mode="keyword")
+                            count("unseen", not found or found[0].id != email["id"])
+                        next_id += args.writers * args.batch
+                        revision += 1
+                        target = int(rng.integers(args.initial))
+                        if f"email_{target}" not in deleted:
+                            rag.upsert_email(_marked_email(samples, target, revision))
+                        rag.delete_email(batch[0]["id"])
+                        rounds += 1
+                        if args.purge_every and writer == 0 and rounds % args.purge_every == 0:
+                            rag.purge_deleted()
+                        count("writes", len(batch) + 2)
+                    except Exception:
+                        count("errors")
+
+            threads = [threading.Thread(target=read, args=(latencies[r], r)) for r in range(readers)]
+            threads += [threading.Thread(target=write, args=(w,)) for w in range(args.writers)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            time.sleep(args.seconds)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            generations = rag.get_stats()["search_generation"] - first_generation
+            rag.close()
+        merged = [latency for reader in latencies for latency in reader]
+        p50, p99 = (np.percentile(merged, 50), np.percentile(merged, 99)) if merged else (0.0, 0.0)
+        print(f"{readers:>8} {len(merged) / elapsed:>10.1f} {p50:>8.2f} {p99:>8.2f} {counts['writes'] / elapsed:>9.1f} "
+              f"{generations:>6} {counts['errors']:>7} {counts['torn']:>5} {counts['deleted']:>8} {counts['unseen']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OutlookLLM RAG benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    search = subparsers.add_parser('search', help="Brute-force search latency per corpus size")
+    search.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    search.add_argument('--dim', type=int, default=384)
+    search.add_argument('--queries', type=int, default=50)
+    search.add_argument('--top_k', type=int, default=5)
+    search.add_argument('--legacy_max_rows', type=int, default=100_000,
+                        help="Also time the original Python loop up to this many rows")
+    search.set_defaults(func=bench_search)
+
+    snapshot = subparsers.add_parser('snapshot', help="Snapshot write time and memory-mapped open time")
+    snapshot.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    snapshot.add_argument('--dim', type=int, default=384)
+    snapshot.add_argument('--top_k', type=int, default=5)
+    snapshot.set_defaults(func=bench_snapshot)
+
+    ann = subparsers.add_parser('ann', help="IVF recall@k and latency against the exact scan")
+    ann.add_argument('--rows', type=int, default=1_000_000)
+    ann.add_argument('--dim', type=int, default=384)
+    ann.add_argument('--clusters', type=int, default=2000, help="Clusters in the synthetic corpus")
+    ann.add_argument('--spread', type=float, default=1.0, help="Within-cluster noise; higher is harder")
+    ann.add_argument('--nlist', type=int, default=None, help="Inverted lists (default ~4*sqrt(rows))")
+    ann.add_argument('--nprobe', type=int, nargs='+', default=[4, 8, 16, 32])
+    ann.add_argument('--queries', type=int, default=200)
+    ann.add_argument('--top_k', type=int, default=10)
+    ann.set_defaults(func=bench_ann)
+
+    quantized = subparsers.add_parser('quantized', help="Memory and recall@k of float16/int8 storage with exact re-ranking")
+    quantized.add_argument('--rows', type=int, default=1_000_000)
+    quantized.add_argument('--dim', type=int, default=384)
+    quantized.add_argument('--clusters', type=int, default=2000, help="Clusters in the synthetic corpus")
+    quantized.add_argument('--spread', type=float, default=1.0, help="Within-cluster noise; higher is harder")
+    quantized.add_argument('--rerank_factor', type=int, nargs='+', default=[2, 4, 8],
+                           help="Candidates re-ranked exactly per requested result")
+    quantized.add_argument('--queries', type=int, default=200)
+    quantized.add_argument('--top_k', type=int, default=10)
+    quantized.set_defaults(func=bench_quantized)
+
+    embedders = subparsers.add_parser('embedders', help="Embeddings/sec of every embedding backend on the same corpus")
+    embedders.add_argument('--backends', nargs='+', default=["hashing", "transformers", "onnx"],
+                           choices=[backend for backend in EMBEDDER_BACKENDS if backend != "auto"])
+    embedders.add_argument('--model', type=str, default=DEFAULT_EMBEDDING_MODEL)
+    embedders.add_argument('--texts', type=int, default=2000)
+    embedders.add_argument('--batch_size', type=int, default=32)
+    embedders.add_argument('--threads', type=int, nargs='+', default=[0],
+                           help="Intra-op threads of the onnx backend, 0 for ONNX Runtime's default")
+    embedders.add_argument('--onnx_float', action='store_true', help="Also time the unquantized ONNX export")
+    embedders.set_defaults(func=bench_embedders)
+
+    documents = subparsers.add_parser('documents', help="Memory per email of dataclass objects against the columnar store")
+    documents.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    documents.add_argument('--correspondents', type=int, default=500, help="Distinct sender/recipient addresses")
+    documents.add_argument('--top_k', type=int, default=10)
+    documents.add_argument('--queries', type=int, default=200)
+    documents.set_defaults(func=bench_documents)
+
+    concurrency = subparsers.add_parser('concurrency', help="Search latency and consistency under concurrent ingestion, deletes and purges")
+    concurrency.add_argument('--readers', type=int, nargs='+', default=[1, 4, 16])
+    concurrency.add_argument('--writers', type=int, default=1)
+    concurrency.add_argument('--initial', type=int, default=2000, help="Emails indexed before the run")
+    concurrency.add_argument('--batch', type=int, default=8, help="Emails added per write")
+    concurrency.add_argument('--purge_every', type=int, default=50, help="Writes between purges, 0 to never purge")
+    concurrency.add_argument('--seconds', type=float, default=10.0)
+    concurrency.add_argument('--mode', type=str, default="hybrid", choices=OutlookRAGSystem.RETRIEVAL_MODES)
+    concurrency.add_argument('--top_k', type=int, default=10)
+    concurrency.set_defaults(func=bench_concurrency)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
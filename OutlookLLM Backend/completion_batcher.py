@@ -0,0 +1,148 @@
+"""
+Request batching for the OutlookLLM completion engine
+Concurrent completion requests wait a few milliseconds in a queue; one worker thread
+runs the requests that arrived together as a single batched decode and hands every
+request its own output, so the GPU serves N users in about the time of one
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+# generate(requests) -> one result per request, in order
+BatchGenerator = Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]
+
+
+def padded_tokens(requests: List[Dict[str, Any]]) -> int:
+    """Token slots a batch occupies once every sequence is padded to the longest input and output"""
+    if not requests:
+        return 0
+    longest = max(len(request["input_ids"]) for request in requests) + max(request["max_new_tokens"] for request in requests)
+    return len(requests) * longest
+
+
+class CompletionBatcher:
+    """FIFO of tokenized completion requests decoded in batches by one worker thread
+
+    A request is a dict with input_ids, temperature and max_new_tokens. The worker
+    waits up to batch_window seconds for more requests, then takes the oldest one
+    and the queued requests with the same temperature behind it, up to max_batch
+    requests and token_budget padded tokens (a larger single request runs alone).
+    Each result gains queue_ms (waiting for a batch) and compute_ms (the batch itself).
+    """
+
+    def __init__(self, generate: BatchGenerator, max_batch: int = 8, batch_window: float = 0.01,
+                 token_budget: Optional[int] = None):
+        self.generate = generate
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.token_budget = token_budget
+        self._jobs: Deque[Dict[str, Any]] = deque()
+        self._condition = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._closed = False
+        self._batches = 0
+        self._batched_requests = 0
+        self._queue_ms = 0.0
+        self._compute_ms = 0.0
+        self._failed = 0
+
+    def submit(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a request and block until its batch has been decoded"""
+        job = {"request": request, "queued_at": time.perf_counter(), "done": threading.Event()}
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Completion batcher is closed")
+            self._jobs.append(job)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="completion-batcher", daemon=True)
+                self._worker.start()
+            self._condition.notify()
+        job["done"].wait()
+        if "error" in job:
+            raise job["error"]
+        return job["result"]
+
+    def _next_batch(self) -> Optional[List[Dict[str, Any]]]:
+        with self._condition:
+            while not self._jobs and not self._closed:
+                self._condition.wait()
+            if not self._jobs:
+                return None
+            if not self._closed and self.batch_window > 0:
+                # Let requests arriving together share one decode
+                self._condition.wait_for(lambda: self._closed or len(self._jobs) >= self.max_batch, timeout=self.batch_window)
+            batch = [self._jobs.popleft()]
+            temperature = batch[0]["request"]["temperature"]
+            skipped: List[Dict[str, Any]] = []
+            while self._jobs and len(batch) < self.max_batch:
+                job = self._jobs.popleft()
+                requests = [queued["request"] for queued in batch] + [job["request"]]
+                if job["request"]["temperature"] != temperature:
+                    skipped.append(job)
+                elif self.token_budget is not None and padded_tokens(requests) > self.token_budget:
+                    skipped.append(job)
+                    break
+                else:
+                    batch.append(job)
+            # Requests left behind keep their place at the front of the queue
+            self._jobs.extendleft(reversed(skipped))
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            try:
+                results = self.generate([job["request"] for job in batch])
+                error = None
+            except Exception as e:
+                logging.error(f"Error decoding a batch of {len(batch)} completions: {e}")
+                results, error = None, e
+            finished = time.perf_counter()
+
+            compute_ms = (finished - started) * 1000
+            with self._condition:
+                for position, job in enumerate(batch):
+                    queue_ms = (started - job["queued_at"]) * 1000
+                    if error is None:
+                        job["result"] = {**results[position], "queue_ms": queue_ms, "compute_ms": compute_ms,
+                                         "batch_size": len(batch)}
+                    else:
+                        job["error"] = error
+                        self._failed += 1
+                    self._queue_ms += queue_ms
+                self._batches += 1
+                self._batched_requests += len(batch)
+                self._compute_ms += compute_ms
+            for job in batch:
+                job["done"].set()
+
+    def close(self):
+        """Decode the queued requests and stop the worker"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            worker = self._worker
+        if worker is not None:
+            worker.join()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._condition:
+            requests = self._batched_requests
+            return {
+                "queued": len(self._jobs),
+                "batches": self._batches,
+                "requests": requests,
+                "max_batch": self.max_batch,
+                "batch_window_ms": round(self.batch_window * 1000, 1),
+                "token_budget": self.token_budget,
+                "mean_batch_size": round(requests / self._batches, 2) if self._batches else 0.0,
+                "mean_queue_ms": round(self._queue_ms / requests, 2) if requests else 0.0,
+                "mean_compute_ms": round(self._compute_ms / self._batches, 2) if self._batches else 0.0,
+                "failed_requests": self._failed
+            }
@@ -0,0 +1,57 @@
+"""
+Shared fixtures of the OutlookLLM backend tests
+RAG systems run on the hashing embedder, so no model is downloaded or loaded
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+import pytest
+
+from outlook_rag import OutlookRAGSystem
+
+
+def _email(number: int, **fields: Any) -> Dict[str, Any]:
+    email = {
+        "id": f"email-{number}",
+        "subject": f"Project topic{number} update",
+        "body": f"Status of workstream{number}: the numbers for topic{number} are ready for review.",
+        "sender": f"sender{number % 3}@company.com",
+        "recipients": ["me@company.com"],
+        "date": (datetime(2024, 3, 1, 9) + timedelta(hours=7 * number)).isoformat(),
+        "folder": "Inbox",
+        "importance": "Normal"
+    }
+    email.update(fields)
+    return email
+
+
+@pytest.fixture
+def make_email():
+    """make_email(number, **fields): an email whose subject and body name topic<number> and workstream<number>"""
+    return _email
+
+
+@pytest.fixture
+def open_rag(tmp_path):
+    """open_rag(**options): a RAG system on tmp_path, closed at the end of the test unless closed before
+
+    Every journal record is fsynced as it is appended, so a closed system leaves its whole journal on disk.
+    """
+    systems = []
+
+    def open_system(**options: Any) -> OutlookRAGSystem:
+        settings = {"embedder_backend": "hashing", "query_cache_size": 0, "group_commit_records": 1,
+                    "group_commit_interval": 0, **options}
+        system = OutlookRAGSystem(snapshot_dir=str(tmp_path), **settings)
+        systems.append(system)
+        return system
+
+    yield open_system
+    for system in systems:
+        system.close()
+
+
+@pytest.fixture
+def rag(open_rag):
+    return open_rag()
@@ -0,0 +1,116 @@
+"""
+Content-addressed embedding lookup for the OutlookLLM RAG system
+Maps sha256(embedding text) to a row that already holds its vector, so byte-identical
+texts (re-synced, forwarded or CC'd messages) are never embedded twice
+"""
+
+import hashlib
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+# Raw 32 bytes: numpy's 'S32' strips trailing NUL bytes on read, so 1 in 256 digests came back short
+DIGEST_DTYPE = np.dtype((np.void, 32))
+# Digest of the rows whose text is not known
+EMPTY_DIGEST = bytes(DIGEST_DTYPE.itemsize)
+
+
+def content_digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+def digest_array(digests: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """Digests as DIGEST_DTYPE; 'S32' arrays of older snapshots hold the same bytes and are viewed as it"""
+    if digests is None or digests.dtype == DIGEST_DTYPE:
+        return digests
+    return np.ascontiguousarray(digests).view(DIGEST_DTYPE)
+
+
+class ContentStore:
+    """Per-corpus, row-aligned digests plus a digest -> (corpus, row) map
+
+    Vectors are not duplicated: a hit points at the corpus row that already stores
+    the embedding. The store belongs to one embedding model; rows of a snapshot built
+    with another model are never registered. The map is built lazily from the
+    row-aligned digests, so opening a large snapshot stays cheap.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+        self._digests: Dict[str, np.ndarray] = {}
+        self._sizes: Dict[str, int] = {}
+        self._rows: Optional[Dict[bytes, Tuple[str, int]]] = None
+        self._lock = threading.Lock()
+
+    def attach(self, corpus: str, digests: Optional[np.ndarray], rows: int):
+        """Register the digests of a corpus' first `rows` rows (unknown digests may be empty)"""
+        with self._lock:
+            array = np.zeros(max(rows, 16), dtype=DIGEST_DTYPE)
+            if digests is not None:
+                digests = digest_array(digests)[:rows]
+                array[:digests.shape[0]] = digests
+            self._digests[corpus] = array
+            self._sizes[corpus] = rows
+            self._rows = None
+
+    def _index(self) -> Dict[bytes, Tuple[str, int]]:
+        if self._rows is None:
+            rows = {}
+            for corpus, digests in self._digests.items():
+                for row, digest in enumerate(digests[:self._sizes[corpus]].tolist()):
+                    if digest != EMPTY_DIGEST:
+                        rows.setdefault(digest, (corpus, row))
+            self._rows = rows
+        return self._rows
+
+    def lookup(self, digests: Iterable[bytes]) -> List[Optional[Tuple[str, int]]]:
+        """(corpus, row) holding each digest's vector, or None; every digest counts as a hit or miss"""
+        with self._lock:
+            index = self._index()
+            found = [index.get(digest) for digest in digests]
+            hits = sum(location is not None for location in found)
+            self.hits += hits
+            self.misses += len(found) - hits
+            return found
+
+    def add(self, corpus: str, rows: np.ndarray, digests: List[bytes]):
+        """Record the digests of rows that were just appended to a corpus"""
+        with self._lock:
+            array = self._digests.setdefault(corpus, np.zeros(16, dtype=DIGEST_DTYPE))
+            end = int(rows[-1]) + 1 if len(rows) else self._sizes.get(corpus, 0)
+            if end > array.shape[0]:
+                grown = np.zeros(max(2 * array.shape[0], end), dtype=DIGEST_DTYPE)
+                grown[:array.shape[0]] = array
+                self._digests[corpus] = array = grown
+            array[rows] = digests
+            self._sizes[corpus] = max(self._sizes.get(corpus, 0), end)
+            if self._rows is not None:
+                for row, digest in zip(rows.tolist(), digests):
+                    self._rows.setdefault(digest, (corpus, row))
+
+    def matches(self, corpus: str, rows: np.ndarray, digests: List[bytes]) -> bool:
+        """Whether the given rows of a corpus hold exactly these digests, in order"""
+        with self._lock:
+            array = self._digests.get(corpus)
+            if array is None or len(rows) != len(digests):
+                return False
+            return bool(np.array_equal(array[np.asarray(rows, dtype=np.int64)], np.array(digests, dtype=DIGEST_DTYPE)))
+
+    def state(self, corpus: str, rows: int) -> np.ndarray:
+        """Row-aligned digests of a corpus' first `rows` rows, for the snapshot"""
+        with self._lock:
+            array = self._digests.get(corpus, np.zeros(0, dtype=DIGEST_DTYPE))
+            out = np.zeros(rows, dtype=DIGEST_DTYPE)
+            out[:min(rows, array.shape[0])] = array[:rows]
+            return out
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "rows": dict(self._sizes)
+        }
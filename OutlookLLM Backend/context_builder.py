@@ -0,0 +1,192 @@
+"""
+Token-budgeted prompt context for the OutlookLLM RAG system
+Ranked hits are packed into the context in score order until a token budget, counted
+with the serving model's tokenizer, is spent; near-identical passages (quoted replies,
+forwards) are packed once, while every hit keeps its header
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from keyword_index import tokenize
+from passages import word_spans
+
+# Characters per token of the fallback estimate, about right for English and Llama-style tokenizers
+CHARS_PER_TOKEN = 4
+
+
+def approximate_tokens(text: str) -> int:
+    """Token count estimate used when no tokenizer is loaded"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def token_counter(tokenizer: Any = None) -> Callable[[str], int]:
+    """Function counting the tokens of a text with a Hugging Face tokenizer (the estimate without one)"""
+    if tokenizer is None:
+        return approximate_tokens
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False)) if text else 0
+
+
+def shingles(text: str, size: int = 3) -> Set[Tuple[str, ...]]:
+    """Word n-grams of a text; texts shorter than `size` words give their single n-gram"""
+    words = tokenize(text)
+    if len(words) <= size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def similarity(first: Set[Tuple[str, ...]], second: Set[Tuple[str, ...]]) -> float:
+    """Jaccard similarity of two shingle sets"""
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+@dataclass
+class ContextSource:
+    """One ranked hit: a header (sender, subject, date...) and its passages, best first"""
+    id: str
+    header: str
+    passages: List[str]
+    # Length of the full body, so a passage shorter than it is marked as an excerpt
+    body_length: int = 0
+    label: str = "Body"
+
+
+@dataclass
+class PackedSource:
+    source: ContextSource
+    passages: List[str] = field(default_factory=list)
+    lines: List[str] = field(default_factory=list)
+    tokens: int = 0
+    truncated: bool = False
+    # Passages skipped as near-duplicates, and for a source with no text of its own the entry holding it
+    duplicates: List[str] = field(default_factory=list)
+    duplicate_of: Optional["PackedSource"] = None
+
+
+class ContextBuilder:
+    """Packs ranked sources into at most budget_tokens tokens of context
+
+    The first pass takes every source's best passage in score order; what budget is
+    left goes to further passages of the same sources, again in score order. A
+    passage that does not fit whole is cut at a word boundary if at least
+    min_passage_tokens of it fit, and packing stops there. A passage whose word
+    3-grams overlap an already packed one by dedupe_threshold (Jaccard) or more is
+    skipped; only the text is deduplicated, so a source whose passages were all
+    skipped (four "Thanks, see attached." mails) is still packed with its header and
+    a line pointing at the entry that holds the text.
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int] = approximate_tokens, budget_tokens: int = 1024,
+                 dedupe_threshold: float = 0.85, min_passage_tokens: int = 24):
+        self.count_tokens = count_tokens
+        self.budget_tokens = budget_tokens
+        self.dedupe_threshold = dedupe_threshold
+        self.min_passage_tokens = min_passage_tokens
+
+    def _truncate(self, text: str, tokens: int) -> str:
+        """Longest word-aligned prefix of text within `tokens` tokens (binary search on the word count)"""
+        spans = word_spans(text)
+        low, high = 0, len(spans)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(text[:spans[middle - 1][1]]) <= tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:spans[low - 1][1]] if low else ""
+
+    @staticmethod
+    def _line(source: ContextSource, passage: str, cut: bool = False) -> str:
+        excerpt = cut or len(passage) < source.body_length
+        return f"{source.label}: {passage}{'...' if excerpt else ''}\n"
+
+    def build(self, title: str, sources: Sequence[ContextSource], entry_name: str = "Item") -> Tuple[str, Dict[str, Any]]:
+        """(context, report) where the report lists the tokens spent on every packed source"""
+        used = self.count_tokens(title)
+        packed: List[PackedSource] = []
+        seen: List[Tuple[Set[Tuple[str, ...]], PackedSource]] = []
+        duplicates = 0
+        full = False
+
+        def add(entry: PackedSource, passage: str, header_tokens: int) -> bool:
+            """Pack one passage (and the header with the first one); False once the budget is spent"""
+            nonlocal used, duplicates, full
+            passage_shingles = shingles(passage)
+            original = next((owner for other, owner in seen if similarity(passage_shingles, other) >= self.dedupe_threshold), None)
+            if original is not None:
+                duplicates += 1
+                entry.duplicates.append(passage)
+                if not entry.passages:
+                    entry.duplicate_of = entry.duplicate_of or original
+                return True
+            line = self._line(entry.source, passage)
+            tokens = header_tokens + self.count_tokens(line)
+            if used + tokens > self.budget_tokens:
+                room = self.budget_tokens - used - header_tokens - self.count_tokens(self._line(entry.source, "", cut=True))
+                passage = self._truncate(passage, room) if room >= self.min_passage_tokens else ""
+                full = True
+                if not passage:
+                    return False
+                line = self._line(entry.source, passage, cut=True)
+                tokens = header_tokens + self.count_tokens(line)
+                entry.truncated = True
+            entry.passages.append(passage)
+            entry.lines.append(line)
+            entry.tokens += tokens
+            used += tokens
+            seen.append((passage_shingles, entry))
+            return not full
+
+        # First pass: the best passage of every source, in score order
+        for source in sources:
+            entry = PackedSource(source)
+            # The header and the blank line closing the entry are paid with its first passage
+            header_tokens = self.count_tokens(f"{entry_name} {len(packed) + 1}:\n{source.header}\n")
+            if used + header_tokens > self.budget_tokens:
+                full = True
+                break
+            for passage in source.passages:
+                keep_going = add(entry, passage, header_tokens)
+                if entry.passages or not keep_going:
+                    break
+            if not entry.passages and not full:
+                # Every passage repeats packed text (or there is none): the header alone still tells the hits apart
+                line = f"{source.label}: same as {entry_name} {packed.index(entry.duplicate_of) + 1}\n" if entry.duplicate_of else ""
+                tokens = header_tokens + self.count_tokens(line)
+                if used + tokens > self.budget_tokens:
+                    full = True
+                    break
+                if line:
+                    entry.lines.append(line)
+                entry.tokens += tokens
+                used += tokens
+            if entry.passages or not full:
+                packed.append(entry)
+            if full:
+                break
+        # Second pass: further passages of the packed sources while budget remains
+        for entry in packed:
+            if full:
+                break
+            for passage in entry.source.passages:
+                if full:
+                    break
+                if passage not in entry.passages and passage not in entry.duplicates:
+                    add(entry, passage, 0)
+
+        context = title
+        for number, entry in enumerate(packed, 1):
+            context += f"{entry_name} {number}:\n{entry.source.header}" + "".join(entry.lines) + "\n"
+        report = {
+            "budget_tokens": self.budget_tokens,
+            "used_tokens": used,
+            "duplicates_skipped": duplicates,
+            "sources": [
+                {"id": entry.source.id, "tokens": entry.tokens, "passages": len(entry.passages), "truncated": entry.truncated,
+                 "duplicate_of": entry.duplicate_of.source.id if entry.duplicate_of is not None else None}
+                for entry in packed
+            ]
+        }
+        return context, report
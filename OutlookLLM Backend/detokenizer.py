@@ -0,0 +1,50 @@
+"""
+Incremental detokenization for streamed completions
+Each streamed token is turned into text by decoding a few tokens around it instead of
+the whole output so far, so the cost per token stays the same however long the
+completion gets
+"""
+
+from typing import Any, List, Sequence
+
+# What a tokenizer decodes a byte sequence cut inside a UTF-8 character to
+REPLACEMENT_CHARACTER = "\ufffd"
+
+
+class IncrementalDetokenizer:
+    """Text deltas of a growing token sequence, equal in sum to decoding it whole
+
+    A window decoded on its own differs from the whole sequence at its edges:
+    sentencepiece drops the leading space of the window's first token, and a
+    character spread over byte tokens decodes as U+FFFD until its last byte
+    arrives. So every step decodes the window from the start of the last emitted
+    chunk with and without the unread tokens and emits the difference, and text
+    ending in U+FFFD is held back until the character is complete.
+    """
+
+    def __init__(self, tokenizer: Any):
+        self.tokenizer = tokenizer
+        self.ids: List[int] = []
+        # ids[prefix_offset:read_offset] is the last chunk emitted, ids[read_offset:] is not emitted yet
+        self._prefix_offset = 0
+        self._read_offset = 0
+
+    def _decode(self, ids: List[int]) -> str:
+        return self.tokenizer.decode(ids) if ids else ""
+
+    def add(self, ids: Sequence[int]) -> str:
+        """Append generated token ids; returns the text they complete ("" while a character is incomplete)"""
+        self.ids.extend(ids)
+        emitted = self._decode(self.ids[self._prefix_offset:self._read_offset])
+        text = self._decode(self.ids[self._prefix_offset:])
+        if len(text) <= len(emitted) or text.endswith(REPLACEMENT_CHARACTER):
+            return ""
+        self._prefix_offset, self._read_offset = self._read_offset, len(self.ids)
+        return text[len(emitted):]
+
+    def flush(self) -> str:
+        """Text still held back at the end of the sequence, even if it ends in an incomplete character"""
+        emitted = self._decode(self.ids[self._prefix_offset:self._read_offset])
+        text = self._decode(self.ids[self._prefix_offset:])
+        self._prefix_offset = self._read_offset = len(self.ids)
+        return text[len(emitted):]
@@ -0,0 +1,184 @@
+"""
+Document ids and tombstones for the OutlookLLM RAG system
+Maps every live document id to its corpus position and marks replaced or deleted
+positions dead, so upserts and deletes cost O(1) and searches can skip the dead rows
+"""
+
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+
+from embedding_snapshot import pack_strings, unpack_strings
+
+
+class LiveView:
+    """Tombstones of a DocumentIds as of one moment; later deletes do not change it"""
+
+    def __init__(self, deleted: np.ndarray, documents: int, deleted_documents: int, deleted_rows: int):
+        self._deleted = deleted
+        self.documents = documents
+        self.deleted_documents = deleted_documents
+        self.deleted_rows = deleted_rows
+
+    def live(self, positions: np.ndarray) -> np.ndarray:
+        """The given positions without the tombstoned ones"""
+        positions = np.asarray(positions, dtype=np.int64)
+        if not self.deleted_documents:
+            return positions
+        return positions[~self._deleted[positions]]
+
+    def live_mask(self, size: Optional[int] = None) -> Optional[np.ndarray]:
+        """Boolean mask of live positions, None while nothing is tombstoned"""
+        if not self.deleted_documents:
+            return None
+        return ~self._deleted[:self.documents if size is None else size]
+
+
+class DocumentIds:
+    """id -> live position, plus a tombstone flag and the row count of every position
+
+    Documents are never removed in place: an upsert appends the new version and
+    tombstones the old position, a delete only tombstones. Tombstoned positions keep
+    their rows until OutlookRAGSystem.purge_deleted() rebuilds the corpus without them.
+    """
+
+    def __init__(self):
+        self._positions: Dict[str, int] = {}
+        self._ids: List[str] = []
+        self._deleted = np.zeros(16, dtype=bool)
+        self._row_counts = np.zeros(16, dtype=np.int64)
+        self.deleted_documents = 0
+        self.deleted_rows = 0
+        # Set once a LiveView shares the tombstone flags; the next tombstone copies them first
+        self._shared = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def live_documents(self) -> int:
+        return len(self._ids) - self.deleted_documents
+
+    def _reserve(self, size: int):
+        if size <= self._deleted.shape[0]:
+            return
+        capacity = max(2 * self._deleted.shape[0], size)
+        deleted = np.zeros(capacity, dtype=bool)
+        row_counts = np.zeros(capacity, dtype=np.int64)
+        deleted[:len(self._ids)] = self._deleted[:len(self._ids)]
+        row_counts[:len(self._ids)] = self._row_counts[:len(self._ids)]
+        self._deleted, self._row_counts = deleted, row_counts
+        self._shared = False
+
+    def _tombstone_locked(self, position: int) -> bool:
+        if self._deleted[position]:
+            return False
+        if self._shared:
+            self._deleted, self._shared = self._deleted.copy(), False
+        self._deleted[position] = True
+        self.deleted_documents += 1
+        self.deleted_rows += int(self._row_counts[position])
+        if self._positions.get(self._ids[position]) == position:
+            del self._positions[self._ids[position]]
+        return True
+
+    def add(self, first_position: int, ids: Sequence[str], row_counts: Sequence[int]) -> List[int]:
+        """Register documents appended at first_position; returns the positions of the versions they replace"""
+        with self._lock:
+            if first_position != len(self._ids):
+                raise ValueError(f"Documents appended at position {first_position}, expected {len(self._ids)}")
+            end = first_position + len(ids)
+            self._reserve(end)
+            self._row_counts[first_position:end] = row_counts
+            replaced = []
+            for position, document_id in enumerate(ids, first_position):
+                self._ids.append(document_id)
+                previous = self._positions.get(document_id)
+                if previous is not None and self._tombstone_locked(previous):
+                    replaced.append(previous)
+                self._positions[document_id] = position
+            return replaced
+
+    def delete(self, document_id: str) -> Optional[int]:
+        """Tombstone the live version of a document; returns its position, None for an unknown id"""
+        with self._lock:
+            position = self._positions.get(document_id)
+            if position is not None:
+                self._tombstone_locked(position)
+            return position
+
+    def tombstone(self, position: int) -> bool:
+        """Tombstone a position directly; False if it already was"""
+        with self._lock:
+            return self._tombstone_locked(position)
+
+    def view(self) -> LiveView:
+        """Tombstones as of now, for a searchable generation (copy-on-write: later deletes copy the flags)"""
+        with self._lock:
+            self._shared = True
+            return LiveView(self._deleted, len(self._ids), self.deleted_documents, self.deleted_rows)
+
+    def live_ids(self) -> List[str]:
+        """Ids of the live documents in position order"""
+        with self._lock:
+            return [document_id for position, document_id in enumerate(self._ids) if not self._deleted[position]]
+
+    def position(self, document_id: str) -> Optional[int]:
+        """Position of the live version of a document"""
+        return self._positions.get(document_id)
+
+    def live(self, positions: np.ndarray) -> np.ndarray:
+        """The given positions without the tombstoned ones"""
+        positions = np.asarray(positions, dtype=np.int64)
+        if not self.deleted_documents:
+            return positions
+        return positions[~self._deleted[positions]]
+
+    def live_mask(self, size: Optional[int] = None) -> Optional[np.ndarray]:
+        """Boolean mask of live positions, None while nothing is tombstoned"""
+        if not self.deleted_documents:
+            return None
+        size = len(self._ids) if size is None else size
+        return ~self._deleted[:size]
+
+    def deleted_mask(self, size: Optional[int] = None) -> np.ndarray:
+        """Copy of the tombstone flags of the first `size` positions"""
+        with self._lock:
+            size = len(self._ids) if size is None else size
+            return self._deleted[:size].copy()
+
+    def state(self, documents: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Arrays to persist next to a snapshot holding the first `documents` documents"""
+        with self._lock:
+            documents = len(self._ids) if documents is None else documents
+            data, offsets = pack_strings(self._ids[:documents])
+            return {
+                "data": data,
+                "offsets": offsets,
+                "deleted": self._deleted[:documents].copy(),
+                "row_counts": self._row_counts[:documents].copy()
+            }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "DocumentIds":
+        ids = unpack_strings(state["data"], state["offsets"])
+        document_ids = cls.from_ids(ids, np.asarray(state["row_counts"]))
+        for position in np.flatnonzero(np.asarray(state["deleted"])).tolist():
+            document_ids.tombstone(position)
+        return document_ids
+
+    @classmethod
+    def from_ids(cls, ids: Sequence[str], row_counts: Sequence[int]) -> "DocumentIds":
+        """Map built from the ids of every position (later duplicates tombstone earlier ones)"""
+        document_ids = cls()
+        document_ids.add(0, ids, row_counts)
+        return document_ids
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "documents": len(self._ids),
+            "live_documents": self.live_documents,
+            "deleted_documents": self.deleted_documents,
+            "deleted_rows": self.deleted_rows
+        }
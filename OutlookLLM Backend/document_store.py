@@ -0,0 +1,198 @@
+"""
+Columnar document storage for the OutlookLLM RAG system
+Documents are kept as parallel arrays instead of one Python object each: UTF-8 text
+columns with offsets, repeated strings (senders, folders, addresses) interned as int32
+codes, timestamps as int64 epoch microseconds and string lists as offset-encoded
+codes; a document object is only built when a position is read
+"""
+
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Tuple
+import numpy as np
+
+# Column kinds a document class lists in its COLUMNS
+TEXT = "text"
+INTERNED = "interned"
+INTERNED_LIST = "interned_list"
+TIMESTAMP = "timestamp"
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+# UTC offset stored for a naive datetime
+NAIVE = np.iinfo(np.int32).min
+
+
+def encode_datetime(value: datetime) -> Tuple[int, int]:
+    """(epoch microseconds, UTC offset seconds or NAIVE); aware values count from the UTC epoch"""
+    offset = value.utcoffset()
+    if offset is None:
+        return (value - EPOCH) // MICROSECOND, NAIVE
+    return (value.replace(tzinfo=None) - offset - EPOCH) // MICROSECOND, int(offset.total_seconds())
+
+
+def decode_datetime(microseconds: int, offset: int) -> datetime:
+    moment = EPOCH + timedelta(microseconds=microseconds)
+    if offset == NAIVE:
+        return moment
+    return (moment + timedelta(seconds=offset)).replace(tzinfo=timezone(timedelta(seconds=offset)))
+
+
+class StringPool:
+    """Every distinct string once, addressed by an int32 code"""
+
+    def __init__(self):
+        self._codes: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def code(self, value: str) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    @property
+    def nbytes(self) -> int:
+        return sys.getsizeof(self._codes) + sys.getsizeof(self.values) + sum(sys.getsizeof(value) for value in self.values)
+
+
+class GrowableArray:
+    """Append-only 1-D array that doubles its capacity
+
+    A grown array is copied before it replaces the old one, so readers of positions
+    below the size they saw never see a partial write.
+    """
+
+    def __init__(self, dtype: Any, capacity: int = 16):
+        self._data = np.zeros(capacity, dtype=dtype)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def extend(self, values: Iterable[Any]):
+        values = np.asarray(values if isinstance(values, np.ndarray) else list(values), dtype=self._data.dtype)
+        end = self._size + len(values)
+        if end > self._data.shape[0]:
+            grown = np.zeros(max(2 * self._data.shape[0], end), dtype=self._data.dtype)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size:end] = values
+        self._size = end
+
+    def append(self, value: Any):
+        self.extend((value,))
+
+    def __getitem__(self, position):
+        return self._data[:self._size][position]
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes
+
+
+class TextColumn:
+    """Strings stored as one UTF-8 buffer plus end offsets"""
+
+    def __init__(self):
+        self._data = bytearray()
+        self._ends = GrowableArray(np.int64)
+
+    def append(self, value: str):
+        self._data += value.encode('utf-8')
+        self._ends.append(len(self._data))
+
+    def __getitem__(self, position: int) -> str:
+        start = int(self._ends[position - 1]) if position else 0
+        return self._data[start:int(self._ends[position])].decode('utf-8')
+
+    @property
+    def nbytes(self) -> int:
+        return sys.getsizeof(self._data) + self._ends.nbytes
+
+
+class DocumentColumns:
+    """Append-only columnar store of one document class
+
+    The class lists its stored fields in COLUMNS ({field: kind}); fields missing from
+    it (the legacy per-document embedding) are not stored and read back as their
+    default. Interned fields of all kinds share one pool, so an address that is a
+    sender of one email and a recipient of another is stored once.
+    """
+
+    def __init__(self, document_type: type):
+        self.document_type = document_type
+        self.columns: Dict[str, str] = document_type.COLUMNS
+        self._pool = StringPool()
+        self._text = {name: TextColumn() for name, kind in self.columns.items() if kind == TEXT}
+        self._codes = {name: GrowableArray(np.int32) for name, kind in self.columns.items() if kind == INTERNED}
+        self._lists = {name: (GrowableArray(np.int32), GrowableArray(np.int64))
+                       for name, kind in self.columns.items() if kind == INTERNED_LIST}
+        self._times = {name: (GrowableArray(np.int64), GrowableArray(np.int32))
+                       for name, kind in self.columns.items() if kind == TIMESTAMP}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, document: Any):
+        with self._lock:
+            for name, column in self._text.items():
+                column.append(getattr(document, name))
+            for name, codes in self._codes.items():
+                codes.append(self._pool.code(getattr(document, name)))
+            for name, (codes, ends) in self._lists.items():
+                values = getattr(document, name)
+                codes.extend(self._pool.code(value) for value in ([values] if isinstance(values, str) else values))
+                ends.append(len(codes))
+            for name, (microseconds, offsets) in self._times.items():
+                value, offset = encode_datetime(getattr(document, name))
+                microseconds.append(value)
+                offsets.append(offset)
+            # Bumped last: readers only look below the size
+            self._size += 1
+
+    def extend(self, documents: Iterable[Any]):
+        for document in documents:
+            self.append(document)
+
+    def __getitem__(self, position: int) -> Any:
+        if position < 0:
+            position += self._size
+        if not 0 <= position < self._size:
+            raise IndexError("document position out of range")
+        values: Dict[str, Any] = {}
+        pool = self._pool.values
+        for name, column in self._text.items():
+            values[name] = column[position]
+        for name, codes in self._codes.items():
+            values[name] = pool[int(codes[position])]
+        for name, (codes, ends) in self._lists.items():
+            start = int(ends[position - 1]) if position else 0
+            values[name] = [pool[code] for code in codes[start:int(ends[position])].tolist()]
+        for name, (microseconds, offsets) in self._times.items():
+            values[name] = decode_datetime(int(microseconds[position]), int(offsets[position]))
+        return self.document_type(**values)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the columns and the string pool"""
+        total = self._pool.nbytes + sum(column.nbytes for column in self._text.values())
+        total += sum(codes.nbytes for codes in self._codes.values())
+        total += sum(codes.nbytes + ends.nbytes for codes, ends in self._lists.values())
+        total += sum(microseconds.nbytes + offsets.nbytes for microseconds, offsets in self._times.values())
+        return total
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "documents": self._size,
+            "interned_strings": len(self._pool),
+            "bytes": self.nbytes,
+            "bytes_per_document": round(self.nbytes / self._size, 1) if self._size else 0.0
+        }
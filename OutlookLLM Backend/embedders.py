@@ -0,0 +1,228 @@
+"""
+Embedding backends for the OutlookLLM RAG system
+Every backend turns a list of texts into a float32 matrix with one row per text; the RAG
+system picks one by name (embedder_backend) and shares it between its shards
+"""
+
+import os
+import hashlib
+import logging
+import importlib.util
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+from keyword_index import tokenize
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# "auto" is SentenceTransformer when installed, else plain transformers
+EMBEDDER_BACKENDS = ("auto", "sentence_transformers", "transformers", "onnx", "hashing")
+
+
+def _mean_pool(hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Mean of the token vectors over real (unpadded) tokens"""
+    mask = mask[..., None].astype(np.float32)
+    return ((hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1)).astype(np.float32)
+
+
+class Embedder(ABC):
+    """Interface of an embedding backend
+
+    encode(texts, batch_size) returns a float32 (len(texts), dim) matrix. `tokenizer` is
+    the Hugging Face tokenizer of the model (None without one); long bodies are split
+    into passages on its tokens.
+    """
+
+    backend = "base"
+    tokenizer: Any = None
+
+    @abstractmethod
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """float32 (len(texts), dim) matrix of the texts' vectors"""
+
+
+class SentenceTransformerEmbedder(Embedder):
+    backend = "sentence_transformers"
+
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL, device: Optional[str] = None):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device=device)
+        self.tokenizer = getattr(self.model, 'tokenizer', None)
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        return np.asarray(self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+
+
+class TransformersEmbedder(Embedder):
+    """Eager PyTorch AutoModel with mean pooling over real tokens"""
+
+    backend = "transformers"
+
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL, max_length: int = 512):
+        from transformers import AutoTokenizer, AutoModel
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+        self.max_length = max_length
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        import torch
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(texts[start:start + batch_size], return_tensors='pt', truncation=True, padding=True,
+                                    max_length=self.max_length)
+            with torch.no_grad():
+                outputs = self.model(**inputs)
+            batches.append(_mean_pool(outputs.last_hidden_state.numpy(), inputs['attention_mask'].numpy()))
+        return np.concatenate(batches) if batches else np.empty((0, 0), dtype=np.float32)
+
+
+class OnnxEmbedder(Embedder):
+    """ONNX Runtime on CPU, by default with dynamically quantized int8 weights
+
+    The first start exports the transformer to ONNX under cache_dir (torch.onnx) and, with
+    quantize, writes an int8 copy of its weights (onnxruntime.quantization); later starts
+    load the cached file without importing torch. intra_op_threads caps the threads one
+    forward pass uses (None lets ONNX Runtime use every physical core).
+    """
+
+    backend = "onnx"
+
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL, quantize: bool = True,
+                 intra_op_threads: Optional[int] = None, max_length: int = 512, cache_dir: str = "onnx_models"):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.max_length = max_length
+        path = self.model_file(model_name, quantize, cache_dir)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self._input_names = [node.name for node in self.session.get_inputs()]
+        logging.info(f"Loaded ONNX embedder {path} (intra-op threads: {intra_op_threads or 'auto'})")
+
+    @classmethod
+    def model_file(cls, model_name: str, quantize: bool, cache_dir: str) -> str:
+        """Path of the (exported and quantized on first use) ONNX file of a model"""
+        directory = os.path.join(cache_dir, model_name.replace('/', '--'))
+        float_path = os.path.join(directory, "model.onnx")
+        int8_path = os.path.join(directory, "model.int8.onnx")
+        if not os.path.exists(float_path):
+            os.makedirs(directory, exist_ok=True)
+            cls._export(model_name, float_path)
+        if not quantize:
+            return float_path
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            temp_path = int8_path + ".tmp"
+            quantize_dynamic(float_path, temp_path, weight_type=QuantType.QInt8)
+            os.replace(temp_path, int8_path)
+            logging.info(f"Quantized {float_path} to int8")
+        return int8_path
+
+    @staticmethod
+    def _export(model_name: str, path: str):
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name).eval()
+        sample = tokenizer(["export sample"], return_tensors='pt')
+        names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+        axes = {name: {0: 'batch', 1: 'sequence'} for name in names + ['last_hidden_state']}
+        temp_path = path + ".tmp"
+        with torch.no_grad():
+            torch.onnx.export(model, tuple(sample[name] for name in names), temp_path, input_names=names,
+                              output_names=['last_hidden_state'], dynamic_axes=axes, opset_version=14)
+        os.replace(temp_path, path)
+        logging.info(f"Exported {model_name} to {path}")
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(texts[start:start + batch_size], return_tensors='np', truncation=True, padding=True,
+                                    max_length=self.max_length)
+            feed = {name: inputs[name].astype(np.int64) for name in self._input_names if name in inputs}
+            hidden = self.session.run(None, feed)[0]
+            batches.append(_mean_pool(hidden, inputs['attention_mask']))
+        return np.concatenate(batches) if batches else np.empty((0, 0), dtype=np.float32)
+
+
+@lru_cache(maxsize=200_000)
+def _hashed_feature(token: str, dim: int) -> Tuple[int, float]:
+    """(column, sign) of a token; blake2b rather than hash(), which is salted per process"""
+    value = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+    return value % dim, 1.0 if (value >> 63) else -1.0
+
+
+class HashingEmbedder(Embedder):
+    """Signed feature hashing of the keyword tokens: no model, no download, the same vectors everywhere
+
+    For tests and for benchmarking everything around the model; similarity is purely lexical.
+    """
+
+    backend = "hashing"
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            features = [_hashed_feature(token, self.dim) for token in tokenize(text)]
+            if features:
+                columns, signs = zip(*features)
+                np.add.at(vectors[row], list(columns), signs)
+        return vectors
+
+
+def available_backend(backend: str, options: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """(backend, options) that can load here for a configured backend and its options
+
+    "onnx" without onnxruntime installed falls back to "auto" without the ONNX options.
+    Resolve the backend before deriving its embedding_space, so the fallback's float
+    vectors are never stored as int8 ONNX ones.
+    """
+    if backend == "onnx" and importlib.util.find_spec("onnxruntime") is None:
+        logging.warning("onnxruntime is not installed, embedding with the auto backend instead of onnx")
+        return "auto", {}
+    return backend, options
+
+
+def create_embedder(backend: str = "auto", model_name: str = DEFAULT_EMBEDDING_MODEL, **options: Any) -> Embedder:
+    """Embedder for a backend name; options go to the backend's constructor"""
+    backend, options = available_backend(backend, options)
+    if backend == "auto":
+        try:
+            embedder = SentenceTransformerEmbedder(model_name, **options)
+        except ImportError:
+            embedder = TransformersEmbedder(model_name, **options)
+    elif backend == "sentence_transformers":
+        embedder = SentenceTransformerEmbedder(model_name, **options)
+    elif backend == "transformers":
+        embedder = TransformersEmbedder(model_name, **options)
+    elif backend == "onnx":
+        embedder = OnnxEmbedder(model_name, **options)
+    elif backend == "hashing":
+        embedder = HashingEmbedder(**options)
+    else:
+        raise ValueError(f"Unknown embedder backend {backend}, expected one of {EMBEDDER_BACKENDS}")
+    logging.info(f"Loaded {embedder.backend} embedder for {model_name if backend != 'hashing' else 'hashed tokens'}")
+    return embedder
+
+
+def embedding_space(backend: str, model_name: str, **options: Any) -> str:
+    """Identity of the vectors a backend produces, stored with snapshots and journals
+
+    The PyTorch backends and a float ONNX export of one model produce the same vectors
+    and share the model name; int8 and hashed vectors get their own, so they are never
+    mixed with float ones.
+    """
+    if backend == "hashing":
+        return f"hashing-{options.get('dim', 384)}"
+    if backend == "onnx" and options.get('quantize', True):
+        return f"{model_name}+int8"
+    return model_name
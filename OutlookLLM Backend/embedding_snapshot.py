@@ -0,0 +1,380 @@
+"""
+Memory-mapped embedding snapshots for the OutlookLLM RAG system
+
+A snapshot root directory holds versioned snapshot directories plus a CURRENT
+file naming the live one, so a new snapshot can be written while the previous
+one is still mapped by a running process. Each snapshot directory contains:
+
+    manifest.json          model name, dimension, row/document counts and checksums
+    <corpus>.npy           float32 matrix of L2-normalized rows, opened with mmap_mode='r'
+    <corpus>.owners.npy    document position of every matrix row
+    <corpus>.meta.jsonl    one compact JSON record per document (no embeddings)
+    <corpus>.offsets.npy   byte offset of every record, for lazy random access
+    <name>.npy             optional auxiliary arrays (e.g. ANN index state) listed in the manifest
+"""
+
+import os
+import sys
+import json
+import mmap
+import shutil
+import hashlib
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+from document_store import DocumentColumns
+from vector_index import VectorIndex
+
+SNAPSHOT_FORMAT_VERSION = 1
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+
+def sha256_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """Checksum a file without reading it into memory at once"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LazyDocuments(Sequence):
+    """Read-only documents of a snapshot, parsed from the metadata sidecar on access
+
+    The sidecar is memory-mapped too, so the mapping stays valid (and pages are only
+    read when touched) even after a newer snapshot replaces this one on disk.
+    """
+
+    def __init__(self, meta_path: str, offsets: np.ndarray, from_record: Callable[[Dict[str, Any]], Any]):
+        self.meta_path = meta_path
+        self._offsets = offsets
+        self._from_record = from_record
+        self._data = b''
+        if len(offsets):
+            with open(meta_path, 'rb') as f:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def raw_record(self, position: int) -> bytes:
+        """Serialized JSON record of one document"""
+        start = int(self._offsets[position])
+        end = self._data.find(b'\n', start)
+        return self._data[start:end if end != -1 else len(self._data)]
+
+    def record(self, position: int) -> Dict[str, Any]:
+        """Parsed JSON record of one document"""
+        return json.loads(self.raw_record(position))
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("document position out of range")
+        return self._from_record(self.record(position))
+
+
+class DocumentList(Sequence):
+    """Documents of one corpus: a lazily loaded snapshot base followed by documents added since
+
+    Added documents of a class listing its COLUMNS go to a DocumentColumns store and
+    are rebuilt when read; others are kept as they are.
+    """
+
+    def __init__(self, base: Sequence = ()):
+        self._base = base
+        self._added: Any = None
+        # Size of a frozen copy, which shares the added documents of its source
+        self._frozen_size: Optional[int] = None
+
+    def _added_size(self) -> int:
+        if self._frozen_size is not None:
+            return self._frozen_size
+        return len(self._added) if self._added is not None else 0
+
+    def __len__(self) -> int:
+        return len(self._base) + self._added_size()
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if position < len(self._base):
+            return self._base[position]
+        if not position < len(self):
+            raise IndexError("document position out of range")
+        return self._added[position - len(self._base)]
+
+    def append(self, document: Any):
+        if self._frozen_size is not None:
+            raise ValueError("A frozen document list is read-only")
+        if self._added is None:
+            self._added = DocumentColumns(type(document)) if hasattr(type(document), "COLUMNS") else []
+        self._added.append(document)
+
+    def extend(self, documents: Iterable[Any]):
+        for document in documents:
+            self.append(document)
+
+    def frozen(self) -> "DocumentList":
+        """Read-only copy that later appends do not affect; both lists share their storage"""
+        documents = DocumentList(self._base)
+        documents._added, documents._frozen_size = self._added, self._added_size()
+        return documents
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the added documents; the snapshot base is memory-mapped"""
+        if isinstance(self._added, DocumentColumns):
+            return self._added.nbytes
+        return sum(sys.getsizeof(document) for document in self._added or ())
+
+    def get_stats(self) -> Dict[str, Any]:
+        added = self._added_size()
+        return {
+            "snapshot_documents": len(self._base),
+            "added_documents": added,
+            "columnar": isinstance(self._added, DocumentColumns),
+            "added_bytes": self.nbytes,
+            "bytes_per_added_document": round(self.nbytes / added, 1) if added else 0.0
+        }
+
+    def record_bytes(self, to_record: Callable[[Any], Dict[str, Any]]) -> Iterator[bytes]:
+        """Serialized records in order; snapshot records are copied without parsing them"""
+        if isinstance(self._base, LazyDocuments):
+            for position in range(len(self._base)):
+                yield self._base.raw_record(position)
+        else:
+            for document in self._base:
+                yield _serialize_record(to_record(document))
+        for position in range(self._added_size()):
+            yield _serialize_record(to_record(self._added[position]))
+
+
+def pack_strings(strings: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """UTF-8 bytes and offsets of a string list, so it can be stored as snapshot arrays"""
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8).copy(), offsets
+
+
+def unpack_strings(data: np.ndarray, offsets: np.ndarray) -> List[str]:
+    data = bytes(np.asarray(data))
+    offsets = np.asarray(offsets).tolist()
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+
+def _serialize_record(record: Dict[str, Any]) -> bytes:
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def fsync_file(path: str):
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+def fsync_directory(path: str):
+    """Make the entries created, renamed or removed in a directory durable"""
+    if os.name == 'nt':
+        # Windows cannot open a directory for fsync; NTFS journals its metadata
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_snapshot(directory: str):
+    """Flush every file of a snapshot directory and the directory itself to disk"""
+    for entry in os.listdir(directory):
+        fsync_file(os.path.join(directory, entry))
+    fsync_directory(directory)
+
+
+def _write_corpus(directory: str, name: str, index: VectorIndex, documents: Sequence,
+                  to_record: Callable[[Any], Dict[str, Any]]) -> Dict[str, Any]:
+    """Write the matrix, row owners and metadata sidecar of one corpus"""
+    rows, dim = len(index), index.dim or 0
+    matrix_path = os.path.join(directory, f"{name}.npy")
+    owners_path = os.path.join(directory, f"{name}.owners.npy")
+
+    if rows == 0:
+        np.save(matrix_path, np.empty((0, dim), dtype=np.float32))
+        np.save(owners_path, np.empty(0, dtype=np.int64))
+    else:
+        # Stream segment by segment so a memory-mapped base is never copied into RAM as a whole
+        matrix = np.lib.format.open_memmap(matrix_path, mode='w+', dtype=np.float32, shape=(rows, dim))
+        owners = np.lib.format.open_memmap(owners_path, mode='w+', dtype=np.int64, shape=(rows,))
+        start = 0
+        for vectors, segment_owners in index.segments():
+            end = start + vectors.shape[0]
+            matrix[start:end] = vectors
+            owners[start:end] = segment_owners
+            start = end
+        matrix.flush()
+        owners.flush()
+        del matrix, owners
+
+    if isinstance(documents, DocumentList):
+        records = documents.record_bytes(to_record)
+    else:
+        records = (_serialize_record(to_record(document)) for document in documents)
+    offsets = np.empty(len(documents), dtype=np.int64)
+    with open(os.path.join(directory, f"{name}.meta.jsonl"), 'wb') as f:
+        for position, record in enumerate(records):
+            offsets[position] = f.tell()
+            f.write(record)
+            f.write(b'\n')
+    np.save(os.path.join(directory, f"{name}.offsets.npy"), offsets)
+
+    return {"rows": rows, "documents": len(documents), "checksum": sha256_file(matrix_path)}
+
+
+def write_snapshot(root: str, model_name: str,
+                   corpora: Dict[str, Tuple[VectorIndex, Sequence, Callable[[Any], Dict[str, Any]]]],
+                   extra: Optional[Dict[str, Any]] = None,
+                   arrays: Optional[Dict[str, np.ndarray]] = None) -> str:
+    """Write a new snapshot under root and atomically make it the current one"""
+    os.makedirs(root, exist_ok=True)
+    name = f"snapshot-{time.time_ns()}"
+    directory = os.path.join(root, name)
+    os.makedirs(directory)
+    arrays = arrays or {}
+    for array_name, array in arrays.items():
+        np.save(os.path.join(directory, f"{array_name}.npy"), array)
+
+    dims = {index.dim for index, _, _ in corpora.values() if index.dim}
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "model_name": model_name,
+        "dim": dims.pop() if len(dims) == 1 else None,
+        "created": time.time(),
+        "corpora": {
+            corpus: _write_corpus(directory, corpus, index, documents, to_record)
+            for corpus, (index, documents, to_record) in corpora.items()
+        },
+        "arrays": sorted(arrays)
+    }
+    manifest.update(extra or {})
+    with open(os.path.join(directory, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    # The caller deletes the journals this snapshot covers once it returns, so it must survive a crash first
+    _fsync_snapshot(directory)
+    fsync_directory(root)
+    _set_current(root, name)
+    _remove_stale_snapshots(root, keep=name)
+    logging.info(f"Wrote embedding snapshot {directory}")
+    return directory
+
+
+def _set_current(root: str, name: str):
+    """Atomically and durably point CURRENT at a snapshot directory"""
+    current_tmp = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(current_tmp, 'w') as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(current_tmp, os.path.join(root, CURRENT_FILE))
+    fsync_directory(root)
+
+
+def publish_snapshot(root: str, directory: str, extra: Optional[Dict[str, Any]] = None) -> str:
+    """Move a snapshot written under another root on the same volume into root and make it the current one
+
+    `extra` is merged into its manifest first. A process still mapping the previous
+    snapshot keeps reading it until it opens the new one.
+    """
+    name = os.path.basename(directory)
+    if extra:
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        manifest.update(extra)
+        with open(manifest_path + ".tmp", 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+    _fsync_snapshot(directory)
+    target = os.path.join(root, name)
+    os.replace(directory, target)
+    fsync_directory(os.path.dirname(os.path.abspath(directory)))
+    fsync_directory(root)
+    _set_current(root, name)
+    _remove_stale_snapshots(root, keep=name)
+    logging.info(f"Published embedding snapshot {target}")
+    return target
+
+
+def _remove_stale_snapshots(root: str, keep: str):
+    """Best-effort removal of older snapshots (files still mapped elsewhere may refuse to go)"""
+    for entry in os.listdir(root):
+        if entry.startswith("snapshot-") and entry != keep:
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+
+def current_snapshot_dir(root: str) -> Optional[str]:
+    """Directory of the live snapshot, or None if there is none"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), 'r') as f:
+            directory = os.path.join(root, f.read().strip())
+    except FileNotFoundError:
+        return None
+    return directory if os.path.exists(os.path.join(directory, MANIFEST_FILE)) else None
+
+
+def load_snapshot(root: str, from_records: Dict[str, Callable[[Dict[str, Any]], Any]],
+                  verify: bool = False) -> Optional[Tuple[Dict[str, Any], Dict[str, Tuple[VectorIndex, LazyDocuments]]]]:
+    """Open the current snapshot without reading it: matrices are memory-mapped, documents parsed lazily
+
+    Returns (manifest, {corpus: (index, documents)}) or None if no snapshot exists;
+    the manifest gains a "directory" key for load_snapshot_array.
+    """
+    directory = current_snapshot_dir(root)
+    if directory is None:
+        return None
+    with open(os.path.join(directory, MANIFEST_FILE), 'r') as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format {manifest.get('format_version')} in {directory}")
+
+    corpora = {}
+    for corpus, from_record in from_records.items():
+        info = manifest["corpora"].get(corpus, {"rows": 0, "documents": 0})
+        matrix_path = os.path.join(directory, f"{corpus}.npy")
+        if verify and info["rows"] and sha256_file(matrix_path) != info["checksum"]:
+            raise ValueError(f"Checksum mismatch for {matrix_path}")
+
+        if info["rows"]:
+            index = VectorIndex(base_vectors=np.load(matrix_path, mmap_mode='r'),
+                                base_owners=np.load(os.path.join(directory, f"{corpus}.owners.npy"), mmap_mode='r'))
+        else:
+            index = VectorIndex(dim=manifest.get("dim"))
+        if index.dim is not None and manifest.get("dim") not in (None, index.dim):
+            raise ValueError(f"Snapshot {corpus} matrix has dimension {index.dim}, manifest says {manifest['dim']}")
+
+        if info["documents"]:
+            offsets = np.load(os.path.join(directory, f"{corpus}.offsets.npy"), mmap_mode='r')
+        else:
+            offsets = np.empty(0, dtype=np.int64)
+        documents = LazyDocuments(os.path.join(directory, f"{corpus}.meta.jsonl"), offsets, from_record)
+        corpora[corpus] = (index, documents)
+
+    manifest["directory"] = directory
+    logging.info(f"Opened embedding snapshot {directory}")
+    return manifest, corpora
+
+
+def load_snapshot_array(manifest: Dict[str, Any], name: str, mmap_mode: Optional[str] = 'r') -> Optional[np.ndarray]:
+    """Auxiliary array stored with an opened snapshot, or None if it was not written"""
+    if name not in manifest.get("arrays", []):
+        return None
+    return np.load(os.path.join(manifest["directory"], f"{name}.npy"), mmap_mode=mmap_mode)
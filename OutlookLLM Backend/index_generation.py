@@ -0,0 +1,80 @@
+"""
+Immutable searchable generations for the OutlookLLM RAG system
+Writers change the live indexes under the RAG system's lock, then publish a new
+generation: O(1) copies of the append-only structures, bounded to the sizes they had.
+Readers take the current generation with one attribute read and search it without
+the lock; a published generation never changes, so a search never sees half a write
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+from document_ids import LiveView
+from embedding_snapshot import DocumentList
+from interval_index import IntervalIndex
+from ivf_index import IVFIndex
+from keyword_index import KeywordView
+from metadata_index import MetadataIndex
+from passages import PassageTable
+from quantized_index import QuantizedIndex
+from vector_index import VectorIndex
+
+
+@dataclass(frozen=True)
+class CorpusGeneration:
+    """One corpus as of a generation
+
+    index, documents, quantized and keyword are copies that later appends do not
+    reach; ids is a copy-on-write view of the tombstones. metadata, passages and ann
+    are shared with the writer: what they hold for the rows and positions of this
+    generation never changes, and what they return is bounded to them.
+    """
+    index: VectorIndex
+    documents: DocumentList
+    ids: LiveView
+    keyword: KeywordView
+    metadata: MetadataIndex
+    passages: PassageTable
+    quantized: Optional[QuantizedIndex] = None
+    ann: Optional[IVFIndex] = None
+
+    def select(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Ascending positions of this generation's documents matching metadata filters, None without filters"""
+        positions = self.metadata.select(filters)
+        if positions is None:
+            return None
+        return positions[positions < len(self.documents)]
+
+    def span(self, row: int) -> Optional[Tuple[int, int]]:
+        """Body span of a row found in this generation, None for a whole-body row or no row"""
+        return self.passages.span(row) if 0 <= row < len(self.index) else None
+
+
+@dataclass(frozen=True)
+class SearchGeneration:
+    """Both corpora, the event intervals and the embedder their vectors came from, as of one write"""
+    number: int
+    corpora: Dict[str, CorpusGeneration]
+    intervals: IntervalIndex
+    embedding_space: str
+    # None until a keyword-only system first embeds
+    embedder: Optional[Any] = None
+
+    @property
+    def events(self) -> CorpusGeneration:
+        return self.corpora['events']
+
+    def overlapping(self, start: int, end: int) -> np.ndarray:
+        positions = self.intervals.overlapping(start, end)
+        return positions[positions < len(self.events.documents)]
+
+    def upcoming(self, after: int, limit: int) -> Tuple[np.ndarray, bool]:
+        """(positions of the next `limit` events starting at or after `after`, whether more may follow)"""
+        positions = self.intervals.upcoming(after, limit)
+        return positions[positions < len(self.events.documents)], len(positions) == limit
+
+    def conflicts(self, start: int, end: int) -> List[Tuple[int, int]]:
+        documents = len(self.events.documents)
+        return [(first, second) for first, second in self.intervals.conflicts(start, end)
+                if first < documents and second < documents]
@@ -0,0 +1,212 @@
+"""
+Append-only ingestion journal for the OutlookLLM RAG system
+
+Every added document and its vector is appended to journal-<generation>.log in the
+snapshot root and fsynced in groups. At startup the journals newer than the last
+snapshot are replayed on top of it; compaction folds them into a new snapshot.
+
+Record layout: <uint32 payload length><uint32 crc32><payload>, where the payload is a
+JSON header line ({"corpus", "record", "dim", "rows", "spans"}) followed by the raw
+float32 vectors, one per passage row ("rows" defaults to 1, "spans" to whole-body).
+A delete is a record with "deleted": true, the document id as its record and no rows.
+The first record of every file has corpus null and names the embedding model.
+"""
+
+import os
+import re
+import json
+import struct
+import logging
+import threading
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+RECORD_HEADER = struct.Struct('<II')
+JOURNAL_PATTERN = re.compile(r'^journal-(\d+)\.log$')
+
+
+def journal_path(root: str, generation: int) -> str:
+    return os.path.join(root, f"journal-{generation:08d}.log")
+
+
+def journal_generations(root: str) -> List[int]:
+    """Generations of the journal files present under root, oldest first"""
+    if not os.path.isdir(root):
+        return []
+    generations = []
+    for entry in os.listdir(root):
+        match = JOURNAL_PATTERN.match(entry)
+        if match:
+            generations.append(int(match.group(1)))
+    return sorted(generations)
+
+
+def _read_records(path: str) -> Iterator[Tuple[Dict[str, Any], bytes]]:
+    """Yield (header, vector bytes) until the end of the file or the first torn record
+
+    A torn or corrupt record can only be the tail of a group commit that never
+    reached the disk, so it ends the file.
+    """
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if not header:
+                return
+            if len(header) < RECORD_HEADER.size:
+                break
+            length, checksum = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            meta, vector = payload.split(b'\n', 1)
+            yield json.loads(meta), vector
+    logging.warning(f"Ignoring torn record at the end of {path}")
+
+
+def replay_journals(root: str, after_generation: int,
+                    model_name: str) -> Iterator[Tuple[str, Dict[str, Any], np.ndarray, Optional[List[List[int]]]]]:
+    """Yield (corpus, record, vectors, passage spans) from every journal newer than after_generation
+
+    A delete is yielded as ({"id": id}, zero vector rows); an added document always has a row.
+    """
+    for generation in journal_generations(root):
+        if generation <= after_generation:
+            continue
+        path = journal_path(root, generation)
+        records = _read_records(path)
+        file_header = next(records, None)
+        if file_header is None:
+            continue
+        if file_header[0].get("model_name") != model_name:
+            logging.warning(f"Skipping {path}: written with {file_header[0].get('model_name')}, current model is {model_name}")
+            continue
+        for meta, vector in records:
+            if meta.get("deleted"):
+                yield meta["corpus"], meta["record"], np.empty((0, 0), dtype=np.float32), None
+                continue
+            rows = meta.get("rows", 1)
+            vectors = np.frombuffer(vector, dtype=np.float32, count=rows * meta["dim"]).reshape(rows, meta["dim"])
+            yield meta["corpus"], meta["record"], vectors, meta.get("spans")
+
+
+def remove_journals(root: str, through_generation: int):
+    """Delete journals that a snapshot has absorbed"""
+    for generation in journal_generations(root):
+        if generation <= through_generation:
+            try:
+                os.remove(journal_path(root, generation))
+            except OSError as e:
+                logging.warning(f"Could not remove journal generation {generation}: {e}")
+
+
+class IngestJournal:
+    """Writer for the current journal generation with group commit
+
+    Appends are buffered and made durable by one fsync per group: when
+    group_commit_records records are pending, or at the latest
+    group_commit_interval seconds after the first pending record. An interval of
+    0 fsyncs every record as it is appended, without a flusher thread.
+    """
+
+    def __init__(self, root: str, generation: int, model_name: str, group_commit_records: int = 256,
+                 group_commit_interval: float = 0.1):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.generation = generation
+        self.model_name = model_name
+        self.group_commit_records = group_commit_records
+        self.group_commit_interval = group_commit_interval
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._file = self._open_generation()
+        self._closed = threading.Event()
+        # A zero wait would turn the flusher into a busy loop
+        self._flusher = None
+        if group_commit_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, name="journal-flusher", daemon=True)
+            self._flusher.start()
+
+    @property
+    def size(self) -> int:
+        """Bytes written to the current generation"""
+        return self._size
+
+    def _open_generation(self):
+        f = open(journal_path(self.root, self.generation), 'ab')
+        self._size = f.tell()
+        if self._size == 0:
+            self._write_record(f, {"corpus": None, "model_name": self.model_name}, b'')
+        return f
+
+    def _write_record(self, f, meta: Dict[str, Any], vector_bytes: bytes):
+        payload = json.dumps(meta, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n' + vector_bytes
+        f.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+        f.write(payload)
+        self._size += RECORD_HEADER.size + len(payload)
+
+    def append(self, corpus: str, record: Dict[str, Any], vectors: np.ndarray,
+               spans: Optional[Sequence[Tuple[int, int]]] = None):
+        """Journal one document with the vectors of its passage rows"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        vectors = vectors.reshape(-1, vectors.shape[-1])
+        meta = {"corpus": corpus, "record": record, "dim": vectors.shape[1], "rows": vectors.shape[0]}
+        if spans is not None:
+            meta["spans"] = [[int(start), int(end)] for start, end in spans]
+        with self._lock:
+            self._write_record(self._file, meta, vectors.tobytes())
+            self._commit_locked()
+
+    def append_delete(self, corpus: str, document_id: str):
+        """Journal the deletion of a document"""
+        with self._lock:
+            self._write_record(self._file, {"corpus": corpus, "record": {"id": document_id}, "deleted": True}, b'')
+            self._commit_locked()
+
+    def _commit_locked(self):
+        self._pending += 1
+        if self._pending >= self.group_commit_records or self._flusher is None:
+            self._sync_locked()
+
+    def _sync_locked(self):
+        if self._pending:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._pending = 0
+
+    def sync(self):
+        """Make every appended record durable now"""
+        with self._lock:
+            self._sync_locked()
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.group_commit_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                logging.error(f"Error syncing ingestion journal: {e}")
+
+    def rotate(self, model_name: Optional[str] = None) -> int:
+        """Seal the current generation and continue in a new one, returns the sealed generation
+
+        With model_name, the new generation holds vectors of that embedding model (after a reindex).
+        """
+        with self._lock:
+            self._sync_locked()
+            self._file.close()
+            sealed = self.generation
+            self.generation += 1
+            if model_name is not None:
+                self.model_name = model_name
+            self._file = self._open_generation()
+            return sealed
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        with self._lock:
+            self._sync_locked()
+            self._file.close()
@@ -0,0 +1,175 @@
+"""
+Background ingestion for the OutlookLLM RAG system
+Requests enqueue documents and get an ingest id back at once; a worker thread drains
+the queue in batches, so embedding runs outside the request thread and documents
+become searchable as soon as their vectors are appended
+"""
+
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+# handler(items, skip_unchanged) -> ids of the documents added
+IngestHandler = Callable[[List[Dict[str, Any]], bool], List[str]]
+
+
+class IngestQueue:
+    """FIFO of ingestion jobs drained by one worker thread
+
+    The worker waits up to batch_window seconds for more work, then merges
+    consecutive jobs of the same kind into one batch of at most max_batch items.
+    The heavy part (the model forward pass) releases the GIL, so a thread keeps
+    queries responsive without a second copy of the model in another process.
+    Status of the last `history` jobs is kept for polling.
+    """
+
+    def __init__(self, handlers: Dict[str, IngestHandler], max_batch: int = 256, batch_window: float = 0.05,
+                 history: int = 10_000):
+        self.handlers = handlers
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.history = history
+        self._jobs: Deque[Dict[str, Any]] = deque()
+        self._status: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._condition = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._closed = False
+        self._active = 0
+        self._batches = 0
+        self._batched_items = 0
+        self._last_batch_size = 0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+        self._failed = 0
+
+    def submit(self, kind: str, items: List[Dict[str, Any]], skip_unchanged: bool = False) -> str:
+        """Queue documents of a kind ('emails' or 'events'); returns the ingest id to poll"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown ingest kind {kind}, expected one of {sorted(self.handlers)}")
+        ingest_id = uuid.uuid4().hex
+        job = {"items": items, "skip_unchanged": skip_unchanged}
+        status = {
+            "id": ingest_id,
+            "kind": kind,
+            "state": "queued",
+            "count": len(items),
+            "queued_at": time.time()
+        }
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Ingest queue is closed")
+            self._status[ingest_id] = status
+            while len(self._status) > self.history:
+                self._status.popitem(last=False)
+            self._jobs.append({**job, "status": status})
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="ingest-worker", daemon=True)
+                self._worker.start()
+            self._condition.notify()
+        return ingest_id
+
+    def status(self, ingest_id: str) -> Optional[Dict[str, Any]]:
+        with self._condition:
+            status = self._status.get(ingest_id)
+            return dict(status) if status is not None else None
+
+    def pending(self) -> int:
+        """Items queued or being embedded"""
+        with self._condition:
+            return sum(len(job["items"]) for job in self._jobs) + self._active
+
+    def _next_batch(self) -> Optional[List[Dict[str, Any]]]:
+        """Consecutive jobs of one kind, at most max_batch items (a larger single job is taken whole)"""
+        with self._condition:
+            while not self._jobs and not self._closed:
+                self._condition.wait()
+            if not self._jobs:
+                return None
+            if not self._closed and self.batch_window > 0:
+                # Give a burst of single-document pushes the chance to share one forward pass
+                self._condition.wait_for(lambda: self._closed or sum(len(job["items"]) for job in self._jobs) >= self.max_batch,
+                                         timeout=self.batch_window)
+            batch = [self._jobs.popleft()]
+            kind, skip_unchanged = batch[0]["status"]["kind"], batch[0]["skip_unchanged"]
+            size = len(batch[0]["items"])
+            while (self._jobs and self._jobs[0]["status"]["kind"] == kind and self._jobs[0]["skip_unchanged"] == skip_unchanged
+                   and size + len(self._jobs[0]["items"]) <= self.max_batch):
+                size += len(self._jobs[0]["items"])
+                batch.append(self._jobs.popleft())
+            self._active = size
+            for job in batch:
+                job["status"].update(state="running", started_at=time.time())
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            kind, skip_unchanged = batch[0]["status"]["kind"], batch[0]["skip_unchanged"]
+            items = [item for job in batch for item in job["items"]]
+            try:
+                if skip_unchanged:
+                    # Unchanged items are dropped, so ids cannot be split back per job
+                    results = [self.handlers[kind](job["items"], True) for job in batch]
+                else:
+                    ids = self.handlers[kind](items, False)
+                    results, start = [], 0
+                    for job in batch:
+                        results.append(ids[start:start + len(job["items"])])
+                        start += len(job["items"])
+                error = None
+            except Exception as e:
+                logging.error(f"Error ingesting {len(items)} queued {kind}: {e}")
+                results, error = [[] for _ in batch], str(e)
+
+            finished_at = time.time()
+            with self._condition:
+                for job, ids in zip(batch, results):
+                    if error is None:
+                        job["status"].update(state="done", ids=ids, finished_at=finished_at)
+                    else:
+                        job["status"].update(state="failed", error=error, finished_at=finished_at)
+                        self._failed += 1
+                lag = finished_at - batch[0]["status"]["queued_at"]
+                self._batches += 1
+                self._batched_items += len(items)
+                self._last_batch_size = len(items)
+                self._last_lag = lag
+                self._max_lag = max(self._max_lag, lag)
+                self._active = 0
+                self._condition.notify_all()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued so far is searchable; False on timeout"""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._jobs and not self._active, timeout=timeout)
+
+    def close(self):
+        """Finish the queued jobs and stop the worker"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            worker = self._worker
+        if worker is not None:
+            worker.join()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._condition:
+            oldest = self._jobs[0]["status"]["queued_at"] if self._jobs else None
+            return {
+                "depth": sum(len(job["items"]) for job in self._jobs),
+                "jobs_queued": len(self._jobs),
+                "in_progress": self._active,
+                "batches": self._batches,
+                "last_batch_size": self._last_batch_size,
+                "mean_batch_size": round(self._batched_items / self._batches, 1) if self._batches else 0.0,
+                "max_batch": self.max_batch,
+                "last_lag_seconds": round(self._last_lag, 3),
+                "max_lag_seconds": round(self._max_lag, 3),
+                "oldest_queued_seconds": round(time.time() - oldest, 3) if oldest is not None else 0.0,
+                "failed_jobs": self._failed
+            }
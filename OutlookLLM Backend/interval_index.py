@@ -0,0 +1,137 @@
+"""
+Time-interval index over calendar events for the OutlookLLM RAG system
+Sorted start arrays bucketed by duration class answer overlap, upcoming and
+conflict queries without scanning the whole calendar
+"""
+
+import heapq
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+# Duration classes double from 15 minutes; the last class takes everything longer
+BASE_DURATION = 15 * 60
+DURATION_CLASSES = 16
+
+
+class IntervalIndex:
+    """Event intervals (int64 epoch seconds) keyed by document position
+
+    Events are grouped by duration class (duration <= BASE_DURATION * 2**c) and kept
+    sorted by start within each class. An overlap query on [a, b) only has to look at
+    starts in [a - longest duration of the class, b) per class, which costs
+    O(log n + k) per class plus the few events that end just before a.
+    Appended events are merged into the sorted classes on the next query.
+    """
+
+    def __init__(self):
+        self._size = 0
+        self._starts = np.zeros(16, dtype=np.int64)
+        self._ends = np.zeros(16, dtype=np.int64)
+        self._indexed = 0
+        self._class_starts: List[np.ndarray] = [np.empty(0, dtype=np.int64) for _ in range(DURATION_CLASSES)]
+        self._class_positions: List[np.ndarray] = [np.empty(0, dtype=np.int64) for _ in range(DURATION_CLASSES)]
+        self._class_max = [0] * DURATION_CLASSES
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @staticmethod
+    def _grow(array: np.ndarray, size: int) -> np.ndarray:
+        if size <= array.shape[0]:
+            return array
+        grown = np.zeros(max(2 * array.shape[0], size), dtype=array.dtype)
+        grown[:array.shape[0]] = array
+        return grown
+
+    def add_batch(self, first_position: int, starts: np.ndarray, ends: np.ndarray):
+        """Append the intervals of events stored from `first_position` on"""
+        end = first_position + len(starts)
+        with self._lock:
+            self._starts = self._grow(self._starts, end)
+            self._ends = self._grow(self._ends, end)
+            self._starts[first_position:end] = starts
+            # Zero-length and inverted events are treated as instants
+            self._ends[first_position:end] = np.maximum(ends, starts)
+            self._size = max(self._size, end)
+
+    def _merge_pending(self):
+        if self._indexed == self._size:
+            return
+        positions = np.arange(self._indexed, self._size, dtype=np.int64)
+        starts = self._starts[positions]
+        durations = self._ends[positions] - starts
+        classes = np.minimum(np.ceil(np.log2(np.maximum(durations, 1) / BASE_DURATION)).clip(min=0),
+                             DURATION_CLASSES - 1).astype(np.int64)
+        for duration_class in np.unique(classes):
+            selected = classes == duration_class
+            new_starts, new_positions = starts[selected], positions[selected]
+            order = np.argsort(new_starts, kind='stable')
+            new_starts, new_positions = new_starts[order], new_positions[order]
+            at = np.searchsorted(self._class_starts[duration_class], new_starts, side='right')
+            self._class_starts[duration_class] = np.insert(self._class_starts[duration_class], at, new_starts)
+            self._class_positions[duration_class] = np.insert(self._class_positions[duration_class], at, new_positions)
+            self._class_max[duration_class] = max(self._class_max[duration_class], int(durations[selected].max()))
+        self._indexed = self._size
+
+    def overlapping(self, start: int, end: int) -> np.ndarray:
+        """Positions of events overlapping [start, end), ordered by start time"""
+        with self._lock:
+            self._merge_pending()
+            found = []
+            for duration_class in range(DURATION_CLASSES):
+                class_starts = self._class_starts[duration_class]
+                if not class_starts.size:
+                    continue
+                low = np.searchsorted(class_starts, start - self._class_max[duration_class], side='left')
+                high = np.searchsorted(class_starts, end, side='left')
+                candidates = self._class_positions[duration_class][low:high]
+                # Instants (start == end) count when they fall inside the window
+                ends = self._ends[candidates]
+                found.append(candidates[(ends > start) | ((ends == start) & (self._starts[candidates] >= start))])
+            if not found:
+                return np.empty(0, dtype=np.int64)
+            positions = np.concatenate(found)
+            return positions[np.argsort(self._starts[positions], kind='stable')]
+
+    def upcoming(self, after: int, limit: int) -> np.ndarray:
+        """Positions of the first `limit` events starting at or after `after`"""
+        with self._lock:
+            self._merge_pending()
+            heads = []
+            for duration_class in range(DURATION_CLASSES):
+                class_starts = self._class_starts[duration_class]
+                low = np.searchsorted(class_starts, after, side='left')
+                heads.append((class_starts[low:low + limit], self._class_positions[duration_class][low:low + limit]))
+            merged = heapq.merge(*[zip(starts.tolist(), positions.tolist()) for starts, positions in heads])
+            return np.array([position for _, position in list(merged)[:limit]], dtype=np.int64)
+
+    def conflicts(self, start: int, end: int) -> List[Tuple[int, int]]:
+        """Pairs of positions of events in [start, end) that overlap each other (sweep line)"""
+        pairs = []
+        active: List[Tuple[int, int]] = []
+        for position in self.overlapping(start, end).tolist():
+            event_start, event_end = int(self._starts[position]), int(self._ends[position])
+            while active and active[0][0] <= event_start:
+                heapq.heappop(active)
+            pairs.extend((other, position) for _, other in active)
+            heapq.heappush(active, (event_end, position))
+        return pairs
+
+    def state(self, documents: Optional[int] = None) -> Dict[str, np.ndarray]:
+        documents = self._size if documents is None else documents
+        return {"starts": self._starts[:documents].copy(), "ends": self._ends[:documents].copy()}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "IntervalIndex":
+        """Restore persisted intervals; the duration classes are sorted on first use"""
+        index = cls()
+        index.add_batch(0, np.asarray(state["starts"], dtype=np.int64), np.asarray(state["ends"], dtype=np.int64))
+        return index
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "events": self._size,
+            "duration_classes": sum(1 for starts in self._class_starts if starts.size)
+        }
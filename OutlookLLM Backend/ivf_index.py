@@ -0,0 +1,165 @@
+"""
+Approximate nearest-neighbour search for the OutlookLLM RAG system
+Pure-numpy IVF: a spherical k-means coarse quantizer with array-backed inverted lists
+"""
+
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+
+from vector_index import VectorIndex, normalize_rows, top_k_indices
+
+
+def default_nlist(rows: int) -> int:
+    """Number of inverted lists for a corpus of `rows` vectors (~4 * sqrt(n))"""
+    return max(1, int(4 * np.sqrt(max(rows, 1))))
+
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iterations: int = 10, seed: int = 0,
+                     chunk_size: int = 8192) -> np.ndarray:
+    """Cluster L2-normalized vectors by cosine similarity, returns normalized centroids"""
+    rng = np.random.default_rng(seed)
+    k = min(k, vectors.shape[0])
+    centroids = np.array(vectors[rng.choice(vectors.shape[0], k, replace=False)], dtype=np.float32)
+    for _ in range(iterations):
+        sums = np.zeros_like(centroids)
+        counts = np.zeros(k, dtype=np.int64)
+        for start in range(0, vectors.shape[0], chunk_size):
+            chunk = vectors[start:start + chunk_size]
+            assignments = np.argmax(chunk @ centroids.T, axis=1)
+            order = np.argsort(assignments, kind='stable')
+            cluster_ids, starts = np.unique(assignments[order], return_index=True)
+            sums[cluster_ids] += np.add.reduceat(chunk[order], starts, axis=0)
+            counts += np.bincount(assignments, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters with random points so every list stays useful
+            sums[empty] = vectors[rng.choice(vectors.shape[0], int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index over the rows of a VectorIndex
+
+    Every row is assigned to its nearest centroid; a query scans only the rows of
+    its nprobe closest lists. Recall and latency are traded with nprobe.
+    """
+
+    def __init__(self, nlist: Optional[int] = None, nprobe: int = 8, train_sample: int = 100_000):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_sample = train_sample
+        self.centroids: Optional[np.ndarray] = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._size = 0
+        self._lists: list = []
+        self._list_sizes = np.empty(0, dtype=np.int64)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def assignments(self) -> np.ndarray:
+        """Inverted list of every indexed row"""
+        return self._assignments[:self._size]
+
+    def train(self, index: VectorIndex, seed: int = 0):
+        """Fit the coarse quantizer on a sample of the index and assign every row"""
+        start_time = time.perf_counter()
+        rows = len(index)
+        nlist = self.nlist or default_nlist(rows)
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(rows, min(rows, self.train_sample), replace=False))
+        self.centroids = spherical_kmeans(index.take(sample_rows), nlist, seed=seed)
+        self.nlist = self.centroids.shape[0]
+        self._reset_lists()
+
+        for vectors, _ in index.segments():
+            self.add(np.arange(self._size, self._size + vectors.shape[0]), vectors)
+        logging.info(f"Trained IVF index with {self.nlist} lists on {len(sample_rows)} of {rows} rows in {time.perf_counter() - start_time:.2f}s")
+
+    def _reset_lists(self):
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._size = 0
+        self._lists = [np.empty(16, dtype=np.int64) for _ in range(self.nlist)]
+        self._list_sizes = np.zeros(self.nlist, dtype=np.int64)
+
+    def _append_to_list(self, list_id: int, rows: np.ndarray):
+        size = self._list_sizes[list_id]
+        posting = self._lists[list_id]
+        if size + rows.shape[0] > posting.shape[0]:
+            grown = np.empty(max(2 * posting.shape[0], size + rows.shape[0]), dtype=np.int64)
+            grown[:size] = posting[:size]
+            self._lists[list_id] = posting = grown
+        posting[size:size + rows.shape[0]] = rows
+        self._list_sizes[list_id] = size + rows.shape[0]
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray, chunk_size: int = 8192):
+        """Assign newly appended rows (with their normalized vectors) to inverted lists"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.size == 0:
+            return
+        assignments = np.concatenate([
+            np.argmax(vectors[start:start + chunk_size] @ self.centroids.T, axis=1)
+            for start in range(0, rows.shape[0], chunk_size)
+        ]).astype(np.int32)
+        self._store_assignments(rows, assignments)
+
+    def _store_assignments(self, rows: np.ndarray, assignments: np.ndarray):
+        end = self._size + rows.shape[0]
+        if end > self._assignments.shape[0]:
+            grown = np.empty(max(2 * self._assignments.shape[0], end), dtype=np.int32)
+            grown[:self._size] = self._assignments[:self._size]
+            self._assignments = grown
+        self._assignments[self._size:end] = assignments
+        self._size = end
+
+        order = np.argsort(assignments, kind='stable')
+        list_ids, starts = np.unique(assignments[order], return_index=True)
+        for list_id, rows_of_list in zip(list_ids, np.split(rows[order], starts[1:])):
+            self._append_to_list(int(list_id), rows_of_list)
+
+    def search(self, query_vector: np.ndarray, index: VectorIndex, top_k: int,
+               nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Scan the nprobe closest lists; returns (scores, rows) best first"""
+        query = normalize_rows(np.asarray(query_vector).reshape(-1))
+        probe = top_k_indices(self.centroids @ query, nprobe or self.nprobe)
+        # The size is read before the list, which a concurrent add may replace by a grown copy
+        sizes = self._list_sizes[probe].tolist()
+        candidates = np.concatenate([self._lists[list_id][:size] for list_id, size in zip(probe.tolist(), sizes)])
+        # Rows added after `index` was taken (a searchable generation's copy) are not in it
+        candidates = candidates[candidates < len(index)]
+        if candidates.size == 0:
+            return np.empty(0, dtype=np.float32), candidates
+        scores = index.take(candidates) @ query
+        best = top_k_indices(scores, top_k)
+        return scores[best], candidates[best]
+
+    def state(self, rows: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Arrays to persist next to a snapshot holding the first `rows` rows"""
+        rows = self._size if rows is None else rows
+        return {"centroids": self.centroids, "assignments": self._assignments[:rows].copy()}
+
+    @classmethod
+    def from_state(cls, centroids: np.ndarray, assignments: np.ndarray, **kwargs: Any) -> "IVFIndex":
+        """Restore a trained index; inverted lists are rebuilt from the row assignments"""
+        ivf = cls(nlist=centroids.shape[0], **kwargs)
+        ivf.centroids = np.asarray(centroids, dtype=np.float32)
+        ivf._reset_lists()
+        ivf._store_assignments(np.arange(assignments.shape[0], dtype=np.int64), np.asarray(assignments, dtype=np.int32))
+        return ivf
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "trained": self.is_trained,
+            "nlist": self.nlist,
+            "nprobe": self.nprobe,
+            "rows": self._size,
+            "largest_list": int(self._list_sizes.max()) if self._list_sizes.size else 0
+        }
@@ -0,0 +1,247 @@
+"""
+BM25 keyword retrieval for the OutlookLLM RAG system
+Incrementally maintained inverted index with array-backed posting lists, plus
+rank fusion helpers to combine keyword and embedding results
+"""
+
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+
+from vector_index import top_k_indices
+from embedding_snapshot import pack_strings, unpack_strings
+
+# Words in any script (Hebrew included); identifiers such as INC-20931 or INV/2024/117
+# are kept whole as well as split into their parts
+TOKEN_PATTERN = re.compile(r'\w+(?:[-_./:#]\w+)*')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased terms of a text, compound identifiers plus their parts"""
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in re.split(r'[-_./:#]', token) if part)
+    return terms
+
+
+class KeywordIndex:
+    """Inverted index over document positions with Okapi BM25 scoring
+
+    Every term owns a growable pair of arrays (document positions ascending, term
+    frequencies); documents are only ever appended, so postings stay sorted.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._terms: Dict[str, int] = {}
+        self._postings: List[np.ndarray] = []
+        self._frequencies: List[np.ndarray] = []
+        self._posting_sizes = np.zeros(16, dtype=np.int64)
+        self._doc_lengths = np.zeros(16, dtype=np.int32)
+        self._documents = 0
+        self._total_length = 0
+        self._state: Optional[Dict[str, np.ndarray]] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._documents
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes allocated for posting lists and document lengths"""
+        postings = sum(array.nbytes for array in self._postings) + sum(array.nbytes for array in self._frequencies)
+        return int(postings + self._posting_sizes.nbytes + self._doc_lengths.nbytes)
+
+    def _grow(self, array: np.ndarray, size: int) -> np.ndarray:
+        if size <= array.shape[0]:
+            return array
+        grown = np.zeros(max(2 * array.shape[0], size), dtype=array.dtype)
+        grown[:array.shape[0]] = array
+        return grown
+
+    def _term_id(self, term: str) -> int:
+        term_id = self._terms.get(term)
+        if term_id is None:
+            term_id = self._terms[term] = len(self._postings)
+            self._postings.append(np.empty(4, dtype=np.int64))
+            self._frequencies.append(np.empty(4, dtype=np.int32))
+            self._posting_sizes = self._grow(self._posting_sizes, term_id + 1)
+        return term_id
+
+    def _append_posting(self, term_id: int, position: int, frequency: int):
+        size = self._posting_sizes[term_id]
+        if size == self._postings[term_id].shape[0]:
+            self._postings[term_id] = self._grow(self._postings[term_id], size + 1)
+            self._frequencies[term_id] = self._grow(self._frequencies[term_id], size + 1)
+        self._postings[term_id][size] = position
+        self._frequencies[term_id][size] = frequency
+        self._posting_sizes[term_id] = size + 1
+
+    def add(self, position: int, text: str):
+        """Index the document at `position`, which must follow every indexed position"""
+        terms = tokenize(text)
+        counts: Dict[str, int] = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        with self._lock:
+            self._materialize()
+            for term, frequency in counts.items():
+                self._append_posting(self._term_id(term), position, frequency)
+            self._doc_lengths = self._grow(self._doc_lengths, position + 1)
+            self._doc_lengths[position] = len(terms)
+            self._documents = max(self._documents, position + 1)
+            self._total_length += len(terms)
+
+    def add_batch(self, first_position: int, texts: Iterable[str]):
+        for offset, text in enumerate(texts):
+            self.add(first_position + offset, text)
+
+    def view(self) -> "KeywordView":
+        """The index as of now; documents added later are not searched through the view"""
+        with self._lock:
+            return KeywordView(self, self._documents, self._total_length)
+
+    def search(self, query: str, top_k: int, allowed: Optional[np.ndarray] = None, documents: Optional[int] = None,
+               total_length: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """BM25 scores of the best matching documents; returns (scores, positions) best first
+
+        `allowed` is an optional boolean mask over document positions. `documents` and
+        `total_length` search the first documents only, with the statistics they had.
+        """
+        with self._lock:
+            self._materialize()
+            bounded = documents is not None and documents < self._documents
+            documents = self._documents if documents is None else documents
+            total_length = self._total_length if total_length is None else total_length
+            if not documents:
+                return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+            average_length = total_length / documents
+            positions, contributions = [], []
+            for term in set(tokenize(query)):
+                term_id = self._terms.get(term)
+                if term_id is None:
+                    continue
+                size = self._posting_sizes[term_id]
+                if bounded:
+                    size = np.searchsorted(self._postings[term_id][:size], documents)
+                docs = self._postings[term_id][:size]
+                frequencies = self._frequencies[term_id][:size].astype(np.float32)
+                idf = np.log1p((documents - size + 0.5) / (size + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[docs] / average_length)
+                positions.append(docs)
+                contributions.append(idf * frequencies * (self.k1 + 1) / (frequencies + norm))
+        if not positions:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        positions = np.concatenate(positions)
+        contributions = np.concatenate(contributions)
+        if allowed is not None:
+            keep = allowed[positions]
+            positions, contributions = positions[keep], contributions[keep]
+        # Sum per document over the touched postings only, never over the whole corpus
+        documents, inverse = np.unique(positions, return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions).astype(np.float32)
+        best = top_k_indices(scores, top_k)
+        return scores[best], documents[best]
+
+    def state(self, documents: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """CSR arrays for the first `documents` documents, to persist with a snapshot"""
+        with self._lock:
+            self._materialize()
+            documents = self._documents if documents is None else documents
+            terms = list(self._terms)
+            sizes = np.array([
+                np.searchsorted(self._postings[term_id][:self._posting_sizes[term_id]], documents)
+                for term_id in range(len(terms))
+            ], dtype=np.int64)
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            np.cumsum(sizes, out=offsets[1:])
+            packed_terms, term_offsets = pack_strings(terms)
+            return {
+                "terms": packed_terms,
+                "term_offsets": term_offsets,
+                "posting_offsets": offsets,
+                "postings": np.concatenate([self._postings[i][:sizes[i]] for i in range(len(terms))] or [np.empty(0, dtype=np.int64)]),
+                "frequencies": np.concatenate([self._frequencies[i][:sizes[i]] for i in range(len(terms))] or [np.empty(0, dtype=np.int32)]),
+                "doc_lengths": self._doc_lengths[:documents].copy()
+            }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray], **kwargs: Any) -> "KeywordIndex":
+        """Restore a persisted index; posting lists are unpacked on first use"""
+        index = cls(**kwargs)
+        index._state = state
+        index._documents = int(state["doc_lengths"].shape[0])
+        index._total_length = int(np.asarray(state["doc_lengths"], dtype=np.int64).sum())
+        return index
+
+    def _materialize(self):
+        state, self._state = self._state, None
+        if state is None:
+            return
+        terms = unpack_strings(state["terms"], state["term_offsets"])
+        posting_offsets = np.asarray(state["posting_offsets"])
+        postings = np.asarray(state["postings"], dtype=np.int64)
+        frequencies = np.asarray(state["frequencies"], dtype=np.int32)
+        count = len(terms)
+        self._terms = {term: i for i, term in enumerate(terms)}
+        self._postings = [postings[posting_offsets[i]:posting_offsets[i + 1]].copy() for i in range(count)]
+        self._frequencies = [frequencies[posting_offsets[i]:posting_offsets[i + 1]].copy() for i in range(count)]
+        self._posting_sizes = self._grow(np.diff(posting_offsets), 16)
+        self._doc_lengths = self._grow(np.array(state["doc_lengths"], dtype=np.int32), 16)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "documents": self._documents,
+            "terms": len(self._terms) if self._state is None else int(self._state["term_offsets"].shape[0] - 1),
+            "average_length": round(self._total_length / self._documents, 1) if self._documents else 0.0
+        }
+
+
+class KeywordView:
+    """A KeywordIndex as of one moment: later documents are skipped and BM25 statistics are those of then"""
+
+    def __init__(self, index: KeywordIndex, documents: int, total_length: int):
+        self._index = index
+        self.documents = documents
+        self.total_length = total_length
+
+    def __len__(self) -> int:
+        return self.documents
+
+    def search(self, query: str, top_k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        return self._index.search(query, top_k, allowed, self.documents, self.total_length)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[np.ndarray], k: int = 60) -> Tuple[np.ndarray, np.ndarray]:
+    """Fuse ranked position lists by sum of 1 / (k + rank); returns (scores, positions) best first"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, position in enumerate(ranking.tolist()):
+            scores[position] = scores.get(position, 0.0) + 1.0 / (k + rank + 1)
+    return _sorted_scores(scores)
+
+
+def weighted_fusion(results: Sequence[Tuple[np.ndarray, np.ndarray]], weights: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """Fuse (scores, positions) lists by a weighted sum of min-max normalized scores"""
+    scores: Dict[int, float] = {}
+    for (result_scores, positions), weight in zip(results, weights):
+        if not len(positions):
+            continue
+        low, high = float(result_scores.min()), float(result_scores.max())
+        normalized = (result_scores - low) / (high - low) if high > low else np.ones_like(result_scores)
+        for position, score in zip(positions.tolist(), normalized.tolist()):
+            scores[position] = scores.get(position, 0.0) + weight * score
+    return _sorted_scores(scores)
+
+
+def _sorted_scores(scores: Dict[int, float]) -> Tuple[np.ndarray, np.ndarray]:
+    positions = np.fromiter(scores.keys(), dtype=np.int64, count=len(scores))
+    values = np.fromiter(scores.values(), dtype=np.float32, count=len(scores))
+    order = np.argsort(-values, kind='stable')
+    return values[order], positions[order]
@@ -0,0 +1,182 @@
+"""
+Columnar metadata filters for the OutlookLLM RAG system
+One int64 timestamp column kept in sorted order for range bisection, plus
+dictionary-encoded categorical columns (sender, folder, ...) for boolean masks
+"""
+
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+import numpy as np
+
+from embedding_snapshot import pack_strings, unpack_strings
+
+
+def to_datetime(value: Union[str, datetime, int, float]) -> datetime:
+    """datetime for a datetime, ISO string (a 'Z' suffix is accepted) or epoch seconds"""
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value)
+    if isinstance(value, str):
+        return datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    return value
+
+
+def to_timestamp(value: Union[str, datetime, int, float]) -> int:
+    """Seconds since the epoch for a datetime, ISO string or number"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    return int(to_datetime(value).timestamp())
+
+
+def _is_date_only(value: Any) -> bool:
+    if isinstance(value, str):
+        return len(value) == 10
+    return isinstance(value, date) and not isinstance(value, datetime)
+
+
+def _date_to_end(value: Any) -> int:
+    """Exclusive upper timestamp of an inclusive date_to: a date without a time covers that whole day"""
+    if _is_date_only(value):
+        day = date.fromisoformat(value) if isinstance(value, str) else value
+        return to_timestamp(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+    return to_timestamp(value) + 1
+
+
+class MetadataIndex:
+    """Per-document metadata columns aligned with document positions
+
+    Timestamps of appended documents go to an unsorted tail that is merged into the
+    sorted order on the next filtered query. Categorical values are interned once,
+    so a filter compares int32 codes and matches its text only against the dictionary.
+    Filters: "date_from" / "date_to" (inclusive; a date_to without a time includes
+    that whole day) on the time field, and for every
+    categorical field a value or list of values matched case-insensitively; fields
+    listed in `substring_fields` match on substrings ("finance" matches
+    finance-team@contoso.com).
+    """
+
+    def __init__(self, time_field: str, categorical_fields: Sequence[str], substring_fields: Sequence[str] = ()):
+        self.time_field = time_field
+        self.categorical_fields = tuple(categorical_fields)
+        self.substring_fields = set(substring_fields)
+        self._size = 0
+        self._times = np.zeros(16, dtype=np.int64)
+        self._sorted_times = np.empty(0, dtype=np.int64)
+        self._order = np.empty(0, dtype=np.int64)
+        self._codes = {field: np.zeros(16, dtype=np.int32) for field in self.categorical_fields}
+        self._values: Dict[str, List[str]] = {field: [] for field in self.categorical_fields}
+        self._value_codes: Dict[str, Dict[str, int]] = {field: {} for field in self.categorical_fields}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @staticmethod
+    def _grow(array: np.ndarray, size: int) -> np.ndarray:
+        if size <= array.shape[0]:
+            return array
+        grown = np.zeros(max(2 * array.shape[0], size), dtype=array.dtype)
+        grown[:array.shape[0]] = array
+        return grown
+
+    def _intern(self, field: str, value: str) -> int:
+        code = self._value_codes[field].get(value)
+        if code is None:
+            code = self._value_codes[field][value] = len(self._values[field])
+            self._values[field].append(value)
+        return code
+
+    def add_batch(self, first_position: int, documents: Iterable[Any]):
+        """Append the metadata of documents stored from `first_position` on"""
+        documents = list(documents)
+        end = first_position + len(documents)
+        with self._lock:
+            self._times = self._grow(self._times, end)
+            self._times[first_position:end] = [to_timestamp(getattr(document, self.time_field)) for document in documents]
+            for field in self.categorical_fields:
+                self._codes[field] = self._grow(self._codes[field], end)
+                self._codes[field][first_position:end] = [self._intern(field, str(getattr(document, field) or ''))
+                                                          for document in documents]
+            self._size = max(self._size, end)
+
+    def _merge_tail(self):
+        """Fold timestamps appended since the last query into the sorted order"""
+        sorted_count = self._order.shape[0]
+        if sorted_count == self._size:
+            return
+        tail_order = sorted_count + np.argsort(self._times[sorted_count:self._size], kind='stable')
+        tail_times = self._times[tail_order]
+        insert_at = np.searchsorted(self._sorted_times, tail_times, side='right')
+        self._sorted_times = np.insert(self._sorted_times, insert_at, tail_times)
+        self._order = np.insert(self._order, insert_at, tail_order)
+
+    def _matching_codes(self, field: str, wanted: Union[str, Sequence[str]]) -> np.ndarray:
+        wanted = [wanted] if isinstance(wanted, str) else list(wanted)
+        wanted = [value.lower() for value in wanted]
+        if field in self.substring_fields:
+            match = lambda value: any(term in value.lower() for term in wanted)
+        else:
+            match = lambda value: value.lower() in wanted
+        return np.array([code for code, value in enumerate(self._values[field]) if match(value)], dtype=np.int32)
+
+    def select(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Ascending positions of the documents matching every filter, or None without filters"""
+        filters = {key: value for key, value in (filters or {}).items() if value not in (None, '', [])}
+        if not filters:
+            return None
+        unknown = set(filters) - {"date_from", "date_to"} - set(self.categorical_fields)
+        if unknown:
+            raise ValueError(f"Unknown filters {sorted(unknown)}, expected date_from, date_to or one of {self.categorical_fields}")
+
+        with self._lock:
+            positions = None
+            if "date_from" in filters or "date_to" in filters:
+                self._merge_tail()
+                low = 0 if "date_from" not in filters else np.searchsorted(self._sorted_times, to_timestamp(filters["date_from"]), side='left')
+                high = self._size if "date_to" not in filters else np.searchsorted(self._sorted_times, _date_to_end(filters["date_to"]), side='left')
+                positions = np.sort(self._order[low:high])
+
+            for field in self.categorical_fields:
+                if field not in filters:
+                    continue
+                codes = self._matching_codes(field, filters[field])
+                if positions is None:
+                    column = self._codes[field][:self._size]
+                    positions = np.flatnonzero(np.isin(column, codes))
+                else:
+                    # Only the already selected subset is compared
+                    positions = positions[np.isin(self._codes[field][positions], codes)]
+                if positions.size == 0:
+                    break
+            return positions
+
+    def state(self, documents: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Columns and dictionaries for the first `documents` documents, to persist with a snapshot"""
+        with self._lock:
+            documents = self._size if documents is None else documents
+            state = {"times": self._times[:documents].copy()}
+            for field in self.categorical_fields:
+                state[f"{field}_codes"] = self._codes[field][:documents].copy()
+                state[f"{field}_values"], state[f"{field}_offsets"] = pack_strings(self._values[field])
+            return state
+
+    def state_names(self) -> List[str]:
+        return ["times"] + [f"{field}_{part}" for field in self.categorical_fields for part in ("codes", "values", "offsets")]
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray], time_field: str, categorical_fields: Sequence[str],
+                   substring_fields: Sequence[str] = ()) -> "MetadataIndex":
+        index = cls(time_field, categorical_fields, substring_fields)
+        index._size = int(state["times"].shape[0])
+        index._times = cls._grow(np.array(state["times"], dtype=np.int64), 16)
+        for field in index.categorical_fields:
+            index._codes[field] = cls._grow(np.array(state[f"{field}_codes"], dtype=np.int32), 16)
+            index._values[field] = unpack_strings(state[f"{field}_values"], state[f"{field}_offsets"])
+            index._value_codes[field] = {value: code for code, value in enumerate(index._values[field])}
+        return index
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "documents": self._size,
+            "distinct": {field: len(values) for field, values in self._values.items()}
+        }
@@ -30,11 +30,8 @@ if RAG_AVAILABLE:
             sample_emails = generate_sample_emails()
             sample_events = generate_sample_calendar_events()
             
-            for email in sample_emails:
-                rag_system.add_email(email)
-            
-            for event in sample_events:
-                rag_system.add_calendar_event(event)
+            rag_system.add_emails(sample_emails)
+            rag_system.add_calendar_events(sample_events)
             
             rag_system.save_embeddings_cache()
             logging.info(f"Loaded {len(sample_emails)} emails and {len(sample_events)} events")
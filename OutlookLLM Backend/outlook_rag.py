@@ -1,13 +1,35 @@
 import os
+import copy
 import json
+import atexit
 import logging
+import threading
+import time
+import uuid
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import Callable, ClassVar, List, Dict, Any, Optional, Tuple
 import numpy as np
-from transformers import AutoTokenizer, AutoModel
-import torch
 import pickle
+from collections import OrderedDict
+from contextlib import contextmanager
 from dataclasses import dataclass
+from vector_index import VectorIndex, normalize_rows
+from embedding_snapshot import (MANIFEST_FILE, DocumentList, current_snapshot_dir, load_snapshot, load_snapshot_array,
+                                publish_snapshot, write_snapshot)
+from ivf_index import IVFIndex
+from quantized_index import PRECISIONS, QuantizedIndex
+from ingest_journal import IngestJournal, journal_generations, remove_journals, replay_journals
+from ingest_queue import IngestQueue
+from content_store import DIGEST_DTYPE, ContentStore, content_digest
+from keyword_index import KeywordIndex, reciprocal_rank_fusion, tokenize, weighted_fusion
+from metadata_index import MetadataIndex, to_datetime, to_timestamp
+from interval_index import IntervalIndex
+from passages import PassageTable, pool_passages, split_passages, token_spans, word_spans
+from document_ids import DocumentIds
+from context_builder import ContextBuilder, ContextSource, approximate_tokens
+from embedders import DEFAULT_EMBEDDING_MODEL, EMBEDDER_BACKENDS, Embedder, available_backend, create_embedder, embedding_space
+from document_store import INTERNED, INTERNED_LIST, TEXT, TIMESTAMP
+from index_generation import CorpusGeneration, SearchGeneration
 
 @dataclass
 class EmailDocument:
@@ -21,6 +43,27 @@ class EmailDocument:
     folder: str
     importance: str
     embedding: Optional[np.ndarray] = None
+    # Storage of every field in a DocumentList (see document_store); the embedding lives in the index
+    COLUMNS: ClassVar[Dict[str, str]] = {"id": TEXT, "subject": TEXT, "body": TEXT, "sender": INTERNED,
+                                         "recipients": INTERNED_LIST, "date": TIMESTAMP, "folder": INTERNED,
+                                         "importance": INTERNED}
+    
+    def to_record(self) -> Dict[str, Any]:
+        """Snapshot metadata record (the embedding lives in the snapshot matrix)"""
+        return {
+            "id": self.id,
+            "subject": self.subject,
+            "body": self.body,
+            "sender": self.sender,
+            "recipients": self.recipients,
+            "date": self.date.isoformat(),
+            "folder": self.folder,
+            "importance": self.importance
+        }
+    
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "EmailDocument":
+        return cls(**{**record, "date": datetime.fromisoformat(record["date"])})
 
 @dataclass
 class CalendarEvent:
@@ -35,64 +78,344 @@ class CalendarEvent:
     location: str
     category: str
     embedding: Optional[np.ndarray] = None
+    COLUMNS: ClassVar[Dict[str, str]] = {"id": TEXT, "subject": TEXT, "body": TEXT, "organizer": INTERNED,
+                                         "attendees": INTERNED_LIST, "start_time": TIMESTAMP, "end_time": TIMESTAMP,
+                                         "location": INTERNED, "category": INTERNED}
+    
+    def to_record(self) -> Dict[str, Any]:
+        """Snapshot metadata record (the embedding lives in the snapshot matrix)"""
+        return {
+            "id": self.id,
+            "subject": self.subject,
+            "body": self.body,
+            "organizer": self.organizer,
+            "attendees": self.attendees,
+            "start_time": self.start_time.isoformat(),
+            "end_time": self.end_time.isoformat(),
+            "location": self.location,
+            "category": self.category
+        }
+    
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "CalendarEvent":
+        return cls(**{
+            **record,
+            "start_time": datetime.fromisoformat(record["start_time"]),
+            "end_time": datetime.fromisoformat(record["end_time"])
+        })
+
+class QueryEmbeddingCache:
+    """Bounded LRU of query embeddings keyed by (model name, normalized query text)"""
+    
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._model_name: Optional[str] = None
+        self._entries: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.split())
+    
+    def get(self, model_name: str, text: str) -> Optional[np.ndarray]:
+        with self._lock:
+            if model_name != self._model_name:
+                # Embeddings from another model are meaningless for this one
+                self._entries.clear()
+                self._model_name = model_name
+            key = (model_name, self.normalize(text))
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+    
+    def put(self, model_name: str, text: str, embedding: np.ndarray):
+        if self.capacity <= 0:
+            return
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.setflags(write=False)
+        with self._lock:
+            if model_name != self._model_name:
+                return
+            key = (model_name, self.normalize(text))
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+# Embedders are loaded once per process and shared by every OutlookRAGSystem (one per mailbox shard)
+_embedders: Dict[Tuple[Any, ...], Embedder] = {}
+_embedders_lock = threading.Lock()
+
+def load_embedding_model(model_name: str = DEFAULT_EMBEDDING_MODEL, backend: str = "auto", **options: Any) -> Embedder:
+    """Shared embedder for a model, backend and options, loading it on first use; lets a server warm it up in the background"""
+    backend, options = available_backend(backend, options)
+    key = (backend, model_name, tuple(sorted(options.items())))
+    with _embedders_lock:
+        if key not in _embedders:
+            # torch / transformers / onnxruntime take seconds to import, so only the chosen backend imports them
+            _embedders[key] = create_embedder(backend, model_name, **options)
+        return _embedders[key]
 
 class OutlookRAGSystem:
     """RAG system for Outlook Inbox and Calendar Q&A"""
     
-    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
+    RETRIEVAL_MODES = ("vector", "keyword", "hybrid")
+    # query_calendar modes answered from the interval index instead of similarity search
+    CALENDAR_MODES = ("window", "upcoming", "conflicts")
+    # (time field, categorical fields, fields matched on substrings) of each corpus' metadata columns
+    METADATA_FIELDS = {
+        'emails': ('date', ('sender', 'folder', 'importance'), ('sender',)),
+        'events': ('start_time', ('organizer', 'category', 'location'), ('organizer', 'location'))
+    }
+    # Passage rows fetched per wanted document before pooling passages to documents
+    PASSAGE_OVERFETCH = 4
+    
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL, embedding_batch_size: int = 32,
+                 snapshot_dir: str = "outlook_embeddings", verify_snapshot: bool = False,
+                 journal_compaction_bytes: int = 64 * 1024 * 1024, group_commit_records: int = 256,
+                 group_commit_interval: float = 0.1, index_mode: str = "flat", ivf_nlist: Optional[int] = None,
+                 ivf_nprobe: int = 8, ivf_min_rows: int = 50_000, query_cache_size: int = 1024,
+                 retrieval_mode: str = "vector", fusion: str = "rrf", hybrid_alpha: float = 0.5,
+                 passage_tokens: int = 200, passage_overlap: int = 40, passage_pooling: str = "max",
+                 vector_storage: str = "float32", rerank_factor: int = 4, ingest_max_batch: int = 256,
+                 ingest_batch_window: float = 0.05, embedder_backend: str = "auto",
+                 embedder_options: Optional[Dict[str, Any]] = None, tombstone_compaction_ratio: float = 0.2,
+                 tombstone_compaction_min: int = 1000, context_tokens: int = 1024, context_max_sources: int = 8,
+                 context_dedupe_threshold: float = 0.85):
+        if embedder_backend not in EMBEDDER_BACKENDS:
+            raise ValueError(f"Unknown embedder_backend {embedder_backend}, expected one of {EMBEDDER_BACKENDS}")
         self.model_name = model_name
-        self.tokenizer = None
-        self.model = None
-        self.email_documents: List[EmailDocument] = []
-        self.calendar_events: List[CalendarEvent] = []
+        self.embedder_backend, self.embedder_options = available_backend(embedder_backend, dict(embedder_options or {}))
+        # Snapshots, journals and caches are keyed by the vectors' identity, which differs for int8 / hashed backends
+        self.embedding_space = embedding_space(self.embedder_backend, model_name, **self.embedder_options)
+        self.embedding_batch_size = embedding_batch_size
+        self._last_ingest: Optional[Dict[str, Any]] = None
+        self._query_cache = QueryEmbeddingCache(query_cache_size)
+        self.embedder: Optional[Embedder] = None
+        self.email_documents: DocumentList = DocumentList()
+        self.calendar_events: DocumentList = DocumentList()
+        # One contiguous, pre-normalized matrix per corpus; rows map back to document positions
+        self._email_index = VectorIndex()
+        self._event_index = VectorIndex()
+        self.snapshot_dir = snapshot_dir
+        self.verify_snapshot = verify_snapshot
+        # Configured embedder while the snapshot still holds vectors of another one (see reindex())
+        self.pending_migration: Optional[Dict[str, Any]] = None
+        self._adopt_snapshot_embedder()
+        # Identity of the position numbering; a purge or reindex renumbers documents and changes it
+        self.layout = uuid.uuid4().hex
+        self._reindexer = None
+        # Legacy pickle cache, only read for the one-shot migration to the snapshot format
         self.embeddings_cache_file = "outlook_embeddings.pkl"
+        # Identical texts (re-synced, forwarded, CC'd mail) reuse the vector already stored for them
+        self._content_store = ContentStore(self.embedding_space)
+        
+        # Inserts go to an append-only journal; compaction folds it into a new snapshot
+        self.journal_compaction_bytes = journal_compaction_bytes
+        self.group_commit_records = group_commit_records
+        self.group_commit_interval = group_commit_interval
+        self._journal: Optional[IngestJournal] = None
+        self._snapshot_generation = 0
+        self._snapshot_documents = {'emails': 0, 'events': 0}
+        self._lock = threading.RLock()
+        # Reentrant: purge_deleted() writes its snapshot while still excluding other compactions
+        self._compaction_lock = threading.RLock()
+        self._compaction_thread: Optional[threading.Thread] = None
+        self._compactions = 0
+        
+        # id -> live position plus tombstones: re-adding an id replaces it, deleting only flags it; once
+        # tombstones pass the threshold a background purge rebuilds the corpus without them
+        self._ids: Dict[str, DocumentIds] = {'emails': DocumentIds(), 'events': DocumentIds()}
+        self.tombstone_compaction_ratio = tombstone_compaction_ratio
+        self.tombstone_compaction_min = tombstone_compaction_min
+        self._purge_thread: Optional[threading.Thread] = None
+        self._purges = 0
+        
+        # Optional approximate index per corpus ("ivf"); small corpora keep using the exact scan
+        if index_mode not in ("flat", "ivf"):
+            raise ValueError(f"Unknown index_mode {index_mode}, expected 'flat' or 'ivf'")
+        self.index_mode = index_mode
+        self.ivf_nlist = ivf_nlist
+        self.ivf_nprobe = ivf_nprobe
+        self.ivf_min_rows = ivf_min_rows
+        self._ann: Dict[str, Optional[IVFIndex]] = {'emails': None, 'events': None}
+        
+        # "float16" / "int8" keep a compressed copy of the rows in RAM for the first-pass scan;
+        # candidates are re-ranked exactly against the float32 rows (memory-mapped once compacted)
+        if vector_storage not in ("float32",) + PRECISIONS:
+            raise ValueError(f"Unknown vector_storage {vector_storage}, expected 'float32' or one of {PRECISIONS}")
+        self.vector_storage = vector_storage
+        self.rerank_factor = rerank_factor
+        self._quantized: Dict[str, Optional[QuantizedIndex]] = {'emails': self._new_quantized(), 'events': self._new_quantized()}
         
-        # Initialize the embedding model
-        self._load_embedding_model()
+        # BM25 over subject/body/sender next to the embeddings; "keyword" never needs the model to answer
+        if retrieval_mode not in self.RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval_mode {retrieval_mode}, expected one of {self.RETRIEVAL_MODES}")
+        if fusion not in ("rrf", "weighted"):
+            raise ValueError(f"Unknown fusion {fusion}, expected 'rrf' or 'weighted'")
+        self.retrieval_mode = retrieval_mode
+        self.fusion = fusion
+        self.hybrid_alpha = hybrid_alpha
+        self._keyword: Dict[str, KeywordIndex] = {'emails': KeywordIndex(), 'events': KeywordIndex()}
+        # Columnar date / sender / folder / importance (organizer / category / location for events) filters
+        self._metadata: Dict[str, MetadataIndex] = {corpus: self._new_metadata(corpus) for corpus in ('emails', 'events')}
+        # Event start/end intervals for time-window, upcoming and conflict questions
+        self._intervals = IntervalIndex()
+        self._model_lock = threading.Lock()
+        
+        # Bodies longer than passage_tokens are embedded as overlapping passages, one row each
+        if passage_pooling not in ("max", "sum"):
+            raise ValueError(f"Unknown passage_pooling {passage_pooling}, expected 'max' or 'sum'")
+        self.passage_tokens = passage_tokens
+        self.passage_overlap = passage_overlap
+        self.passage_pooling = passage_pooling
+        self._passages: Dict[str, PassageTable] = {'emails': PassageTable(), 'events': PassageTable()}
+        
+        # query_inbox / query_calendar pack up to context_max_sources hits into context_tokens prompt tokens
+        self.context_tokens = context_tokens
+        self.context_max_sources = context_max_sources
+        self.context_dedupe_threshold = context_dedupe_threshold
+        
+        # Searches read the last published generation without taking the lock; every write publishes one
+        self._generation: Optional[SearchGeneration] = None
+        self._publish_deferred = 0
+        self._publish()
+        
+        # submit_emails / submit_calendar_events return at once; a worker thread embeds in batches
+        self._ingest_queue = IngestQueue({
+            'emails': lambda items, skip_unchanged: self.add_emails(items, skip_unchanged=skip_unchanged),
+            'events': lambda items, skip_unchanged: self.add_calendar_events(items, skip_unchanged=skip_unchanged)
+        }, max_batch=ingest_max_batch, batch_window=ingest_batch_window)
+        
+        # Initialize the embedding model; keyword-only systems load it on the first ingestion instead
+        if retrieval_mode != "keyword":
+            self._load_embedding_model()
         
         # Load cached embeddings if available
         self._load_cached_embeddings()
+        with self._lock:
+            self._publish()
+        atexit.register(self.close)
         
         logging.info(f"OutlookRAG initialized with {len(self.email_documents)} emails and {len(self.calendar_events)} events")
     
-    def _load_embedding_model(self):
-        """Load the sentence transformer model for embeddings"""
+    def _adopt_snapshot_embedder(self):
+        """Serve a snapshot built with another embedder than the configured one with that embedder
+        
+        Its vectors stay searchable instead of being ignored; the configured embedder is
+        kept in pending_migration for reindex(). Snapshots that do not name their
+        embedder are ignored as before.
+        """
+        directory = current_snapshot_dir(self.snapshot_dir)
+        if directory is None:
+            return
         try:
-            from sentence_transformers import SentenceTransformer
-            self.model = SentenceTransformer(self.model_name)
-            logging.info(f"Loaded SentenceTransformer: {self.model_name}")
-        except ImportError:
-            # Fallback to basic transformers
-            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-            self.model = AutoModel.from_pretrained(self.model_name)
-            logging.info(f"Loaded basic transformer: {self.model_name}")
+            with open(os.path.join(directory, MANIFEST_FILE), 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        embedder = manifest.get("embedder")
+        if not embedder or manifest.get("model_name") == self.embedding_space:
+            return
+        self.pending_migration = {"backend": self.embedder_backend, "model_name": self.model_name, "options": self.embedder_options}
+        logging.warning(f"Snapshot holds {manifest['model_name']} vectors, serving them until a reindex into {self.embedding_space}")
+        self.embedder_backend, self.model_name = embedder["backend"], embedder["model_name"]
+        self.embedder_options = dict(embedder.get("options", {}))
+        self.embedding_space = manifest["model_name"]
+    
+    def _embedder_manifest(self) -> Dict[str, Any]:
+        """Snapshot manifest entries naming the embedder and the position layout"""
+        return {"embedder": {"backend": self.embedder_backend, "model_name": self.model_name, "options": self.embedder_options},
+                "layout": self.layout}
+    
+    def _load_embedding_model(self):
+        """Load the configured embedder, or reuse the one already loaded in this process"""
+        self.embedder = load_embedding_model(self.model_name, self.embedder_backend, **self.embedder_options)
+    
+    def _ensure_model(self):
+        """Load the embedding model on first use"""
+        if self.embedder is None:
+            with self._model_lock:
+                if self.embedder is None:
+                    self._load_embedding_model()
+    
+    def _encode(self, text: str) -> np.ndarray:
+        """Run the embedding model on one text"""
+        self._ensure_model()
+        return self.embedder.encode([text], batch_size=1)[0]
     
     def _get_embedding(self, text: str) -> np.ndarray:
         """Generate embedding for text"""
         try:
-            if hasattr(self.model, 'encode'):
-                # SentenceTransformer
-                return self.model.encode(text, convert_to_numpy=True)
-            else:
-                # Basic transformer
-                inputs = self.tokenizer(text, return_tensors='pt', truncation=True, padding=True, max_length=512)
-                with torch.no_grad():
-                    outputs = self.model(**inputs)
-                    embeddings = outputs.last_hidden_state.mean(dim=1)
-                return embeddings.numpy().flatten()
+            return self._encode(text)
         except Exception as e:
             logging.error(f"Error generating embedding: {e}")
             # Return random embedding as fallback
             return np.random.rand(384)
     
-    def add_email(self, email_data: Dict[str, Any]) -> str:
-        """Add an email to the RAG system"""
-        email_id = email_data.get('id', f"email_{len(self.email_documents)}")
+    def _get_query_embedding(self, query: str, generation: Optional[SearchGeneration] = None) -> np.ndarray:
+        """Embedding for a search query, served from the LRU cache when the query repeats
         
-        # Create text for embedding
-        email_text = f"Subject: {email_data.get('subject', '')} Body: {email_data.get('body', '')} Sender: {email_data.get('sender', '')}"
-        
-        email_doc = EmailDocument(
+        With a generation, the query is embedded by the model its vectors came from,
+        even if a reindex has swapped another one in since.
+        """
+        space, embedder = self.embedding_space, None
+        if generation is not None:
+            space, embedder = generation.embedding_space, generation.embedder
+        embedding = self._query_cache.get(space, query)
+        if embedding is not None:
+            return embedding
+        try:
+            embedding = embedder.encode([query], batch_size=1)[0] if embedder is not None else self._encode(query)
+        except Exception as e:
+            logging.error(f"Error generating query embedding: {e}")
+            # Random fallback, deliberately not cached
+            return np.random.rand(384)
+        self._query_cache.put(space, query, embedding)
+        return embedding
+    
+    def _get_embeddings(self, texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
+        """Generate embeddings for many texts, one forward pass per batch"""
+        batch_size = batch_size or self.embedding_batch_size
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        try:
+            self._ensure_model()
+            return np.asarray(self.embedder.encode(texts, batch_size=batch_size), dtype=np.float32)
+        except Exception as e:
+            logging.error(f"Error generating batch embeddings: {e}")
+            # Fall back to per-text embedding so one bad batch does not drop the others
+            return np.stack([self._get_embedding(text) for text in texts]).astype(np.float32)
+    
+    @staticmethod
+    def _email_text(email_data: Dict[str, Any]) -> str:
+        """Text that is embedded for an email"""
+        return f"Subject: {email_data.get('subject', '')} Body: {email_data.get('body', '')} Sender: {email_data.get('sender', '')}"
+    
+    @staticmethod
+    def _event_text(event_data: Dict[str, Any]) -> str:
+        """Text that is embedded for a calendar event"""
+        return f"Subject: {event_data.get('subject', '')} Body: {event_data.get('body', '')} Location: {event_data.get('location', '')} Organizer: {event_data.get('organizer', '')}"
+    
+    @staticmethod
+    def _build_email(email_data: Dict[str, Any], email_id: str, embedding: np.ndarray) -> EmailDocument:
+        return EmailDocument(
             id=email_id,
             subject=email_data.get('subject', ''),
             body=email_data.get('body', ''),
@@ -101,21 +424,12 @@ class OutlookRAGSystem:
             date=datetime.fromisoformat(email_data.get('date', datetime.now().isoformat())),
             folder=email_data.get('folder', 'Inbox'),
             importance=email_data.get('importance', 'Normal'),
-            embedding=self._get_embedding(email_text)
+            embedding=embedding
         )
-        
-        self.email_documents.append(email_doc)
-        logging.info(f"Added email: {email_doc.subject}")
-        return email_id
     
-    def add_calendar_event(self, event_data: Dict[str, Any]) -> str:
-        """Add a calendar event to the RAG system"""
-        event_id = event_data.get('id', f"event_{len(self.calendar_events)}")
-        
-        # Create text for embedding
-        event_text = f"Subject: {event_data.get('subject', '')} Body: {event_data.get('body', '')} Location: {event_data.get('location', '')} Organizer: {event_data.get('organizer', '')}"
-        
-        event = CalendarEvent(
+    @staticmethod
+    def _build_event(event_data: Dict[str, Any], event_id: str, embedding: np.ndarray) -> CalendarEvent:
+        return CalendarEvent(
             id=event_id,
             subject=event_data.get('subject', ''),
             body=event_data.get('body', ''),
@@ -125,136 +439,1290 @@ class OutlookRAGSystem:
             end_time=datetime.fromisoformat(event_data.get('end_time', (datetime.now() + timedelta(hours=1)).isoformat())),
             location=event_data.get('location', ''),
             category=event_data.get('category', 'Meeting'),
-            embedding=self._get_embedding(event_text)
+            embedding=embedding
         )
+    
+    def _corpus(self, corpus: str):
+        """(index, documents) of the 'emails' or 'events' corpus"""
+        if corpus == 'emails':
+            return self._email_index, self.email_documents
+        return self._event_index, self.calendar_events
+    
+    def _item_text(self, corpus: str, item: Dict[str, Any], body: Optional[str] = None) -> str:
+        """Embedded text of an item (dict or stored document), optionally for one passage of its body"""
+        if body is not None:
+            item = {**item, 'body': body}
+        return self._email_text(item) if corpus == 'emails' else self._event_text(item)
+    
+    def _document_text(self, corpus: str, document: Any, span: Optional[Tuple[int, int]] = None) -> str:
+        """Embedded text of a stored document or of one of its passages"""
+        fields = vars(document)
+        return self._item_text(corpus, fields, None if span is None else fields['body'][span[0]:span[1]])
+    
+    @staticmethod
+    def _keyword_text(corpus: str, document: Any) -> str:
+        """Fields indexed for keyword search"""
+        if corpus == 'emails':
+            return f"{document.subject}\n{document.body}\n{document.sender}"
+        return f"{document.subject}\n{document.body}\n{document.location}\n{document.organizer}"
+    
+    def _token_spans(self, text: str):
+        """Character spans of the embedding tokenizer's tokens, whitespace words without a fast tokenizer"""
+        try:
+            self._ensure_model()
+            return token_spans(self.embedder.tokenizer, text)
+        except Exception as e:
+            logging.error(f"Error tokenizing passage text: {e}")
+        return word_spans(text)
+    
+    def _passage_spans(self, body: str) -> List[Tuple[int, int]]:
+        return split_passages(body, self.passage_tokens, self.passage_overlap, self._token_spans)
+    
+    def _embed_texts(self, texts: List[str], batch_size: Optional[int] = None, digests: Optional[List[bytes]] = None,
+                     locations: Optional[List[Any]] = None, purges: Optional[int] = None):
+        """Embeddings and content digests for texts; only texts never seen before reach the model
+        
+        Returns (embeddings, digests, reused) where reused counts the texts served
+        from vectors already in the index. Locations looked up before purge number
+        `purges` are looked up again if a purge has renumbered the rows since.
+        """
+        if digests is None:
+            digests = [content_digest(text) for text in texts]
+        vectors: List[Optional[np.ndarray]] = [None] * len(texts)
+        with self._lock:
+            if locations is None or purges != self._purges:
+                locations = self._content_store.lookup(digests)
+            for position, location in enumerate(locations):
+                if location is not None:
+                    index, _ = self._corpus(location[0])
+                    vectors[position] = index.take(np.array([location[1]]))[0]
+        
+        # Embed each missing text once, even if it repeats within the batch
+        missing: Dict[bytes, List[int]] = {}
+        for position, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(digests[position], []).append(position)
+        if missing:
+            embedded = self._get_embeddings([texts[positions[0]] for positions in missing.values()], batch_size)
+            for positions, embedding in zip(missing.values(), embedded):
+                for position in positions:
+                    vectors[position] = embedding
         
-        self.calendar_events.append(event)
+        embeddings = np.stack(vectors).astype(np.float32) if vectors else np.empty((0, 0), dtype=np.float32)
+        return embeddings, digests, len(texts) - len(missing)
+    
+    def _append_documents(self, corpus: str, documents: List[Any], embeddings: np.ndarray,
+                          row_counts: Optional[List[int]] = None, spans: Optional[List[Tuple[int, int]]] = None,
+                          journal: bool = True, digests: Optional[List[bytes]] = None):
+        """Append documents with their passage rows to a corpus and, unless replaying, to the ingestion journal
+        
+        row_counts gives the number of passage rows of every document (default one);
+        spans the body span of every row, (0, -1) for a row covering the whole body.
+        """
+        row_counts = row_counts or [1] * len(documents)
+        if spans is None:
+            spans = [(0, -1)] * len(embeddings)
+        if digests is None:
+            owners = np.repeat(np.arange(len(documents)), row_counts)
+            digests = [content_digest(self._document_text(corpus, documents[owner], span if span[1] >= 0 else None))
+                       for owner, span in zip(owners.tolist(), spans)]
+        with self._lock:
+            index, stored = self._corpus(corpus)
+            first_position = len(stored)
+            stored.extend(documents)
+            # A document whose id is already indexed replaces (tombstones) the previous version
+            replaced = self._ids[corpus].add(first_position, [document.id for document in documents], row_counts)
+            rows = index.add_batch(embeddings, np.repeat(np.arange(first_position, first_position + len(documents)), row_counts))
+            self._passages[corpus].add(rows, spans)
+            self._content_store.add(corpus, rows, digests)
+            self._keyword[corpus].add_batch(first_position, (self._keyword_text(corpus, document) for document in documents))
+            self._metadata[corpus].add_batch(first_position, documents)
+            if corpus == 'events':
+                self._add_intervals(first_position, documents)
+            if self._quantized[corpus] is not None:
+                self._quantized[corpus].add(index.take(rows))
+            self._update_ann(corpus, rows, embeddings)
+            self._publish()
+            if journal and self._journal is not None:
+                first_row = 0
+                for document, count in zip(documents, row_counts):
+                    self._journal.append(corpus, document.to_record(), embeddings[first_row:first_row + count],
+                                         spans[first_row:first_row + count])
+                    first_row += count
+        if journal:
+            self._maybe_compact()
+            if replaced:
+                self._maybe_purge()
+    
+    def _add_intervals(self, first_position: int, events: List[CalendarEvent]):
+        self._intervals.add_batch(first_position,
+                                  np.array([to_timestamp(event.start_time) for event in events], dtype=np.int64),
+                                  np.array([to_timestamp(event.end_time) for event in events], dtype=np.int64))
+    
+    def _update_ann(self, corpus: str, rows: Optional[np.ndarray] = None, embeddings: Optional[np.ndarray] = None):
+        """Insert new rows into the corpus ANN index, training it once the corpus is large enough"""
+        if self.index_mode != "ivf":
+            return
+        ann = self._ann[corpus]
+        if ann is not None:
+            if rows is not None and len(rows):
+                ann.add(rows, normalize_rows(embeddings))
+            return
+        index, _ = self._corpus(corpus)
+        if len(index) >= self.ivf_min_rows:
+            ann = IVFIndex(nlist=self.ivf_nlist, nprobe=self.ivf_nprobe)
+            ann.train(index)
+            self._ann[corpus] = ann
+    
+    def _new_quantized(self) -> Optional[QuantizedIndex]:
+        if self.vector_storage == "float32":
+            return None
+        return QuantizedIndex(self.vector_storage, rerank_factor=self.rerank_factor)
+    
+    @contextmanager
+    def _one_generation(self):
+        """Publish the changes made inside as a single generation (call with the lock held)"""
+        self._publish_deferred += 1
+        try:
+            yield
+        finally:
+            self._publish_deferred -= 1
+            self._publish()
+    
+    def _publish(self):
+        """Make the current state searchable as a new generation (call with the lock held)"""
+        if self._publish_deferred:
+            return
+        corpora = {}
+        for corpus in ('emails', 'events'):
+            index, documents = self._corpus(corpus)
+            quantized = self._quantized[corpus]
+            corpora[corpus] = CorpusGeneration(copy.copy(index), documents.frozen(), self._ids[corpus].view(),
+                                               self._keyword[corpus].view(), self._metadata[corpus], self._passages[corpus],
+                                               copy.copy(quantized) if quantized is not None else None, self._ann[corpus])
+        number = self._generation.number + 1 if self._generation is not None else 1
+        self._generation = SearchGeneration(number, corpora, self._intervals, self.embedding_space, self.embedder)
+    
+    @staticmethod
+    def _search_rows(view: CorpusGeneration, query_embedding: np.ndarray, top_k: int, rows: Optional[np.ndarray] = None):
+        """(scores, rows) from the ANN index when one is trained, else from the compressed or exact scan
+        
+        `rows` restricts the scan to those rows (filtered search, never served by the ANN index).
+        """
+        if view.ann is not None and rows is None:
+            return view.ann.search(query_embedding, view.index, top_k)
+        if view.quantized is not None:
+            return view.quantized.search(query_embedding, view.index, top_k, rows=rows)
+        return view.index.search(query_embedding, top_k, rows=rows)
+    
+    def _ingest(self, corpus: str, items: List[Dict[str, Any]], batch_size: Optional[int] = None,
+                skip_unchanged: bool = False):
+        """Chunk, embed and append items; returns (documents added, embeddings reused, unchanged skipped)
+        
+        Every body is split into overlapping token-bounded passages, each embedded as
+        its own row. Passage texts already embedded reuse their stored vector. With
+        skip_unchanged, items whose passages are all already in the corpus are not
+        added again (mailbox re-sync).
+        """
+        item_spans = [self._passage_spans(item.get('body', '')) for item in items]
+        item_texts = [[self._item_text(corpus, item, item.get('body', '')[start:end]) for start, end in spans]
+                      for item, spans in zip(items, item_spans)]
+        item_digests = [[content_digest(text) for text in texts] for texts in item_texts]
+        with self._lock:
+            space, purges = self.embedding_space, self._purges
+            item_locations = [self._content_store.lookup(digests) for digests in item_digests]
+            keep = list(range(len(items)))
+            if skip_unchanged:
+                keep = [i for i in keep if not self._unchanged(corpus, items[i], item_digests[i], item_locations[i])]
+        texts = [text for i in keep for text in item_texts[i]]
+        # A body that fits in one passage is stored as a whole-body row
+        spans = [span for i in keep for span in (item_spans[i] if len(item_spans[i]) > 1 else [(0, -1)])]
+        embeddings, digests, reused = self._embed_texts(
+            texts, batch_size,
+            [digest for i in keep for digest in item_digests[i]],
+            [location for i in keep for location in item_locations[i]],
+            purges
+        )
+        
+        build = self._build_email if corpus == 'emails' else self._build_event
+        prefix = 'email' if corpus == 'emails' else 'event'
+        documents, row_counts, first_row = [], [], 0
+        for i in keep:
+            # With compressed storage the index holds the only copy of the vector
+            embedding = embeddings[first_row] if self.vector_storage == "float32" else None
+            # Generated ids must stay unique after a purge renumbers the positions
+            documents.append(build(items[i], items[i].get('id') or f"{prefix}_{uuid.uuid4().hex}", embedding))
+            row_counts.append(len(item_spans[i]))
+            first_row += len(item_spans[i])
+        with self._lock:
+            if self.embedding_space != space:
+                # A reindex swapped the embedder in while these were embedded with the old one
+                return self._ingest(corpus, items, batch_size, skip_unchanged)
+            if documents:
+                self._append_documents(corpus, documents, embeddings, row_counts, spans, digests=digests)
+        return documents, reused, len(items) - len(keep)
+    
+    def _unchanged(self, corpus: str, item: Dict[str, Any], digests: List[bytes], locations: List[Any]) -> bool:
+        """Whether an item is indexed as is (call with the lock held)
+        
+        With an id: its live version has the same passages and the same values for
+        every field the item carries (a moved email changes only its folder). Without
+        one: every passage belongs to a live document of the corpus.
+        """
+        index, stored = self._corpus(corpus)
+        ids = self._ids[corpus]
+        if item.get('id'):
+            position = ids.position(item['id'])
+            if position is None or not self._content_store.matches(corpus, index.rows_of_owners(np.array([position])), digests):
+                return False
+            build = self._build_email if corpus == 'emails' else self._build_event
+            record, stored_record = build(item, item['id'], None).to_record(), stored[position].to_record()
+            return all(record[field] == stored_record[field] for field in record if field in item)
+        if not all(location is not None and location[0] == corpus for location in locations):
+            return False
+        owners = index.owners_of(np.array([location[1] for location in locations], dtype=np.int64))
+        return len(ids.live(owners)) == len(owners)
+    
+    def add_email(self, email_data: Dict[str, Any]) -> str:
+        """Add an email to the RAG system"""
+        email_doc = self._ingest('emails', [email_data])[0][0]
+        logging.info(f"Added email: {email_doc.subject}")
+        return email_doc.id
+    
+    def add_calendar_event(self, event_data: Dict[str, Any]) -> str:
+        """Add a calendar event to the RAG system"""
+        event = self._ingest('events', [event_data])[0][0]
         logging.info(f"Added calendar event: {event.subject}")
-        return event_id
+        return event.id
     
-    def search_emails(self, query: str, top_k: int = 5) -> List[EmailDocument]:
-        """Search emails using semantic similarity"""
-        if not self.email_documents:
-            return []
+    def _record_ingest(self, kind: str, count: int, elapsed: float, reused: int = 0, unchanged: int = 0) -> Dict[str, Any]:
+        """Remember and log the throughput of a bulk ingestion"""
+        docs_per_sec = count / elapsed if elapsed > 0 else 0.0
+        self._last_ingest = {
+            "kind": kind,
+            "count": count,
+            "seconds": round(elapsed, 3),
+            "docs_per_sec": round(docs_per_sec, 1),
+            "reused_embeddings": reused,
+            "unchanged": unchanged
+        }
+        logging.info(f"Added {count} {kind} in {elapsed:.2f}s ({docs_per_sec:.1f} docs/sec, {reused} embeddings reused, {unchanged} unchanged skipped)")
+        return self._last_ingest
+    
+    def add_emails(self, emails: List[Dict[str, Any]], batch_size: Optional[int] = None,
+                   skip_unchanged: bool = False) -> List[str]:
+        """Add many emails, embedding their passages in batches
         
-        query_embedding = self._get_embedding(query)
-        similarities = []
+        Texts already embedded reuse their stored vector. With skip_unchanged, emails
+        whose exact text is already indexed are not added again (mailbox re-sync).
+        """
+        start_time = time.perf_counter()
+        email_docs, reused, unchanged = self._ingest('emails', emails, batch_size, skip_unchanged)
+        email_ids = [email_doc.id for email_doc in email_docs]
         
-        for email in self.email_documents:
-            if email.embedding is not None:
-                similarity = np.dot(query_embedding, email.embedding) / (
-                    np.linalg.norm(query_embedding) * np.linalg.norm(email.embedding)
-                )
-                similarities.append((similarity, email))
-        
-        # Sort by similarity and return top_k
-        similarities.sort(key=lambda x: x[0], reverse=True)
-        return [email for _, email in similarities[:top_k]]
-    
-    def search_calendar(self, query: str, top_k: int = 5) -> List[CalendarEvent]:
-        """Search calendar events using semantic similarity"""
-        if not self.calendar_events:
+        self._record_ingest("emails", len(email_ids), time.perf_counter() - start_time, reused, unchanged)
+        return email_ids
+    
+    def add_calendar_events(self, events: List[Dict[str, Any]], batch_size: Optional[int] = None,
+                            skip_unchanged: bool = False) -> List[str]:
+        """Add many calendar events, embedding their passages in batches
+        
+        Texts already embedded reuse their stored vector. With skip_unchanged, events
+        whose exact text is already indexed are not added again (calendar re-sync).
+        """
+        start_time = time.perf_counter()
+        events_added, reused, unchanged = self._ingest('events', events, batch_size, skip_unchanged)
+        event_ids = [event.id for event in events_added]
+        
+        self._record_ingest("events", len(event_ids), time.perf_counter() - start_time, reused, unchanged)
+        return event_ids
+    
+    def upsert_email(self, email_data: Dict[str, Any]) -> str:
+        """Add the email or replace the indexed version with the same id; an unchanged email is left as is"""
+        if not email_data.get('id'):
+            raise ValueError("Upserting an email requires its id")
+        self.add_emails([email_data], skip_unchanged=True)
+        return email_data['id']
+    
+    def upsert_calendar_event(self, event_data: Dict[str, Any]) -> str:
+        """Add the event or replace the indexed version with the same id; an unchanged event is left as is"""
+        if not event_data.get('id'):
+            raise ValueError("Upserting a calendar event requires its id")
+        self.add_calendar_events([event_data], skip_unchanged=True)
+        return event_data['id']
+    
+    def _delete(self, corpus: str, document_id: str) -> bool:
+        with self._lock:
+            if self._ids[corpus].delete(document_id) is None:
+                return False
+            if self._journal is not None:
+                self._journal.append_delete(corpus, document_id)
+            self._publish()
+        self._maybe_purge()
+        return True
+    
+    def delete_email(self, email_id: str) -> bool:
+        """Tombstone an email so searches skip it; False if no email has this id"""
+        return self._delete('emails', email_id)
+    
+    def delete_calendar_event(self, event_id: str) -> bool:
+        """Tombstone a calendar event so searches skip it; False if no event has this id"""
+        return self._delete('events', event_id)
+    
+    def submit_emails(self, emails: List[Dict[str, Any]], skip_unchanged: bool = False) -> str:
+        """Queue emails for background embedding; returns the ingest id to poll with ingest_status()"""
+        return self._ingest_queue.submit('emails', emails, skip_unchanged)
+    
+    def submit_calendar_events(self, events: List[Dict[str, Any]], skip_unchanged: bool = False) -> str:
+        """Queue calendar events for background embedding; returns the ingest id to poll with ingest_status()"""
+        return self._ingest_queue.submit('events', events, skip_unchanged)
+    
+    def ingest_status(self, ingest_id: str) -> Optional[Dict[str, Any]]:
+        """State ("queued", "running", "done" or "failed") and document ids of a queued ingestion"""
+        return self._ingest_queue.status(ingest_id)
+    
+    def pending_ingest(self) -> int:
+        """Queued documents whose vectors are not searchable yet"""
+        return self._ingest_queue.pending()
+    
+    def wait_for_ingest(self, timeout: Optional[float] = None) -> bool:
+        """Block until every queued document is searchable; False on timeout"""
+        return self._ingest_queue.wait(timeout)
+    
+    def _vector_ranking(self, view: CorpusGeneration, query_embedding: np.ndarray, depth: int,
+                        positions: Optional[np.ndarray] = None):
+        """(scores, document positions, best passage rows) by embedding similarity, best first
+        
+        Passage hits are pooled per document (passage_pooling "max" or "sum");
+        `positions` optionally restricts the search to those documents.
+        """
+        index, documents, ids = view.index, view.documents, view.ids
+        # Several rows may belong to one document, so fetch enough rows to fill depth documents
+        row_depth = depth if len(index) <= len(documents) else depth * self.PASSAGE_OVERFETCH
+        # Filtered: score only the rows of the matching documents
+        rows = None if positions is None else index.rows_of_owners(ids.live(positions))
+        if rows is None:
+            # Tombstoned rows stay in the matrix until the next purge, so fetch past every one of them
+            row_depth += ids.deleted_rows
+        scores, rows = self._search_rows(view, query_embedding, row_depth, rows)
+        owners = index.owners_of(rows)
+        if ids.deleted_documents:
+            alive = ids.live_mask(len(documents))[owners]
+            scores, owners, rows = scores[alive], owners[alive], rows[alive]
+        scores, owners, rows = pool_passages(scores, owners, rows, self.passage_pooling)
+        return scores[:depth], owners[:depth], rows[:depth]
+    
+    def _rank_documents(self, generation: SearchGeneration, corpus: str, query: str, top_k: int, mode: Optional[str] = None,
+                        filters: Optional[Dict[str, Any]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(positions, best passage rows) of the top_k documents for a query under the given mode and filters
+        
+        The row is -1 for documents found by keywords only.
+        """
+        mode = mode or self.retrieval_mode
+        if mode not in self.RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {mode}, expected one of {self.RETRIEVAL_MODES}")
+        view = generation.corpora[corpus]
+        positions = view.select(filters)
+        if positions is not None:
+            positions = view.ids.live(positions)
+            if positions.size == 0:
+                return positions, positions
+        # Keyword search skips tombstoned documents through the same mask as the filters
+        allowed = view.ids.live_mask(len(view.documents))
+        if positions is not None and mode != "vector":
+            allowed = np.zeros(len(view.documents), dtype=bool)
+            allowed[positions] = True
+        
+        if mode == "vector":
+            _, owners, rows = self._vector_ranking(view, self._get_query_embedding(query, generation), top_k, positions)
+            return owners, rows
+        if mode == "keyword":
+            owners = view.keyword.search(query, top_k, allowed)[1]
+            return owners, np.full(owners.shape, -1, dtype=np.int64)
+        
+        # Hybrid: fuse deeper candidate lists from both retrievers
+        depth = max(4 * top_k, 50)
+        vector_scores, vector_owners, vector_rows = self._vector_ranking(view, self._get_query_embedding(query, generation), depth, positions)
+        keyword_result = view.keyword.search(query, depth, allowed)
+        if self.fusion == "rrf":
+            _, fused = reciprocal_rank_fusion([vector_owners, keyword_result[1]])
+        else:
+            _, fused = weighted_fusion([(vector_scores, vector_owners), keyword_result], [self.hybrid_alpha, 1 - self.hybrid_alpha])
+        best_rows = dict(zip(vector_owners.tolist(), vector_rows.tolist()))
+        fused = fused[:top_k]
+        return fused, np.array([best_rows.get(position, -1) for position in fused.tolist()], dtype=np.int64)
+    
+    def _snippet(self, document: Any, span: Optional[Tuple[int, int]], query: str) -> str:
+        """Body text to show for a hit: its best-matching passage
+        
+        Keyword hits and rows stored without a passage span fall back to the body
+        passage sharing the most terms with the query.
+        """
+        if span is not None:
+            return document.body[span[0]:span[1]]
+        spans = split_passages(document.body, self.passage_tokens, self.passage_overlap)
+        if len(spans) == 1:
+            return document.body
+        terms = set(tokenize(query))
+        return max((document.body[start:end] for start, end in spans),
+                   key=lambda passage: sum(term in terms for term in tokenize(passage)))
+    
+    def _ranked_passages(self, document: Any, span: Optional[Tuple[int, int]], query: str) -> List[str]:
+        """Every passage of a hit's body: its best-matching one first, the others by shared query terms"""
+        best = self._snippet(document, span, query)
+        spans = split_passages(document.body, self.passage_tokens, self.passage_overlap)
+        terms = set(tokenize(query))
+        others = [document.body[start:end] for start, end in spans]
+        others.sort(key=lambda passage: -sum(term in terms for term in tokenize(passage)))
+        return [best] + [passage for passage in others if passage != best]
+    
+    def _context_builder(self, token_budget: Optional[int], count_tokens: Optional[Callable[[str], int]]) -> ContextBuilder:
+        return ContextBuilder(count_tokens or approximate_tokens, self.context_tokens if token_budget is None else token_budget,
+                              dedupe_threshold=self.context_dedupe_threshold)
+    
+    def _search(self, corpus: str, query: str, top_k: int, mode: Optional[str], filters: Optional[Dict[str, Any]]):
+        """[(document, body span of its best passage or None)] for a query
+        
+        Runs without the lock on the current generation, so concurrent ingestion,
+        deletes and purges neither block it nor show it a half-applied change.
+        """
+        generation = self._generation
+        view = generation.corpora[corpus]
+        if not view.documents:
             return []
+        positions, rows = self._rank_documents(generation, corpus, query, top_k, mode, filters)
+        return [(view.documents[position], view.span(row)) for position, row in zip(positions.tolist(), rows.tolist())]
+    
+    def search_emails(self, query: str, top_k: int = 5, mode: Optional[str] = None,
+                      filters: Optional[Dict[str, Any]] = None) -> List[EmailDocument]:
+        """Search emails by semantic similarity, BM25 keywords or both ("vector", "keyword", "hybrid")
         
-        query_embedding = self._get_embedding(query)
-        similarities = []
+        filters: date_from / date_to (ISO dates, inclusive), sender (substring), folder, importance.
+        """
+        return [email for email, _ in self._search('emails', query, top_k, mode, filters)]
+    
+    def search_calendar(self, query: str, top_k: int = 5, mode: Optional[str] = None,
+                        filters: Optional[Dict[str, Any]] = None) -> List[CalendarEvent]:
+        """Search calendar events by semantic similarity, BM25 keywords or both
         
-        for event in self.calendar_events:
-            if event.embedding is not None:
-                similarity = np.dot(query_embedding, event.embedding) / (
-                    np.linalg.norm(query_embedding) * np.linalg.norm(event.embedding)
-                )
-                similarities.append((similarity, event))
-        
-        # Sort by similarity and return top_k
-        similarities.sort(key=lambda x: x[0], reverse=True)
-        return [event for _, event in similarities[:top_k]]
-    
-    def query_inbox(self, question: str) -> Dict[str, Any]:
-        """Answer questions about inbox using RAG"""
-        relevant_emails = self.search_emails(question, top_k=3)
-        
-        context = "Relevant emails:\n"
-        for i, email in enumerate(relevant_emails):
-            context += f"Email {i+1}:\n"
-            context += f"From: {email.sender}\n"
-            context += f"Subject: {email.subject}\n"
-            context += f"Date: {email.date.strftime('%Y-%m-%d %H:%M')}\n"
-            context += f"Body: {email.body[:200]}...\n\n"
+        filters: date_from / date_to on the start time, organizer and location (substrings), category.
+        """
+        return [event for event, _ in self._search('events', query, top_k, mode, filters)]
+    
+    def query_inbox(self, question: str, mode: Optional[str] = None, filters: Optional[Dict[str, Any]] = None,
+                    token_budget: Optional[int] = None, count_tokens: Optional[Callable[[str], int]] = None) -> Dict[str, Any]:
+        """Answer questions about inbox using RAG
+        
+        The context holds as many of the best hits' passages as fit in token_budget
+        tokens (default context_tokens) counted with count_tokens, ideally the serving
+        model's tokenizer; "context_tokens" reports what every email used.
+        """
+        hits = self._search('emails', question, self.context_max_sources, mode, filters)
+        sources = [
+            ContextSource(email.id, f"From: {email.sender}\nSubject: {email.subject}\nDate: {email.date.strftime('%Y-%m-%d %H:%M')}\n",
+                          self._ranked_passages(email, span, question), len(email.body))
+            for email, span in hits
+        ]
+        context, report = self._context_builder(token_budget, count_tokens).build("Relevant emails:\n", sources, "Email")
+        emails = {email.id: email for email, _ in hits}
+        packed = {source.id: source for source in sources}
         
         return {
             "question": question,
             "context": context,
+            "context_tokens": report,
             "relevant_emails": [
                 {
-                    "id": email.id,
-                    "subject": email.subject,
-                    "sender": email.sender,
-                    "date": email.date.isoformat(),
-                    "folder": email.folder
-                } for email in relevant_emails
+                    "id": used["id"],
+                    "subject": emails[used["id"]].subject,
+                    "sender": emails[used["id"]].sender,
+                    "date": emails[used["id"]].date.isoformat(),
+                    "folder": emails[used["id"]].folder,
+                    "snippet": packed[used["id"]].passages[0],
+                    "tokens": used["tokens"]
+                } for used in report["sources"]
             ]
         }
     
-    def query_calendar(self, question: str) -> Dict[str, Any]:
-        """Answer questions about calendar using RAG"""
-        relevant_events = self.search_calendar(question, top_k=3)
+    @staticmethod
+    def _filtered_events(view: CorpusGeneration, positions: np.ndarray, filters: Optional[Dict[str, Any]]) -> List[CalendarEvent]:
+        positions = view.ids.live(positions)
+        selected = view.select(filters)
+        if selected is not None:
+            positions = positions[np.isin(positions, selected)]
+        return [view.documents[position] for position in positions.tolist()]
+    
+    def events_between(self, start, end, filters: Optional[Dict[str, Any]] = None) -> List[CalendarEvent]:
+        """Events overlapping [start, end) ordered by start time (datetimes or ISO strings)"""
+        generation = self._generation
+        return self._filtered_events(generation.events, generation.overlapping(to_timestamp(start), to_timestamp(end)), filters)
+    
+    def upcoming_events(self, limit: int = 5, after=None, filters: Optional[Dict[str, Any]] = None) -> List[CalendarEvent]:
+        """The next `limit` events starting at or after `after` (default: now)"""
+        after = to_timestamp(after if after is not None else datetime.now())
+        generation = self._generation
+        # Filtered or tombstoned events may be many, so read further ahead until enough remain
+        depth = limit
+        while True:
+            positions, more = generation.upcoming(after, depth)
+            events = self._filtered_events(generation.events, positions, filters)
+            if len(events) >= limit or not more:
+                return events[:limit]
+            depth *= 4
+    
+    def calendar_conflicts(self, start, end) -> List[Tuple[CalendarEvent, CalendarEvent]]:
+        """Pairs of events in [start, end) that overlap each other"""
+        generation = self._generation
+        view = generation.events
+        live = view.ids.live_mask(len(view.documents))
+        return [(view.documents[first], view.documents[second])
+                for first, second in generation.conflicts(to_timestamp(start), to_timestamp(end))
+                if live is None or (live[first] and live[second])]
+    
+    @staticmethod
+    def _question_window(question: str, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+        """Time window a calendar question refers to: tomorrow, this/next week, else today"""
+        now = now or datetime.now()
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        question = question.lower()
+        if "tomorrow" in question:
+            return today + timedelta(days=1), today + timedelta(days=2)
+        week_start = today - timedelta(days=today.weekday())
+        if "next week" in question:
+            return week_start + timedelta(days=7), week_start + timedelta(days=14)
+        if "this week" in question or "week" in question:
+            return week_start, week_start + timedelta(days=7)
+        return today, today + timedelta(days=1)
+    
+    def query_calendar(self, question: str, mode: Optional[str] = None, filters: Optional[Dict[str, Any]] = None,
+                       start=None, end=None, limit: int = 5, token_budget: Optional[int] = None,
+                       count_tokens: Optional[Callable[[str], int]] = None) -> Dict[str, Any]:
+        """Answer questions about calendar using RAG
         
-        context = "Relevant calendar events:\n"
-        for i, event in enumerate(relevant_events):
-            context += f"Event {i+1}:\n"
-            context += f"Subject: {event.subject}\n"
-            context += f"Organizer: {event.organizer}\n"
-            context += f"Start: {event.start_time.strftime('%Y-%m-%d %H:%M')}\n"
-            context += f"End: {event.end_time.strftime('%Y-%m-%d %H:%M')}\n"
-            context += f"Location: {event.location}\n"
-            context += f"Description: {event.body[:200]}...\n\n"
+        Modes "window" (events in start..end), "upcoming" (next `limit` events after
+        start, default now) and "conflicts" (overlapping events in start..end) read the
+        interval index; without start/end the window is taken from the question.
+        Any other mode ranks events by similarity. Events are packed into the context
+        as in query_inbox, within token_budget tokens.
+        """
+        conflicts: List[Tuple[CalendarEvent, CalendarEvent]] = []
+        passages: Optional[List[List[str]]] = None
+        if mode == "upcoming":
+            relevant_events = self.upcoming_events(limit, after=start, filters=filters)
+            header = "Upcoming calendar events:\n"
+        elif mode in self.CALENDAR_MODES:
+            if start is None or end is None:
+                start, end = self._question_window(question)
+            start, end = to_datetime(start), to_datetime(end)
+            relevant_events = self.events_between(start, end, filters)
+            header = f"Calendar events from {start.strftime('%Y-%m-%d %H:%M')} to {end.strftime('%Y-%m-%d %H:%M')}:\n"
+            if mode == "conflicts":
+                conflicts = self.calendar_conflicts(start, end)
+        else:
+            hits = self._search('events', question, self.context_max_sources, mode, filters)
+            relevant_events = [event for event, _ in hits]
+            passages = [self._ranked_passages(event, span, question) for event, span in hits]
+            header = "Relevant calendar events:\n"
+        if passages is None:
+            # Time-ordered events keep their body passages in order
+            passages = [[event.body[start:end] for start, end in split_passages(event.body, self.passage_tokens, self.passage_overlap)]
+                        for event in relevant_events]
         
-        return {
+        conflict_lines = ""
+        if conflicts:
+            conflict_lines = "Conflicting events:\n"
+            for first, second in conflicts:
+                conflict_lines += f"'{first.subject}' ({first.start_time.strftime('%Y-%m-%d %H:%M')}-{first.end_time.strftime('%H:%M')}) overlaps '{second.subject}' ({second.start_time.strftime('%Y-%m-%d %H:%M')}-{second.end_time.strftime('%H:%M')})\n"
+        builder = self._context_builder(token_budget, count_tokens)
+        # The conflict list is always included, so the events share what budget it leaves
+        builder.budget_tokens = max(builder.budget_tokens - builder.count_tokens(conflict_lines), 0)
+        sources = [
+            ContextSource(event.id, f"Subject: {event.subject}\nOrganizer: {event.organizer}\n"
+                                    f"Start: {event.start_time.strftime('%Y-%m-%d %H:%M')}\nEnd: {event.end_time.strftime('%Y-%m-%d %H:%M')}\n"
+                                    f"Location: {event.location}\n",
+                          event_passages, len(event.body), label="Description")
+            for event, event_passages in zip(relevant_events, passages)
+        ]
+        context, report = builder.build(header, sources, "Event")
+        context += conflict_lines
+        events = {event.id: event for event in relevant_events}
+        
+        result = {
             "question": question,
             "context": context,
+            "context_tokens": report,
             "relevant_events": [
                 {
-                    "id": event.id,
-                    "subject": event.subject,
-                    "organizer": event.organizer,
-                    "start_time": event.start_time.isoformat(),
-                    "end_time": event.end_time.isoformat(),
-                    "location": event.location
-                } for event in relevant_events
+                    "id": used["id"],
+                    "subject": events[used["id"]].subject,
+                    "organizer": events[used["id"]].organizer,
+                    "start_time": events[used["id"]].start_time.isoformat(),
+                    "end_time": events[used["id"]].end_time.isoformat(),
+                    "location": events[used["id"]].location,
+                    "tokens": used["tokens"]
+                } for used in report["sources"]
             ]
         }
+        if mode == "conflicts":
+            result["conflicts"] = [[first.id, second.id] for first, second in conflicts]
+        return result
     
     def save_embeddings_cache(self):
-        """Save embeddings to cache file"""
+        """Fold everything ingested so far into a new memory-mapped snapshot"""
         try:
-            cache_data = {
-                'emails': self.email_documents,
-                'events': self.calendar_events
-            }
-            with open(self.embeddings_cache_file, 'wb') as f:
-                pickle.dump(cache_data, f)
-            logging.info("Embeddings cache saved successfully")
+            self._compact()
+            logging.info("Embeddings snapshot saved successfully")
         except Exception as e:
-            logging.error(f"Error saving embeddings cache: {e}")
+            logging.error(f"Error saving embeddings snapshot: {e}")
+    
+    def _maybe_compact(self):
+        """Start a background compaction once the journal passes its size threshold"""
+        if self._journal is None or self._journal.size < self.journal_compaction_bytes:
+            return
+        with self._lock:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+            self._compaction_thread = threading.Thread(target=self._background_compact, name="snapshot-compaction", daemon=True)
+            self._compaction_thread.start()
+    
+    def _background_compact(self):
+        try:
+            self._compact()
+        except Exception as e:
+            logging.error(f"Error compacting ingestion journal: {e}")
+    
+    def _purge_due(self, corpus: str) -> bool:
+        ids = self._ids[corpus]
+        return ids.deleted_documents > 0 and ids.deleted_documents >= max(
+            self.tombstone_compaction_min, self.tombstone_compaction_ratio * len(ids))
+    
+    def _maybe_purge(self):
+        """Start a background purge once the tombstones of a corpus pass their threshold"""
+        if self.reindexing() or not any(self._purge_due(corpus) for corpus in self._ids):
+            return
+        with self._lock:
+            if self._purge_thread is not None and self._purge_thread.is_alive():
+                return
+            self._purge_thread = threading.Thread(target=self._background_purge, name="tombstone-purge", daemon=True)
+            self._purge_thread.start()
+    
+    def _background_purge(self):
+        try:
+            self.purge_deleted()
+        except Exception as e:
+            logging.error(f"Error purging deleted documents: {e}")
+    
+    def purge_deleted(self) -> int:
+        """Rebuild the corpora without tombstoned documents and their rows; returns the documents dropped
+        
+        Like compaction, the new matrices, metadata and indexes are built into a new
+        snapshot while ingestion and searches continue; documents added meanwhile are
+        carried over on top of it and deletes made meanwhile are applied again. Positions
+        are renumbered, so in-flight ingestion looks its reused vectors up again.
+        """
+        with self._compaction_lock:
+            with self._lock:
+                # A running reindex tells added documents from planned ones by position
+                if self.reindexing() or not any(ids.deleted_documents for ids in self._ids.values()):
+                    return 0
+                sealed = self._journal.rotate() if self._journal is not None else self._snapshot_generation
+                captured = {}
+                for corpus in ('emails', 'events'):
+                    index, documents = self._corpus(corpus)
+                    quantized, ann = self._quantized[corpus], self._ann[corpus]
+                    captured[corpus] = {
+                        "index": copy.copy(index),
+                        "documents": documents.frozen(),
+                        "deleted": self._ids[corpus].deleted_mask(len(documents)),
+                        "digests": self._content_store.state(corpus, len(index)),
+                        "passages": self._passages[corpus].state(len(index)),
+                        "quantized": quantized.state(rows=len(index)) if quantized is not None else None,
+                        "ann": ann.state(rows=len(index)) if ann is not None else None
+                    }
+            
+            corpora, arrays, new_positions = {}, {}, {}
+            for corpus, state in captured.items():
+                index, documents, positions = self._purged_corpus(corpus, state, arrays)
+                to_record = EmailDocument.to_record if corpus == 'emails' else CalendarEvent.to_record
+                corpora[corpus] = (index, documents, to_record)
+                new_positions[corpus] = positions
+            self.layout = uuid.uuid4().hex
+            write_snapshot(self.snapshot_dir, self.embedding_space, corpora,
+                           extra={"journal_generation": sealed, **self._embedder_manifest()}, arrays=arrays)
+            
+            dropped = 0
+            with self._lock:
+                carried = {}
+                for corpus, state in captured.items():
+                    index, documents = self._corpus(corpus)
+                    first_row, first_position = len(state["index"]), len(state["documents"])
+                    vectors, owners = index.rows_from(first_row)
+                    carried[corpus] = (
+                        documents[first_position:], vectors, np.bincount(owners - first_position, minlength=len(documents) - first_position),
+                        [self._passages[corpus].span(row) or (0, -1) for row in range(first_row, len(index))],
+                        self._content_store.state(corpus, len(index))[first_row:].tolist(),
+                        # Tombstoned while the new snapshot was written
+                        np.flatnonzero(self._ids[corpus].deleted_mask(len(documents))[:first_position] & ~state["deleted"]),
+                        np.flatnonzero(self._ids[corpus].deleted_mask(len(documents))[first_position:])
+                    )
+                    dropped += int(state["deleted"].sum())
+                # Searches go from the old generation straight to the purged one with the tail and deletes applied
+                with self._one_generation():
+                    self._open_snapshot()
+                    for corpus, (documents, vectors, row_counts, spans, digests, deleted_before, deleted_after) in carried.items():
+                        first_position = len(self._corpus(corpus)[1])
+                        if documents:
+                            self._append_documents(corpus, documents, vectors, row_counts.tolist(), spans, journal=False, digests=digests)
+                        for position in new_positions[corpus][deleted_before].tolist():
+                            self._ids[corpus].tombstone(position)
+                        for position in deleted_after.tolist():
+                            self._ids[corpus].tombstone(first_position + position)
+                self._purges += 1
+            remove_journals(self.snapshot_dir, sealed)
+            logging.info(f"Purged {dropped} deleted documents")
+            return dropped
+    
+    def _purged_corpus(self, corpus: str, state: Dict[str, Any], arrays: Dict[str, np.ndarray]):
+        """(index, documents, old -> new positions) of a captured corpus without its tombstoned documents
+        
+        The aux arrays of the new snapshot are added to `arrays`, so opening it restores
+        every index without rebuilding it.
+        """
+        index, documents, deleted = state["index"], state["documents"], state["deleted"]
+        keep = np.flatnonzero(~deleted)
+        new_positions = np.full(len(documents), -1, dtype=np.int64)
+        new_positions[keep] = np.arange(len(keep))
+        owners = index.owners
+        rows = np.flatnonzero(~deleted[owners])
+        
+        purged = VectorIndex(dim=index.dim, initial_capacity=len(rows))
+        for start in range(0, len(rows), 65536):
+            chunk = rows[start:start + 65536]
+            purged.add_batch(index.take(chunk), new_positions[owners[chunk]])
+        live = DocumentList()
+        live.extend(documents[position] for position in keep.tolist())
+        
+        arrays[f"{corpus}.digests"] = state["digests"][rows]
+        for name, array in state["passages"].items():
+            arrays[f"{corpus}.passage_{name}"] = array[rows]
+        self._document_arrays(corpus, live, np.bincount(purged.owners, minlength=len(live)), arrays)
+        if state["quantized"] is not None:
+            arrays[f"{corpus}.quantized_codes"] = state["quantized"]["codes"][rows]
+            arrays[f"{corpus}.quantized_scales"] = state["quantized"]["scales"][rows]
+        if state["ann"] is not None:
+            arrays[f"{corpus}.ivf_centroids"] = state["ann"]["centroids"]
+            arrays[f"{corpus}.ivf_assignments"] = state["ann"]["assignments"][rows]
+        return purged, live, new_positions
+    
+    def _document_arrays(self, corpus: str, documents, row_counts: np.ndarray, arrays: Dict[str, np.ndarray]):
+        """Add the BM25, metadata, interval and id arrays of a rebuilt corpus to the arrays of its snapshot"""
+        keyword = KeywordIndex()
+        keyword.add_batch(0, (self._keyword_text(corpus, document) for document in documents))
+        for name, array in keyword.state().items():
+            arrays[f"{corpus}.bm25_{name}"] = array
+        metadata = self._new_metadata(corpus)
+        metadata.add_batch(0, documents)
+        for name, array in metadata.state().items():
+            arrays[f"{corpus}.meta_{name}"] = array
+        if corpus == 'events':
+            intervals = IntervalIndex()
+            intervals.add_batch(0, np.array([to_timestamp(event.start_time) for event in documents], dtype=np.int64),
+                                np.array([to_timestamp(event.end_time) for event in documents], dtype=np.int64))
+            for name, array in intervals.state().items():
+                arrays[f"events.interval_{name}"] = array
+        ids = DocumentIds.from_ids([document.id for document in documents], row_counts)
+        for name, array in ids.state().items():
+            arrays[f"{corpus}.ids_{name}"] = array
+    
+    def reindexing(self) -> bool:
+        return self._reindexer is not None and self._reindexer.get_stats()["phase"] not in ("done", "failed")
+    
+    def reindex_status(self) -> Optional[Dict[str, Any]]:
+        """Progress of the running (or last) reindex, None if there was none"""
+        return self._reindexer.get_stats() if self._reindexer is not None else None
+    
+    def reindex(self, backend: Optional[str] = None, model_name: Optional[str] = None, options: Optional[Dict[str, Any]] = None,
+                workers: Optional[int] = None, threads_per_worker: Optional[int] = None, chunk_size: int = 512) -> Dict[str, Any]:
+        """Re-embed every live document, in parallel worker processes, and swap the result in
+        
+        The target defaults to the configured embedder when the snapshot still holds
+        another one's vectors (pending_migration), else to the current embedder
+        (rebuild). Searches and ingestion continue on the current index meanwhile;
+        see reindex.Reindexer for the phases and resuming. Returns the final status.
+        """
+        from reindex import Reindexer
+        target = self.pending_migration or {"backend": self.embedder_backend, "model_name": self.model_name,
+                                            "options": self.embedder_options}
+        reindexer = Reindexer(self, backend or target["backend"], model_name or target["model_name"],
+                              target["options"] if options is None else options, workers=workers,
+                              threads_per_worker=threads_per_worker, chunk_size=chunk_size)
+        # Taken with the compaction lock, so the plan never sees a purge half done
+        with self._compaction_lock:
+            with self._lock:
+                if self.reindexing():
+                    raise RuntimeError("A reindex is already running")
+                self._reindexer = reindexer
+        return reindexer.run()
+    
+    def reindex_source(self) -> Tuple[str, Dict[str, List[str]], Dict[str, int]]:
+        """(layout, live ids, document count) of every corpus, frozen as a reindex plan"""
+        with self._lock:
+            return (self.layout, {corpus: ids.live_ids() for corpus, ids in self._ids.items()},
+                    {corpus: len(self._corpus(corpus)[1]) for corpus in self._ids})
+    
+    def reindex_records(self, corpus: str, ids: List[str]) -> List[Tuple[str, Dict[str, Any]]]:
+        """(id, record) of the documents still live under these ids"""
+        with self._lock:
+            _, documents = self._corpus(corpus)
+            positions = [(document_id, self._ids[corpus].position(document_id)) for document_id in ids]
+            return [(document_id, documents[position].to_record()) for document_id, position in positions if position is not None]
+    
+    def reindex_embedder(self, backend: str, model_name: str, options: Dict[str, Any]) -> Embedder:
+        return load_embedding_model(model_name, backend, **options)
+    
+    def _reindex_tail(self, corpus: str, start: int, end: int) -> List[Dict[str, Any]]:
+        """Records of the live documents at positions [start, end) (call with the lock held)"""
+        _, documents = self._corpus(corpus)
+        live = self._ids[corpus].live(np.arange(start, end))
+        return [documents[position].to_record() for position in live.tolist()]
+    
+    def install_reindex(self, reindexer, progress: Optional[Callable[[str], None]] = None):
+        """Assemble the chunks of a finished reindex into a snapshot and swap it in
+        
+        The snapshot is written under the staging directory while the current index
+        keeps serving. Documents added since the plan are embedded with the new
+        embedder, the last of them under the lock; then the journal moves to the new
+        embedding space, the snapshot becomes the current one and deletes made since
+        the plan are applied again.
+        """
+        from reindex import embed_records
+        plan = reindexer.plan
+        from_records = {'emails': EmailDocument.from_record, 'events': CalendarEvent.from_record}
+        to_records = {'emails': EmailDocument.to_record, 'events': CalendarEvent.to_record}
+        corpora, arrays = {}, {}
+        for corpus, from_record in from_records.items():
+            index, documents = VectorIndex(), DocumentList()
+            row_counts, starts, ends, digests = [], [], [], []
+            for chunk in reindexer.chunks(corpus):
+                if not chunk["records"]:
+                    continue
+                first_position = len(documents)
+                documents.extend(from_record(record) for record in chunk["records"])
+                index.add_batch(chunk["vectors"], np.repeat(np.arange(first_position, len(documents)), chunk["row_counts"]))
+                row_counts.append(chunk["row_counts"])
+                starts.append(chunk["starts"])
+                ends.append(chunk["ends"])
+                digests.append(chunk["digests"])
+            concatenated = lambda parts, dtype: np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+            arrays[f"{corpus}.digests"] = concatenated(digests, DIGEST_DTYPE)
+            arrays[f"{corpus}.passage_starts"] = concatenated(starts, np.int64)
+            arrays[f"{corpus}.passage_ends"] = concatenated(ends, np.int64)
+            self._document_arrays(corpus, documents, concatenated(row_counts, np.int64), arrays)
+            if self.vector_storage != "float32":
+                state = QuantizedIndex.from_index(index, precision=self.vector_storage).state()
+                arrays[f"{corpus}.quantized_codes"], arrays[f"{corpus}.quantized_scales"] = state["codes"], state["scales"]
+            if self.index_mode == "ivf" and len(index) >= self.ivf_min_rows:
+                ann = IVFIndex(nlist=self.ivf_nlist, nprobe=self.ivf_nprobe)
+                ann.train(index)
+                state = ann.state()
+                arrays[f"{corpus}.ivf_centroids"], arrays[f"{corpus}.ivf_assignments"] = state["centroids"], state["assignments"]
+            corpora[corpus] = (index, documents, to_records[corpus])
+        layout = uuid.uuid4().hex
+        embedder_entry = {"backend": reindexer.backend, "model_name": reindexer.model_name, "options": reindexer.options}
+        directory = write_snapshot(os.path.join(reindexer.directory, "snapshot"), reindexer.embedding_space, corpora,
+                                   extra={"embedder": embedder_entry, "layout": layout}, arrays=arrays)
+        
+        if progress is not None:
+            progress("swapping")
+        embedder = self.reindex_embedder(reindexer.backend, reindexer.model_name, reindexer.options)
+        embed = lambda corpus, records: embed_records(embedder, corpus, records, self.passage_tokens, self.passage_overlap,
+                                                      self.embedding_batch_size)
+        # Documents added since the plan: embed what is there now without the lock, the rest under it
+        with self._lock:
+            if self.layout != plan["layout"]:
+                raise RuntimeError("Documents were renumbered during the reindex")
+            seen = {corpus: len(self._corpus(corpus)[1]) for corpus in from_records}
+            tail = {corpus: self._reindex_tail(corpus, plan["source_documents"][corpus], seen[corpus]) for corpus in from_records}
+        tail = {corpus: (records, embed(corpus, records)) for corpus, records in tail.items()}
+        
+        with self._compaction_lock:
+            with self._lock:
+                for corpus in from_records:
+                    records = self._reindex_tail(corpus, seen[corpus], len(self._corpus(corpus)[1]))
+                    if records:
+                        result = embed(corpus, records)
+                        earlier_records, earlier = tail[corpus]
+                        tail[corpus] = (earlier_records + records,
+                                        {name: np.concatenate([earlier[name], result[name]]) if len(earlier[name]) else result[name]
+                                         for name in result})
+                old_ids = self._ids
+                sealed = self._journal.rotate(reindexer.embedding_space) if self._journal is not None else self._snapshot_generation
+                publish_snapshot(self.snapshot_dir, directory, extra={"journal_generation": sealed})
+                
+                self.embedder_backend, self.model_name = reindexer.backend, reindexer.model_name
+                self.embedder_options, self.embedding_space = dict(reindexer.options), reindexer.embedding_space
+                self.embedder = embedder
+                self.pending_migration = None
+                self._content_store = ContentStore(self.embedding_space)
+                self._quantized = {corpus: self._new_quantized() for corpus in from_records}
+                self._ann = {corpus: None for corpus in from_records}
+                with self._one_generation():
+                    self._open_snapshot()
+                    for corpus, (records, result) in tail.items():
+                        if records:
+                            self._append_documents(corpus, [from_records[corpus](record) for record in records], result["vectors"],
+                                                   result["row_counts"].tolist(), np.stack([result["starts"], result["ends"]], axis=1).tolist(),
+                                                   digests=result["digests"].tolist())
+                        for document_id in plan["ids"][corpus]:
+                            if old_ids[corpus].position(document_id) is None and self._ids[corpus].delete(document_id) is not None:
+                                if self._journal is not None:
+                                    self._journal.append_delete(corpus, document_id)
+                self._purges += 1
+            remove_journals(self.snapshot_dir, sealed)
+        logging.info(f"Swapped in the reindexed snapshot ({self.embedding_space})")
+    
+    def _compact(self):
+        """Write a snapshot covering every sealed journal generation, then drop those journals
+        
+        Ingestion continues meanwhile: documents added after the journal rotation are
+        carried over on top of the new snapshot and stay in the new journal generation.
+        """
+        with self._compaction_lock:
+            with self._lock:
+                sealed = self._journal.rotate() if self._journal is not None else self._snapshot_generation
+                corpora = {
+                    'emails': (copy.copy(self._email_index), self.email_documents.frozen(), EmailDocument.to_record),
+                    'events': (copy.copy(self._event_index), self.calendar_events.frozen(), CalendarEvent.to_record)
+                }
+                arrays = {}
+                for corpus, (index, _, _) in corpora.items():
+                    arrays[f"{corpus}.digests"] = self._content_store.state(corpus, len(index))
+                    for name, array in self._passages[corpus].state(len(index)).items():
+                        arrays[f"{corpus}.passage_{name}"] = array
+                for corpus, (_, documents, _) in corpora.items():
+                    for name, array in self._keyword[corpus].state(len(documents)).items():
+                        arrays[f"{corpus}.bm25_{name}"] = array
+                    for name, array in self._metadata[corpus].state(len(documents)).items():
+                        arrays[f"{corpus}.meta_{name}"] = array
+                for name, array in self._intervals.state(len(corpora['events'][1])).items():
+                    arrays[f"events.interval_{name}"] = array
+                for corpus, (_, documents, _) in corpora.items():
+                    for name, array in self._ids[corpus].state(len(documents)).items():
+                        arrays[f"{corpus}.ids_{name}"] = array
+                for corpus, quantized in self._quantized.items():
+                    if quantized is not None:
+                        state = quantized.state(rows=len(corpora[corpus][0]))
+                        arrays[f"{corpus}.quantized_codes"] = state["codes"]
+                        arrays[f"{corpus}.quantized_scales"] = state["scales"]
+                for corpus, ann in self._ann.items():
+                    if ann is not None:
+                        state = ann.state(rows=len(corpora[corpus][0]))
+                        arrays[f"{corpus}.ivf_centroids"] = state["centroids"]
+                        arrays[f"{corpus}.ivf_assignments"] = state["assignments"]
+            
+            write_snapshot(self.snapshot_dir, self.embedding_space, corpora,
+                           extra={"journal_generation": sealed, **self._embedder_manifest()}, arrays=arrays)
+            
+            with self._lock:
+                self._open_snapshot(carry_over=True)
+            remove_journals(self.snapshot_dir, sealed)
+            self._compactions += 1
+    
+    def _open_snapshot(self, carry_over: bool = False) -> bool:
+        """Map the current snapshot; documents and vector pages are only read when touched
+        
+        With carry_over, rows and documents beyond the snapshot are moved on top of it.
+        """
+        snapshot = load_snapshot(self.snapshot_dir, {
+            'emails': EmailDocument.from_record,
+            'events': CalendarEvent.from_record
+        }, verify=self.verify_snapshot)
+        if snapshot is None:
+            return False
+        
+        manifest, corpora = snapshot
+        if manifest["model_name"] != self.embedding_space:
+            logging.warning(f"Ignoring embeddings snapshot built with {manifest['model_name']}, current model is {self.embedding_space}")
+            return False
+        
+        for corpus, (index, lazy_documents) in corpora.items():
+            documents = DocumentList(lazy_documents)
+            if carry_over:
+                old_index, old_documents = self._corpus(corpus)
+                documents.extend(old_documents[len(lazy_documents):])
+                vectors, owners = old_index.rows_from(len(index))
+                index.add_batch(vectors, owners)
+            else:
+                # Rows and positions survive compaction, so digests, BM25 and ANN state are only restored on a cold load
+                digests = load_snapshot_array(manifest, f"{corpus}.digests", mmap_mode=None)
+                if digests is None or digests.shape[0] != len(index):
+                    digests = self._backfill_digests(corpus, index, lazy_documents, self._load_passages(manifest, corpus, len(index)))
+                self._content_store.attach(corpus, digests, len(index))
+                self._passages[corpus] = self._load_passages(manifest, corpus, len(index))
+                self._keyword[corpus] = self._load_keyword_index(manifest, corpus, documents)
+                self._metadata[corpus] = self._load_metadata_index(manifest, corpus, documents)
+                if corpus == 'events':
+                    self._intervals = self._load_intervals(manifest, documents)
+                if self.vector_storage != "float32":
+                    self._quantized[corpus] = self._load_quantized(manifest, corpus, index)
+                if self.index_mode == "ivf":
+                    self._ann[corpus] = self._load_ann(manifest, corpus, len(index))
+                self._ids[corpus] = self._load_ids(manifest, corpus, lazy_documents, index)
+            if corpus == 'emails':
+                self._email_index, self.email_documents = index, documents
+            else:
+                self._event_index, self.calendar_events = index, documents
+            self._snapshot_documents[corpus] = len(lazy_documents)
+        self._snapshot_generation = manifest.get("journal_generation", 0)
+        if not carry_over:
+            self.layout = manifest.get("layout", os.path.basename(manifest["directory"]))
+        self._publish()
+        return True
+    
+    def _backfill_digests(self, corpus: str, index: VectorIndex, documents, passages: Optional[PassageTable] = None) -> np.ndarray:
+        """Content digests for a snapshot written before digests were persisted"""
+        owners = index.owners
+        passages = passages or PassageTable()
+        logging.info(f"Computing content digests for {len(owners)} {corpus} rows")
+        return np.array([content_digest(self._document_text(corpus, documents[int(owner)], passages.span(row)))
+                         for row, owner in enumerate(owners)], dtype=DIGEST_DTYPE)
+    
+    def _load_passages(self, manifest: Dict[str, Any], corpus: str, rows: int) -> PassageTable:
+        """Restore the persisted passage spans; snapshots without them hold one whole-body row per document"""
+        state = {name: load_snapshot_array(manifest, f"{corpus}.passage_{name}", mmap_mode=None) for name in ("starts", "ends")}
+        if all(array is not None for array in state.values()) and state["starts"].shape[0] == rows:
+            return PassageTable.from_state(state)
+        passages = PassageTable()
+        passages.add(np.arange(rows), None)
+        return passages
+    
+    def _load_keyword_index(self, manifest: Dict[str, Any], corpus: str, documents) -> KeywordIndex:
+        """Restore the persisted BM25 index, or build it from the documents if it is missing or stale"""
+        state = {name: load_snapshot_array(manifest, f"{corpus}.bm25_{name}", mmap_mode='r')
+                 for name in ("terms", "term_offsets", "posting_offsets", "postings", "frequencies", "doc_lengths")}
+        if all(array is not None for array in state.values()) and state["doc_lengths"].shape[0] == len(documents):
+            return KeywordIndex.from_state(state)
+        logging.info(f"Building keyword index for {len(documents)} {corpus}")
+        keyword = KeywordIndex()
+        keyword.add_batch(0, (self._keyword_text(corpus, document) for document in documents))
+        return keyword
+    
+    def _new_metadata(self, corpus: str) -> MetadataIndex:
+        time_field, categorical_fields, substring_fields = self.METADATA_FIELDS[corpus]
+        return MetadataIndex(time_field, categorical_fields, substring_fields)
+    
+    def _load_metadata_index(self, manifest: Dict[str, Any], corpus: str, documents) -> MetadataIndex:
+        """Restore the persisted metadata columns, or build them from the documents if missing or stale"""
+        metadata = self._new_metadata(corpus)
+        state = {name: load_snapshot_array(manifest, f"{corpus}.meta_{name}", mmap_mode=None) for name in metadata.state_names()}
+        if all(array is not None for array in state.values()) and state["times"].shape[0] == len(documents):
+            time_field, categorical_fields, substring_fields = self.METADATA_FIELDS[corpus]
+            return MetadataIndex.from_state(state, time_field, categorical_fields, substring_fields)
+        logging.info(f"Building metadata columns for {len(documents)} {corpus}")
+        metadata.add_batch(0, documents)
+        return metadata
+    
+    def _load_intervals(self, manifest: Dict[str, Any], events) -> IntervalIndex:
+        """Restore the persisted event intervals, or read them from the events if missing or stale"""
+        state = {name: load_snapshot_array(manifest, f"events.interval_{name}", mmap_mode=None) for name in ("starts", "ends")}
+        if all(array is not None for array in state.values()) and state["starts"].shape[0] == len(events):
+            return IntervalIndex.from_state(state)
+        self._intervals = IntervalIndex()
+        self._add_intervals(0, events)
+        return self._intervals
+    
+    def _load_quantized(self, manifest: Dict[str, Any], corpus: str, index: VectorIndex) -> QuantizedIndex:
+        """Restore the persisted compressed rows, or quantize the snapshot matrix if they are missing or stale"""
+        state = {name: load_snapshot_array(manifest, f"{corpus}.quantized_{name}", mmap_mode=None) for name in ("codes", "scales")}
+        if (all(array is not None for array in state.values()) and state["codes"].shape[0] == len(index)
+                and str(state["codes"].dtype) == self.vector_storage):
+            return QuantizedIndex.from_state(state, rerank_factor=self.rerank_factor)
+        logging.info(f"Quantizing {len(index)} {corpus} rows to {self.vector_storage}")
+        return QuantizedIndex.from_index(index, precision=self.vector_storage, rerank_factor=self.rerank_factor)
+    
+    def _load_ann(self, manifest: Dict[str, Any], corpus: str, rows: int) -> Optional[IVFIndex]:
+        """Restore a persisted IVF index if it matches the snapshot rows"""
+        centroids = load_snapshot_array(manifest, f"{corpus}.ivf_centroids", mmap_mode=None)
+        assignments = load_snapshot_array(manifest, f"{corpus}.ivf_assignments", mmap_mode=None)
+        if centroids is None or assignments is None or assignments.shape[0] != rows:
+            return None
+        return IVFIndex.from_state(centroids, assignments, nprobe=self.ivf_nprobe)
+    
+    def _load_ids(self, manifest: Dict[str, Any], corpus: str, documents, index: VectorIndex) -> DocumentIds:
+        """Restore the persisted id map and tombstones, or read the ids from the documents if missing or stale"""
+        state = {name: load_snapshot_array(manifest, f"{corpus}.ids_{name}", mmap_mode=None)
+                 for name in ("data", "offsets", "deleted", "row_counts")}
+        if all(array is not None for array in state.values()) and state["deleted"].shape[0] == len(documents):
+            return DocumentIds.from_state(state)
+        logging.info(f"Building document ids for {len(documents)} {corpus}")
+        # Older snapshots may hold an id more than once; all but its last version become tombstones
+        return DocumentIds.from_ids([documents.record(position)["id"] for position in range(len(documents))],
+                                    np.bincount(index.owners, minlength=len(documents)))
     
     def _load_cached_embeddings(self):
-        """Load embeddings from cache file"""
+        """Load the snapshot, replay newer journals on top and start a fresh journal generation"""
+        migrate = False
         try:
-            if os.path.exists(self.embeddings_cache_file):
-                with open(self.embeddings_cache_file, 'rb') as f:
-                    cache_data = pickle.load(f)
-                self.email_documents = cache_data.get('emails', [])
-                self.calendar_events = cache_data.get('events', [])
-                logging.info("Loaded embeddings from cache")
+            if self._open_snapshot():
+                logging.info("Loaded embeddings from snapshot")
+            else:
+                migrate = os.path.exists(self.embeddings_cache_file)
+            self._replay_journal()
+            for corpus in self._ann:
+                self._update_ann(corpus)
         except Exception as e:
             logging.error(f"Error loading embeddings cache: {e}")
+        
+        generation = max(journal_generations(self.snapshot_dir) + [self._snapshot_generation]) + 1
+        self._journal = IngestJournal(self.snapshot_dir, generation, self.embedding_space,
+                                      group_commit_records=self.group_commit_records,
+                                      group_commit_interval=self.group_commit_interval)
+        if migrate:
+            try:
+                self._migrate_pickle_cache()
+            except Exception as e:
+                logging.error(f"Error migrating embeddings cache: {e}")
+    
+    def _replay_journal(self):
+        """Re-apply journaled inserts and deletes that are newer than the snapshot, in order"""
+        replayed = {'emails': ([], [], [], []), 'events': ([], [], [], [])}
+        counts = {'emails': [0, 0], 'events': [0, 0]}
+        
+        def flush(corpus: str):
+            documents, vectors, row_counts, spans = replayed[corpus]
+            if documents:
+                self._append_documents(corpus, documents, np.concatenate(vectors), row_counts, spans, journal=False)
+                counts[corpus][0] += len(documents)
+                replayed[corpus] = ([], [], [], [])
+        
+        for corpus, record, vectors, spans in replay_journals(self.snapshot_dir, self._snapshot_generation, self.embedding_space):
+            if not len(vectors):
+                # A delete applies to the documents journaled before it
+                flush(corpus)
+                counts[corpus][1] += self._ids[corpus].delete(record["id"]) is not None
+                continue
+            from_record = EmailDocument.from_record if corpus == 'emails' else CalendarEvent.from_record
+            documents, corpus_vectors, row_counts, corpus_spans = replayed[corpus]
+            documents.append(from_record(record))
+            corpus_vectors.append(vectors)
+            row_counts.append(len(vectors))
+            # Records journaled before passage chunking hold one whole-body row
+            corpus_spans.extend(spans if spans is not None else [(0, -1)] * len(vectors))
+        for corpus in counts:
+            flush(corpus)
+            added, deleted = counts[corpus]
+            if added or deleted:
+                logging.info(f"Replayed {added} journaled {corpus} and {deleted} deletes")
+    
+    def _migrate_pickle_cache(self):
+        """One-shot conversion of outlook_embeddings.pkl into a snapshot"""
+        with open(self.embeddings_cache_file, 'rb') as f:
+            cache_data = pickle.load(f)
+        self._rebuild_indexes(cache_data.get('emails', []), cache_data.get('events', []))
+        for corpus in self._ann:
+            self._update_ann(corpus)
+        
+        self._compact()
+        os.replace(self.embeddings_cache_file, self.embeddings_cache_file + ".migrated")
+        logging.info(f"Migrated {self.embeddings_cache_file} to snapshot {self.snapshot_dir}")
+    
+    def close(self):
+        """Embed what is still queued, wait for a running compaction and make the journal durable"""
+        self._ingest_queue.close()
+        for thread in (self._purge_thread, self._compaction_thread):
+            if thread is not None:
+                thread.join()
+        if self._journal is not None:
+            self._journal.close()
+        # Let an evicted shard be garbage collected
+        atexit.unregister(self.close)
+    
+    def unsaved_documents(self) -> int:
+        """Documents added since the current snapshot (only in the journal so far)"""
+        return sum(len(self._corpus(corpus)[1]) - count for corpus, count in self._snapshot_documents.items())
+    
+    def resident_bytes(self) -> int:
+        """Approximate RAM held by the indexes; memory-mapped snapshot pages are not counted"""
+        total = self._email_index.nbytes + self._event_index.nbytes
+        total += sum(quantized.nbytes for quantized in self._quantized.values() if quantized is not None)
+        total += sum(keyword.nbytes for keyword in self._keyword.values())
+        total += self.email_documents.nbytes + self.calendar_events.nbytes
+        return total
+    
+    def _rebuild_indexes(self, emails: List[EmailDocument], events: List[CalendarEvent]):
+        """Rebuild the document lists and embedding matrices from documents carrying their embeddings"""
+        self.email_documents, self.calendar_events = DocumentList(), DocumentList()
+        self.email_documents.extend(emails)
+        self.calendar_events.extend(events)
+        self._email_index = VectorIndex(initial_capacity=len(emails))
+        self._event_index = VectorIndex(initial_capacity=len(events))
+        for position, email in enumerate(emails):
+            if email.embedding is not None:
+                self._email_index.add(email.embedding, position)
+        for position, event in enumerate(events):
+            if event.embedding is not None:
+                self._event_index.add(event.embedding, position)
+        for corpus in ('emails', 'events'):
+            index, documents = self._corpus(corpus)
+            if self.vector_storage != "float32":
+                self._quantized[corpus] = QuantizedIndex.from_index(index, precision=self.vector_storage, rerank_factor=self.rerank_factor)
+            self._passages[corpus] = PassageTable()
+            self._passages[corpus].add(np.arange(len(index)), None)
+            self._content_store.attach(corpus, self._backfill_digests(corpus, index, documents), len(index))
+            self._keyword[corpus] = KeywordIndex()
+            self._keyword[corpus].add_batch(0, (self._keyword_text(corpus, document) for document in documents))
+            self._metadata[corpus] = self._new_metadata(corpus)
+            self._metadata[corpus].add_batch(0, documents)
+            self._ids[corpus] = DocumentIds.from_ids([document.id for document in documents],
+                                                     np.bincount(index.owners, minlength=len(documents)))
+        self._intervals = IntervalIndex()
+        self._add_intervals(0, self.calendar_events)
+        self._publish()
     
     def get_stats(self) -> Dict[str, Any]:
         """Get statistics about the RAG system"""
         return {
-            "total_emails": len(self.email_documents),
-            "total_events": len(self.calendar_events),
+            "total_emails": self._ids['emails'].live_documents,
+            "total_events": self._ids['events'].live_documents,
             "model_name": self.model_name,
-            "cache_file": self.embeddings_cache_file
+            "cache_file": self.snapshot_dir,
+            "embedding_batch_size": self.embedding_batch_size,
+            "last_ingest": self._last_ingest,
+            "ingest_queue": self._ingest_queue.get_stats(),
+            "query_cache": self._query_cache.get_stats(),
+            "content_store": self._content_store.get_stats(),
+            "index_mode": self.index_mode,
+            "retrieval_mode": self.retrieval_mode,
+            "fusion": self.fusion,
+            "embedding_model_loaded": self.embedder is not None,
+            "embedder": self.embedder_backend,
+            "embedding_space": self.embedding_space,
+            "pending_migration": self.pending_migration,
+            "reindex": self.reindex_status(),
+            "search_generation": self._generation.number,
+            "keyword_index": {corpus: keyword.get_stats() for corpus, keyword in self._keyword.items()},
+            "metadata": {corpus: metadata.get_stats() for corpus, metadata in self._metadata.items()},
+            "calendar_intervals": self._intervals.get_stats(),
+            "passages": {
+                "max_tokens": self.passage_tokens,
+                "overlap": self.passage_overlap,
+                "pooling": self.passage_pooling,
+                **{corpus: passages.get_stats() for corpus, passages in self._passages.items()}
+            },
+            "vector_storage": self.vector_storage,
+            "quantized": {corpus: quantized.get_stats() for corpus, quantized in self._quantized.items() if quantized is not None},
+            "ann": {corpus: ann.get_stats() for corpus, ann in self._ann.items() if ann is not None},
+            "documents": {"emails": self.email_documents.get_stats(), "events": self.calendar_events.get_stats()},
+            "tombstones": {
+                "purges": self._purges,
+                "purging": self._purge_thread is not None and self._purge_thread.is_alive(),
+                **{corpus: ids.get_stats() for corpus, ids in self._ids.items()}
+            },
+            "journal": {
+                "generation": self._journal.generation if self._journal is not None else None,
+                "bytes": self._journal.size if self._journal is not None else 0,
+                "snapshot_generation": self._snapshot_generation,
+                "compactions": self._compactions,
+                "compacting": self._compaction_thread is not None and self._compaction_thread.is_alive()
+            }
         }
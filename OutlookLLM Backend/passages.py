@@ -0,0 +1,120 @@
+"""
+Passage chunking for the OutlookLLM RAG system
+Long bodies are split into overlapping token-bounded passages, each embedded as its
+own row; search pools passage scores back to their parent document
+"""
+
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+WORD_PATTERN = re.compile(r'\S+')
+
+
+def word_spans(text: str) -> List[Tuple[int, int]]:
+    """Character spans of whitespace-separated words, the fallback token boundaries"""
+    return [match.span() for match in WORD_PATTERN.finditer(text)]
+
+
+def token_spans(tokenizer: Any, text: str) -> Sequence[Tuple[int, int]]:
+    """Character spans of a Hugging Face tokenizer's tokens, whitespace words without a fast tokenizer"""
+    if tokenizer is not None and getattr(tokenizer, 'is_fast', False):
+        return tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)['offset_mapping']
+    return word_spans(text)
+
+
+def split_passages(text: str, max_tokens: int, overlap: int,
+                   token_spans: Optional[Callable[[str], Sequence[Tuple[int, int]]]] = None) -> List[Tuple[int, int]]:
+    """Character spans of overlapping passages of at most max_tokens tokens
+
+    `token_spans` returns the character span of every token (a tokenizer's offset
+    mapping); whitespace words are used without one. A text that fits in one passage
+    yields the single span (0, len(text)).
+    """
+    spans = list((token_spans or word_spans)(text))
+    if len(spans) <= max_tokens:
+        return [(0, len(text))]
+    step = max(1, max_tokens - overlap)
+    passages = []
+    for first in range(0, len(spans), step):
+        last = min(first + max_tokens, len(spans)) - 1
+        start = 0 if first == 0 else spans[first][0]
+        end = len(text) if last == len(spans) - 1 else spans[last][1]
+        passages.append((start, end))
+        if last == len(spans) - 1:
+            break
+    return passages
+
+
+def pool_passages(scores: np.ndarray, owners: np.ndarray, rows: np.ndarray, pooling: str = "max"):
+    """Aggregate best-first passage hits to documents
+
+    Returns (scores, owners, best rows) with one entry per document, best first.
+    "max" scores a document by its best passage, "sum" by the sum over its retrieved passages.
+    """
+    if not len(owners):
+        return scores, owners, rows
+    unique_owners, first, inverse = np.unique(owners, return_index=True, return_inverse=True)
+    if pooling == "sum":
+        pooled = np.bincount(inverse, weights=scores).astype(np.float32)
+        order = np.argsort(-pooled, kind='stable')
+        return pooled[order], unique_owners[order], rows[first[order]]
+    # Hits are sorted best first, so a document's first hit is its best passage
+    first = np.sort(first)
+    return scores[first], owners[first], rows[first]
+
+
+class PassageTable:
+    """Character span of every row's passage within its document body
+
+    Rows without a recorded span (end < 0) cover the whole body.
+    """
+
+    def __init__(self):
+        self._size = 0
+        self._starts = np.zeros(16, dtype=np.int64)
+        self._ends = np.full(16, -1, dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, rows: np.ndarray, spans: Optional[Sequence[Tuple[int, int]]]):
+        rows = np.asarray(rows, dtype=np.int64)
+        if not rows.size:
+            return
+        end = int(rows.max()) + 1
+        with self._lock:
+            if end > self._starts.shape[0]:
+                capacity = max(2 * self._starts.shape[0], end)
+                starts = np.zeros(capacity, dtype=np.int64)
+                ends = np.full(capacity, -1, dtype=np.int64)
+                starts[:self._size], ends[:self._size] = self._starts[:self._size], self._ends[:self._size]
+                self._starts, self._ends = starts, ends
+            if spans is None:
+                self._starts[rows], self._ends[rows] = 0, -1
+            else:
+                spans = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+                self._starts[rows], self._ends[rows] = spans[:, 0], spans[:, 1]
+            self._size = max(self._size, end)
+
+    def span(self, row: int) -> Optional[Tuple[int, int]]:
+        """(start, end) of a row's passage, or None if the row covers the whole body"""
+        if row < 0 or row >= self._size or self._ends[row] < 0:
+            return None
+        return int(self._starts[row]), int(self._ends[row])
+
+    def state(self, rows: Optional[int] = None) -> Dict[str, np.ndarray]:
+        rows = self._size if rows is None else rows
+        return {"starts": self._starts[:rows].copy(), "ends": self._ends[:rows].copy()}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "PassageTable":
+        table = cls()
+        rows = np.arange(state["starts"].shape[0], dtype=np.int64)
+        table.add(rows, np.stack([np.asarray(state["starts"]), np.asarray(state["ends"])], axis=1))
+        return table
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"rows": self._size, "chunked_rows": int((self._ends[:self._size] >= 0).sum())}
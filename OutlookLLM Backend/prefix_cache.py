@@ -0,0 +1,78 @@
+"""
+Prompt prefix token cache for the OutlookLLM completion engine
+Every completion of an endpoint starts with the same system prompt framing; its token
+ids are computed once and only the request's own text is tokenized per call
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+
+class PrefixCache:
+    """LRU of prefix text -> token ids
+
+    Tokenizing a prefix and the rest separately only equals tokenizing the whole
+    prompt when no token spans the cut. The first `verify` prompts of every prefix
+    are also tokenized whole; a prefix whose split ever differs is marked unsplittable
+    and its prompts are tokenized whole from then on.
+    """
+
+    def __init__(self, encode: Callable[[str], List[int]], capacity: int = 32, verify: int = 3):
+        self._encode = encode
+        self.capacity = capacity
+        self.verify = verify
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.mismatches = 0
+        self.reused_tokens = 0
+
+    def encode(self, prompt: str, prefix: Optional[str] = None) -> List[int]:
+        """Token ids of a prompt, reusing the cached ids of `prefix` when the prompt starts with it"""
+        if not prefix or self.capacity <= 0 or not prompt.startswith(prefix):
+            return self._encode(prompt)
+        with self._lock:
+            entry = self._entries.get(prefix)
+            if entry is not None:
+                self._entries.move_to_end(prefix)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is None:
+            entry = {"ids": self._encode(prefix), "checks": 0, "splittable": True}
+            with self._lock:
+                entry = self._entries.setdefault(prefix, entry)
+                while len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+        if not entry["splittable"]:
+            return self._encode(prompt)
+
+        ids = entry["ids"] + self._encode(prompt[len(prefix):])
+        if entry["checks"] < self.verify:
+            entry["checks"] += 1
+            whole = self._encode(prompt)
+            if whole != ids:
+                logging.warning(f"Prompt prefix of {len(entry['ids'])} tokens does not tokenize apart from the rest; tokenizing its prompts whole")
+                entry["splittable"] = False
+                with self._lock:
+                    self.mismatches += 1
+                return whole
+        with self._lock:
+            self.reused_tokens += len(entry["ids"])
+        return ids
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "prefixes": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "unsplittable": self.mismatches,
+                "reused_tokens": self.reused_tokens
+            }
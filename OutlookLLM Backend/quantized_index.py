@@ -0,0 +1,173 @@
+"""
+Quantized embedding storage for the OutlookLLM RAG system
+Row-aligned float16 or per-row-scaled int8 copies of a VectorIndex: queries scan the
+compact matrix first and re-rank the best candidates exactly against the float32 rows
+"""
+
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+
+from vector_index import VectorIndex, normalize_rows, top_k_indices
+
+PRECISIONS = ("float16", "int8")
+
+# float16 bits shifted left by 13 sit in a float32's sign, exponent and mantissa with the exponent 112 too low
+# (bias 15 instead of 127); the mask drops the sign-extension bits and the multiply restores the exponent
+_FLOAT16_MASK = np.int32(-0x70002000)  # 0x8FFFE000
+_FLOAT16_REBIAS = np.float32(2.0 ** 112)
+
+
+def quantize_rows(vectors: np.ndarray, precision: str) -> Tuple[np.ndarray, np.ndarray]:
+    """(codes, scales) of L2-normalized rows; a row is approximately codes * scale
+
+    int8 scales every row by its largest magnitude / 127, float16 keeps a scale of 1.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if precision == "float16":
+        return vectors.astype(np.float16), np.ones(vectors.shape[0], dtype=np.float32)
+    if precision != "int8":
+        raise ValueError(f"Unknown precision {precision}, expected one of {PRECISIONS}")
+    peaks = np.abs(vectors).max(axis=1) if vectors.size else np.empty(0, dtype=np.float32)
+    scales = np.where(peaks > 0, peaks / 127.0, 1.0).astype(np.float32)
+    return np.rint(vectors / scales[:, None]).astype(np.int8), scales
+
+
+def _widen_codes(codes: np.ndarray, out: np.ndarray):
+    """Convert codes into the float32 array `out` of the same shape
+
+    numpy's float16 -> float32 cast is a scalar loop, several times slower than the
+    matmul it feeds; rebuilding the float32 bits with vectorized integer operations
+    gives the same values (subnormals included; codes of normalized rows are never
+    inf or NaN) in about a third of the time.
+    """
+    if codes.dtype != np.float16:
+        np.copyto(out, codes)
+        return
+    bits = out.view(np.int32)
+    np.copyto(bits, codes.view(np.int16))
+    np.left_shift(bits, 13, out=bits)
+    np.bitwise_and(bits, _FLOAT16_MASK, out=bits)
+    np.multiply(out, _FLOAT16_REBIAS, out=out)
+
+
+class QuantizedIndex:
+    """Compressed copy of every row of a VectorIndex, kept in RAM for the first-pass scan
+
+    float16 halves and int8 quarters the bytes per row. The scan converts chunk_rows
+    rows at a time into one float32 buffer, so it never materializes a float32 matrix
+    (converting float16 still makes its scan about three times as slow as int8's); the
+    top top_k * rerank_factor candidates are then scored exactly with the float32 rows
+    of the VectorIndex, which for a snapshot are memory-mapped and only paged in for them.
+    """
+
+    def __init__(self, precision: str = "int8", rerank_factor: int = 4, rerank_min: int = 50,
+                 chunk_rows: int = 512):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision}, expected one of {PRECISIONS}")
+        self.precision = precision
+        self.rerank_factor = rerank_factor
+        self.rerank_min = rerank_min
+        self.chunk_rows = chunk_rows
+        self._size = 0
+        self._codes: Optional[np.ndarray] = None
+        self._scales = np.zeros(16, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the populated codes and scales"""
+        if self._codes is None:
+            return 0
+        return int(self._codes[:self._size].nbytes + self._scales[:self._size].nbytes)
+
+    def _reserve(self, rows: int, dim: int):
+        if self._codes is None:
+            self._codes = np.empty((max(rows, 16), dim), dtype=self.precision)
+        elif rows > self._codes.shape[0]:
+            codes = np.empty((max(2 * self._codes.shape[0], rows), dim), dtype=self.precision)
+            codes[:self._size] = self._codes[:self._size]
+            self._codes = codes
+        if rows > self._scales.shape[0]:
+            scales = np.zeros(max(2 * self._scales.shape[0], rows), dtype=np.float32)
+            scales[:self._size] = self._scales[:self._size]
+            self._scales = scales
+
+    def add(self, vectors: np.ndarray):
+        """Append the (normalized) vectors of the rows that follow the indexed ones"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[0] == 0:
+            return
+        codes, scales = quantize_rows(vectors, self.precision)
+        end = self._size + vectors.shape[0]
+        self._reserve(end, vectors.shape[1])
+        self._codes[self._size:end] = codes
+        self._scales[self._size:end] = scales
+        self._size = end
+
+    @classmethod
+    def from_index(cls, index: VectorIndex, **kwargs: Any) -> "QuantizedIndex":
+        """Quantize every row of an index, a chunk at a time"""
+        quantized = cls(**kwargs)
+        for vectors, _ in index.segments():
+            for start in range(0, vectors.shape[0], quantized.chunk_rows):
+                quantized.add(vectors[start:start + quantized.chunk_rows])
+        return quantized
+
+    def _scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Approximate scores of all rows, or of the given rows"""
+        count = self._size if rows is None else len(rows)
+        scores = np.empty(count, dtype=np.float32)
+        # Every chunk is converted into the same cache-sized buffer, so the scan allocates nothing per chunk
+        buffer = np.empty((min(self.chunk_rows, count), self._codes.shape[1]), dtype=np.float32)
+        for start in range(0, count, self.chunk_rows):
+            end = min(start + self.chunk_rows, count)
+            chunk = buffer[:end - start]
+            _widen_codes(self._codes[start:end] if rows is None else self._codes[rows[start:end]], chunk)
+            np.matmul(chunk, query, out=scores[start:end])
+        scores *= self._scales[:count] if rows is None else self._scales[rows]
+        return scores
+
+    def search(self, query_vector: np.ndarray, index: VectorIndex, top_k: int,
+               rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Compressed scan then exact re-rank of the candidates; returns (scores, rows) best first
+
+        With `rows`, only those rows are scanned (filtered search).
+        """
+        if not self._size or (rows is not None and len(rows) == 0):
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        query = normalize_rows(np.asarray(query_vector).reshape(-1))
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+        scores = self._scores(query, rows)
+        candidates = top_k_indices(scores, max(top_k * self.rerank_factor, self.rerank_min))
+        if rows is not None:
+            candidates = rows[candidates]
+        exact = index.take(candidates) @ query
+        best = top_k_indices(exact, top_k)
+        return exact[best], candidates[best]
+
+    def state(self, rows: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Arrays to persist next to a snapshot holding the first `rows` rows"""
+        rows = self._size if rows is None else rows
+        codes = self._codes[:rows].copy() if self._codes is not None else np.empty((0, 0), dtype=self.precision)
+        return {"codes": codes, "scales": self._scales[:rows].copy()}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray], **kwargs: Any) -> "QuantizedIndex":
+        quantized = cls(precision=str(state["codes"].dtype), **kwargs)
+        quantized._codes = np.array(state["codes"])
+        quantized._scales = np.array(state["scales"], dtype=np.float32)
+        quantized._size = quantized._codes.shape[0]
+        return quantized
+
+    def get_stats(self) -> Dict[str, Any]:
+        dim = self._codes.shape[1] if self._codes is not None else 0
+        return {
+            "precision": self.precision,
+            "rows": self._size,
+            "bytes": self.nbytes,
+            "float32_bytes": self._size * dim * 4,
+            "rerank_factor": self.rerank_factor
+        }
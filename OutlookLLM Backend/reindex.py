@@ -0,0 +1,286 @@
+"""
+Parallel re-embedding for the OutlookLLM RAG system
+A full reindex (embedding model migration, rebuild after a lost snapshot) streams the
+live documents in chunks to a pool of embedder processes, each with its own model and
+thread budget; finished chunks are staged on disk, so an interrupted run resumes where
+it stopped, and the result is swapped in while the old index keeps serving
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import logging
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+from content_store import DIGEST_DTYPE, content_digest, digest_array
+from embedders import Embedder, available_backend, create_embedder, embedding_space
+from embedding_snapshot import pack_strings, unpack_strings
+from passages import split_passages, token_spans
+
+PLAN_FILE = "plan.json"
+CORPORA = ('emails', 'events')
+
+
+def staging_directory(root: str, space: str) -> str:
+    """Directory under a snapshot root holding the plan and finished chunks of a reindex into `space`"""
+    return os.path.join(root, "reindex-" + re.sub(r'[^A-Za-z0-9._-]', '_', space))
+
+
+def embed_records(embedder: Embedder, corpus: str, records: Sequence[Dict[str, Any]], passage_tokens: int,
+                  passage_overlap: int, batch_size: int = 32) -> Dict[str, np.ndarray]:
+    """Split document records into passages and embed them, as OutlookRAGSystem ingestion does
+
+    Returns row_counts (rows per record), starts / ends (body span of every row, (0, -1)
+    for a whole-body row), vectors and content digests.
+    """
+    from outlook_rag import OutlookRAGSystem
+    text_of = OutlookRAGSystem._email_text if corpus == 'emails' else OutlookRAGSystem._event_text
+    row_counts, spans, texts = [], [], []
+    for record in records:
+        body = record.get('body', '')
+        passages = split_passages(body, passage_tokens, passage_overlap, lambda text: token_spans(embedder.tokenizer, text))
+        texts.extend(text_of({**record, 'body': body[start:end]}) for start, end in passages)
+        spans.extend(passages if len(passages) > 1 else [(0, -1)])
+        row_counts.append(len(passages))
+    vectors = embedder.encode(texts, batch_size) if texts else np.empty((0, 0), dtype=np.float32)
+    spans = np.array(spans, dtype=np.int64).reshape(-1, 2)
+    return {
+        "row_counts": np.array(row_counts, dtype=np.int64),
+        "starts": spans[:, 0].copy(),
+        "ends": spans[:, 1].copy(),
+        "vectors": np.asarray(vectors, dtype=np.float32),
+        "digests": np.array([content_digest(text) for text in texts], dtype=DIGEST_DTYPE)
+    }
+
+
+# Embedder and passage settings of a worker process, set by _init_worker
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(backend: str, model_name: str, options: Dict[str, Any], threads: int,
+                 passage_tokens: int, passage_overlap: int, batch_size: int):
+    # Set before torch / onnxruntime are imported, so their thread pools honour the budget
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[variable] = str(threads)
+    if backend == "onnx":
+        options = {**options, "intra_op_threads": threads}
+    start_time = time.perf_counter()
+    embedder = create_embedder(backend, model_name, **options)
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(threads)
+    _worker.update(embedder=embedder, passage_tokens=passage_tokens, passage_overlap=passage_overlap,
+                   batch_size=batch_size, load_seconds=time.perf_counter() - start_time)
+
+
+def _worker_ready() -> Tuple[int, float]:
+    return os.getpid(), _worker["load_seconds"]
+
+
+def _embed_chunk(corpus: str, records: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    return embed_records(_worker["embedder"], corpus, records, _worker["passage_tokens"], _worker["passage_overlap"],
+                         _worker["batch_size"])
+
+
+@contextmanager
+def _importable_main():
+    """Spawned workers re-import the parent's __main__; app.py starts the server at import, so
+    workers are started while __main__ is this import-safe module instead"""
+    main = sys.modules.get('__main__')
+    sys.modules['__main__'] = sys.modules[__name__]
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
+
+
+class Reindexer:
+    """One full re-embedding of an OutlookRAGSystem into the space of (backend, model_name, options)
+
+    Phases ("planning", "embedding", "assembling", "swapping", then "done" or
+    "failed"): the plan freezes the ids of the live documents; `workers` spawned
+    processes (0 embeds in this process) each load their own embedder limited to
+    threads_per_worker threads and embed the ids chunk by chunk, and every finished
+    chunk is saved under the staging directory; OutlookRAGSystem.install_reindex()
+    assembles the chunks into a snapshot and swaps it in, embedding what was added
+    meanwhile. Running again with the same target after an interruption reuses the
+    plan and the finished chunks, unless a purge has renumbered the documents since.
+    """
+
+    def __init__(self, rag, backend: str, model_name: str, options: Optional[Dict[str, Any]] = None,
+                 workers: Optional[int] = None, threads_per_worker: Optional[int] = None, chunk_size: int = 512):
+        cores = os.cpu_count() or 1
+        self.rag = rag
+        self.backend, self.options = available_backend(backend, dict(options or {}))
+        self.model_name = model_name
+        self.embedding_space = embedding_space(backend, model_name, **self.options)
+        self.directory = staging_directory(rag.snapshot_dir, self.embedding_space)
+        self.workers = max(1, cores // 2) if workers is None else workers
+        self.threads_per_worker = threads_per_worker or max(1, cores // max(self.workers, 1))
+        self.chunk_size = chunk_size
+        self.plan: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._status: Dict[str, Any] = {"phase": "pending", "chunks": 0, "chunks_done": 0, "chunks_resumed": 0,
+                                        "documents": 0, "documents_embedded": 0, "rows_embedded": 0}
+
+    def _update(self, **values: Any):
+        with self._lock:
+            self._status.update(values)
+
+    def _chunk_path(self, corpus: str, number: int) -> str:
+        return os.path.join(self.directory, f"{corpus}-{number:06d}.npz")
+
+    def _chunk_ids(self, corpus: str) -> Iterator[Tuple[int, List[str]]]:
+        ids = self.plan["ids"][corpus]
+        for number, start in enumerate(range(0, len(ids), self.chunk_size)):
+            yield number, ids[start:start + self.chunk_size]
+
+    def _load_plan(self) -> Optional[Dict[str, Any]]:
+        """The plan of an interrupted run into the same space, if it is still valid"""
+        try:
+            with open(os.path.join(self.directory, PLAN_FILE), 'r') as f:
+                plan = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if plan.get("embedding_space") != self.embedding_space or plan.get("chunk_size") != self.chunk_size:
+            return None
+        if plan.get("layout") != self.rag.layout:
+            logging.info("Documents were renumbered since the interrupted reindex, starting over")
+            return None
+        plan["ids"] = {corpus: unpack_strings(np.load(os.path.join(self.directory, f"{corpus}.ids_data.npy")),
+                                              np.load(os.path.join(self.directory, f"{corpus}.ids_offsets.npy")))
+                       for corpus in CORPORA}
+        return plan
+
+    def _make_plan(self) -> Dict[str, Any]:
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory)
+        layout, ids, documents = self.rag.reindex_source()
+        for corpus in CORPORA:
+            data, offsets = pack_strings(ids[corpus])
+            np.save(os.path.join(self.directory, f"{corpus}.ids_data.npy"), data)
+            np.save(os.path.join(self.directory, f"{corpus}.ids_offsets.npy"), offsets)
+        plan = {"embedding_space": self.embedding_space, "backend": self.backend, "model_name": self.model_name,
+                "options": self.options, "chunk_size": self.chunk_size, "layout": layout, "source_documents": documents,
+                "created": time.time()}
+        with open(os.path.join(self.directory, PLAN_FILE + ".tmp"), 'w') as f:
+            json.dump(plan, f, indent=2)
+        os.replace(os.path.join(self.directory, PLAN_FILE + ".tmp"), os.path.join(self.directory, PLAN_FILE))
+        plan["ids"] = ids
+        return plan
+
+    def _save_chunk(self, corpus: str, number: int, ids: List[str], records: List[Dict[str, Any]],
+                    result: Dict[str, np.ndarray]):
+        id_data, id_offsets = pack_strings(ids)
+        record_data, record_offsets = pack_strings([json.dumps(record, ensure_ascii=False) for record in records])
+        path = self._chunk_path(corpus, number)
+        with open(path + ".tmp", 'wb') as f:
+            np.savez(f, id_data=id_data, id_offsets=id_offsets, record_data=record_data, record_offsets=record_offsets,
+                     **result)
+        os.replace(path + ".tmp", path)
+        with self._lock:
+            self._status["chunks_done"] += 1
+            self._status["documents_embedded"] += len(ids)
+            self._status["rows_embedded"] += int(result["row_counts"].sum())
+
+    def chunks(self, corpus: str) -> Iterator[Dict[str, Any]]:
+        """Finished chunks of a corpus in plan order: ids, records and the embed_records() arrays"""
+        for number, _ in self._chunk_ids(corpus):
+            with np.load(self._chunk_path(corpus, number)) as chunk:
+                arrays = {name: chunk[name] for name in chunk.files}
+            arrays["digests"] = digest_array(arrays["digests"])
+            yield {
+                "ids": unpack_strings(arrays.pop("id_data"), arrays.pop("id_offsets")),
+                "records": [json.loads(record) for record in unpack_strings(arrays.pop("record_data"), arrays.pop("record_offsets"))],
+                **arrays
+            }
+
+    def _pending_chunks(self) -> Iterator[Tuple[str, int, List[str], List[Dict[str, Any]]]]:
+        """(corpus, number, ids, records) of every chunk still to embed; records are read only when it is due"""
+        for corpus in CORPORA:
+            for number, ids in self._chunk_ids(corpus):
+                if os.path.exists(self._chunk_path(corpus, number)):
+                    continue
+                found = self.rag.reindex_records(corpus, ids)
+                yield corpus, number, [document_id for document_id, _ in found], [record for _, record in found]
+
+    def _embed_in_process(self):
+        embedder = self.rag.reindex_embedder(self.backend, self.model_name, self.options)
+        for corpus, number, ids, records in self._pending_chunks():
+            self._save_chunk(corpus, number, ids, records,
+                             embed_records(embedder, corpus, records, self.rag.passage_tokens, self.rag.passage_overlap,
+                                           self.rag.embedding_batch_size))
+
+    def _embed_in_pool(self):
+        settings = (self.backend, self.model_name, self.options, self.threads_per_worker, self.rag.passage_tokens,
+                    self.rag.passage_overlap, self.rag.embedding_batch_size)
+        executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=_init_worker, initargs=settings)
+        try:
+            with _importable_main():
+                # Start every worker now; they load their models in parallel
+                ready = [executor.submit(_worker_ready) for _ in range(self.workers)]
+                load_seconds = max(future.result()[1] for future in ready)
+            self._update(worker_load_seconds=round(load_seconds, 3))
+            # At most two chunks per worker in flight, so records are read as the workers need them
+            in_flight = {}
+            pending = self._pending_chunks()
+            for corpus, number, ids, records in pending:
+                in_flight[executor.submit(_embed_chunk, corpus, records)] = (corpus, number, ids, records)
+                if len(in_flight) >= 2 * self.workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._save_chunk(*in_flight.pop(future), future.result())
+            for future in list(in_flight):
+                self._save_chunk(*in_flight.pop(future), future.result())
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def run(self) -> Dict[str, Any]:
+        """Plan (or resume), embed, then let the RAG system install the result; returns the final status"""
+        started = time.perf_counter()
+        self._update(phase="planning", started=time.time(), embedding_space=self.embedding_space,
+                     workers=self.workers, threads_per_worker=self.threads_per_worker)
+        try:
+            self.plan = self._load_plan() or self._make_plan()
+            chunks = [(corpus, number) for corpus in CORPORA for number, _ in self._chunk_ids(corpus)]
+            resumed = sum(os.path.exists(self._chunk_path(corpus, number)) for corpus, number in chunks)
+            self._update(phase="embedding", chunks=len(chunks), chunks_resumed=resumed, chunks_done=resumed,
+                         documents=sum(len(ids) for ids in self.plan["ids"].values()), embedding_started=time.perf_counter())
+            if resumed < len(chunks) and self.workers == 0:
+                self._embed_in_process()
+            elif resumed < len(chunks):
+                self._embed_in_pool()
+            seconds = time.perf_counter() - self._status["embedding_started"]
+            self._update(phase="assembling", embedding_seconds=round(seconds, 3),
+                         documents_per_second=round(self._status["documents_embedded"] / seconds, 1) if seconds else 0.0)
+            self.rag.install_reindex(self, progress=lambda phase: self._update(phase=phase))
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self._update(phase="done")
+        except Exception as e:
+            logging.error(f"Reindex into {self.embedding_space} failed: {e}")
+            self._update(phase="failed", error=str(e))
+        self._update(seconds=round(time.perf_counter() - started, 3))
+        return self.get_stats()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            status = dict(self._status)
+        embedding_started = status.pop("embedding_started", None)
+        if status["phase"] == "embedding" and embedding_started is not None:
+            elapsed = time.perf_counter() - embedding_started
+            # Throughput of this run only; resumed chunks were embedded by an earlier one
+            embedded = status["chunks_done"] - status["chunks_resumed"]
+            status["elapsed_seconds"] = round(elapsed, 3)
+            status["documents_per_second"] = round(status["documents_embedded"] / elapsed, 1) if elapsed else 0.0
+            status["rows_per_second"] = round(status["rows_embedded"] / elapsed, 1) if elapsed else 0.0
+            remaining = status["chunks"] - status["chunks_done"]
+            status["eta_seconds"] = round(elapsed / embedded * remaining, 1) if embedded else None
+        return status
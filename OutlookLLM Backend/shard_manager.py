@@ -0,0 +1,171 @@
+"""
+Per-mailbox RAG shards for the OutlookLLM backend
+Every mailbox (user key sent by the add-in) gets its own OutlookRAGSystem with its own
+snapshot directory; shards are opened on first use and evicted least recently used
+once the resident ones exceed a memory budget
+"""
+
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from outlook_rag import OutlookRAGSystem
+
+DEFAULT_SHARD = "default"
+
+
+def shard_directory_name(key: str) -> str:
+    """File-system safe, collision-free directory name for a mailbox key"""
+    readable = re.sub(r'[^a-z0-9._@-]', '_', key.lower())[:64]
+    return f"{readable}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:10]}"
+
+
+class ShardManager:
+    """LRU of open OutlookRAGSystem shards keyed by mailbox
+
+    `factory(snapshot_dir)` builds a shard; the default shard keeps `default_dir`
+    (the single-user location), every other one lives under `root`. A shard in use
+    (see lease) or with queued ingestion is never evicted; an evicted shard with
+    journaled inserts is compacted first, so reopening it maps a snapshot instead of
+    replaying a journal.
+    """
+
+    def __init__(self, factory: Callable[[str], OutlookRAGSystem], root: str = "outlook_shards",
+                 default_dir: str = "outlook_embeddings", memory_budget_bytes: int = 2 * 1024 ** 3,
+                 max_shards: Optional[int] = None):
+        self.factory = factory
+        self.root = root
+        self.default_dir = default_dir
+        self.memory_budget_bytes = memory_budget_bytes
+        self.max_shards = max_shards
+        self._shards: "OrderedDict[str, OutlookRAGSystem]" = OrderedDict()
+        self._leases: Dict[str, int] = {}
+        self._info: Dict[str, Dict[str, Any]] = {}
+        self._loading: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._loads = 0
+        self._evictions = 0
+
+    def snapshot_dir(self, key: str) -> str:
+        if key == DEFAULT_SHARD:
+            return self.default_dir
+        return os.path.join(self.root, shard_directory_name(key))
+
+    def _open(self, key: str) -> OutlookRAGSystem:
+        """Resident shard for key, opening it (once, even under concurrent requests) if needed"""
+        with self._lock:
+            shard = self._shards.get(key)
+            if shard is not None:
+                self._shards.move_to_end(key)
+                return shard
+            loading = self._loading.setdefault(key, threading.Lock())
+        with loading:
+            with self._lock:
+                shard = self._shards.get(key)
+                if shard is not None:
+                    self._shards.move_to_end(key)
+                    return shard
+            start_time = time.perf_counter()
+            shard = self.factory(self.snapshot_dir(key))
+            load_seconds = time.perf_counter() - start_time
+            with self._lock:
+                self._shards[key] = shard
+                self._loading.pop(key, None)
+                info = self._info.setdefault(key, {"loads": 0, "requests": 0})
+                info.update(load_seconds=round(load_seconds, 3), loaded_at=time.time())
+                info["loads"] += 1
+                self._loads += 1
+            logging.info(f"Opened RAG shard {key} in {load_seconds:.2f}s")
+            return shard
+
+    def resident(self, key: str) -> Optional[OutlookRAGSystem]:
+        """Shard for key if it is open, without opening it or refreshing its LRU position"""
+        with self._lock:
+            return self._shards.get(key)
+
+    @contextmanager
+    def lease(self, key: Optional[str] = None) -> Iterator[OutlookRAGSystem]:
+        """Shard for a mailbox (the default shard without one), protected from eviction while in use"""
+        key = key or DEFAULT_SHARD
+        with self._lock:
+            self._leases[key] = self._leases.get(key, 0) + 1
+        try:
+            shard = self._open(key)
+            with self._lock:
+                info = self._info[key]
+                info["requests"] += 1
+                info["last_used"] = time.time()
+            yield shard
+        finally:
+            with self._lock:
+                self._leases[key] -= 1
+                if not self._leases[key]:
+                    del self._leases[key]
+            self.evict()
+
+    def evict(self):
+        """Close least recently used idle shards until the resident ones fit the budget"""
+        while True:
+            with self._lock:
+                sizes = {key: shard.resident_bytes() for key, shard in self._shards.items()}
+                over_budget = sum(sizes.values()) > self.memory_budget_bytes
+                over_count = self.max_shards is not None and len(self._shards) > self.max_shards
+                if not (over_budget or over_count):
+                    return
+                # Shards still embedding queued documents stay open as well
+                idle = [key for key, shard in self._shards.items() if key not in self._leases and not shard.pending_ingest()]
+                # Keep the most recently used shard even if it alone exceeds the budget
+                if not idle or (len(self._shards) == 1 and not over_count):
+                    return
+                key = idle[0]
+                shard = self._shards.pop(key)
+                self._info[key]["resident_bytes_at_eviction"] = sizes[key]
+                self._evictions += 1
+                # A request for this mailbox waits until its files are released before reopening them
+                closing = self._loading.setdefault(key, threading.Lock())
+                closing.acquire()
+            try:
+                self._close(key, shard)
+            finally:
+                closing.release()
+
+    def _close(self, key: str, shard: OutlookRAGSystem):
+        try:
+            if shard.unsaved_documents():
+                shard.save_embeddings_cache()
+            shard.close()
+            logging.info(f"Evicted RAG shard {key}")
+        except Exception as e:
+            logging.error(f"Error closing RAG shard {key}: {e}")
+
+    def close(self):
+        with self._lock:
+            shards, self._shards = list(self._shards.items()), OrderedDict()
+        for key, shard in shards:
+            self._close(key, shard)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            resident = {key: shard.resident_bytes() for key, shard in self._shards.items()}
+            return {
+                "resident": len(self._shards),
+                "resident_bytes": sum(resident.values()),
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "max_shards": self.max_shards,
+                "loads": self._loads,
+                "evictions": self._evictions,
+                "shards": {
+                    key: {
+                        **info,
+                        "resident": key in resident,
+                        "resident_bytes": resident.get(key, 0),
+                        "in_use": self._leases.get(key, 0)
+                    } for key, info in self._info.items()
+                }
+            }
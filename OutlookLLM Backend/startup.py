@@ -0,0 +1,111 @@
+"""
+Phased startup for the OutlookLLM backend
+The server binds its port at once while the embedding model, the RAG index and the
+TensorRT engine load in background threads; every phase reports its status and timing
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# (phase name, function run for it)
+Phase = Tuple[str, Callable[[], Any]]
+
+
+class StartupPhases:
+    """Named startup phases with status ("pending", "running", "ready", "failed", "skipped") and timings
+
+    Every chain passed to start() runs in its own daemon thread, its phases in order;
+    a failed phase skips the rest of its chain. Phases done before start() (imports,
+    configuration) are recorded with record(). Once no phase is left to run, a timing
+    report is logged.
+    """
+
+    def __init__(self, started_at: Optional[float] = None):
+        # perf_counter() at process start, so the report includes the time spent importing
+        self.started_at = time.perf_counter() if started_at is None else started_at
+        self._phases: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._condition = threading.Condition()
+        self._reported = False
+
+    def record(self, name: str, seconds: float):
+        """A phase that already completed on the calling thread"""
+        with self._condition:
+            self._phases[name] = {"status": "ready", "seconds": round(seconds, 3),
+                                  "finished_after": round(time.perf_counter() - self.started_at, 3)}
+
+    def start(self, chains: Sequence[Sequence[Phase]]) -> List[threading.Thread]:
+        with self._condition:
+            for chain in chains:
+                for name, _ in chain:
+                    self._phases[name] = {"status": "pending"}
+        threads = []
+        for chain in chains:
+            thread = threading.Thread(target=self._run_chain, args=(list(chain),),
+                                      name=f"startup-{chain[0][0]}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def _run_chain(self, chain: List[Phase]):
+        for position, (name, function) in enumerate(chain):
+            with self._condition:
+                self._phases[name].update(status="running", started_after=round(time.perf_counter() - self.started_at, 3))
+            start_time = time.perf_counter()
+            try:
+                function()
+                error = None
+            except Exception as e:
+                logging.error(f"Startup phase {name} failed: {e}")
+                error = str(e)
+            seconds = time.perf_counter() - start_time
+            with self._condition:
+                self._phases[name].update(status="ready" if error is None else "failed", seconds=round(seconds, 3),
+                                          finished_after=round(time.perf_counter() - self.started_at, 3))
+                if error is not None:
+                    self._phases[name]["error"] = error
+                    for skipped, _ in chain[position + 1:]:
+                        self._phases[skipped]["status"] = "skipped"
+                self._condition.notify_all()
+            logging.info(f"Startup phase {name} {'done' if error is None else 'failed'} in {seconds:.2f}s")
+            if error is not None:
+                break
+        self._report_when_finished()
+
+    def _report_when_finished(self):
+        with self._condition:
+            if self._reported or any(phase["status"] in ("pending", "running") for phase in self._phases.values()):
+                return
+            self._reported = True
+            phases = [(name, dict(phase)) for name, phase in self._phases.items()]
+        lines = [f"  {name:<16} {phase['status']:<8} {phase.get('seconds', 0.0):8.2f}s" for name, phase in phases]
+        logging.info(f"Startup finished after {time.perf_counter() - self.started_at:.2f}s\n" + "\n".join(lines))
+
+    def status(self, name: str) -> Optional[str]:
+        with self._condition:
+            phase = self._phases.get(name)
+            return phase["status"] if phase is not None else None
+
+    def is_ready(self, *names: str) -> bool:
+        """Whether the given phases (all of them without names) completed"""
+        with self._condition:
+            names = names or tuple(self._phases)
+            return all(self._phases.get(name, {}).get("status") == "ready" for name in names)
+
+    def wait(self, name: str, timeout: Optional[float] = None) -> bool:
+        """Block until a phase finished; True if it is ready, False if it failed, was skipped or timed out"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._phases.get(name, {}).get("status") not in ("pending", "running"),
+                                     timeout=timeout)
+            return self._phases.get(name, {}).get("status") == "ready"
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._condition:
+            phases = {name: dict(phase) for name, phase in self._phases.items()}
+        return {
+            "ready": all(phase["status"] == "ready" for phase in phases.values()),
+            "uptime_seconds": round(time.perf_counter() - self.started_at, 3),
+            "phases": phases
+        }
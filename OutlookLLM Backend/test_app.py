@@ -0,0 +1,42 @@
+"""
+Routing tests for the OutlookLLM inference server
+Importing app starts its background loaders: with placeholder engine paths only the engine fails to
+load, and the hashing embedder keeps the RAG index free of model downloads; run with
+    python -m pytest test_app.py
+"""
+
+import os
+import sys
+import json
+import importlib
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("pydantic")
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    # app.py reads outlookllm_config.json from, and creates its shards under, the working directory
+    directory = tmp_path_factory.mktemp("server")
+    with open(directory / "outlookllm_config.json", 'w') as f:
+        json.dump({"https_cert_file": "localhost.crt", "https_key_file": "localhost.key", "trt_engine_path": "engine",
+                   "trt_engine_name": "engine", "tokenizer_dir_path": "tokenizer", "verbose": False, "host": "127.0.0.1",
+                   "port": "8385", "max_output_tokens": 256, "max_input_tokens": 2048, "embedder": "hashing"}, f)
+    argv, cwd = sys.argv, os.getcwd()
+    sys.argv = ["app.py"]
+    os.chdir(directory)
+    try:
+        yield importlib.import_module("app").app
+    finally:
+        sys.argv = argv
+        os.chdir(cwd)
+
+
+def test_compose_email_is_routed(app):
+    assert app.url_map.bind("localhost").match("/composeEmail", method="POST")[0] == "composeEmail"
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([os.path.abspath(__file__), "-q"]))
@@ -0,0 +1,58 @@
+"""
+Tests for the content-addressed embedding lookup
+Run with
+    python -m pytest test_content_store.py
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import pytest
+
+import outlook_rag
+from content_store import DIGEST_DTYPE, ContentStore
+
+# A sha256 digest ends in a NUL byte once in 256 texts
+NUL_DIGEST = b"\x07" * 31 + b"\x00"
+OTHER_DIGEST = b"\x00" * 31 + b"\x01"
+
+
+def test_digests_ending_in_nul_roundtrip():
+    store = ContentStore("model")
+    store.add("emails", np.array([0, 1]), [NUL_DIGEST, OTHER_DIGEST])
+
+    assert store.lookup([NUL_DIGEST, OTHER_DIGEST, NUL_DIGEST[:31]]) == [("emails", 0), ("emails", 1), None]
+    assert store.matches("emails", np.array([0, 1]), [NUL_DIGEST, OTHER_DIGEST])
+    state = store.state("emails", 2)
+    assert state.tolist() == [NUL_DIGEST, OTHER_DIGEST]
+
+    reopened = ContentStore("model")
+    reopened.attach("emails", state, 2)
+    assert reopened.lookup([NUL_DIGEST, OTHER_DIGEST]) == [("emails", 0), ("emails", 1)]
+
+
+def test_attach_reads_older_s32_digests():
+    store = ContentStore("model")
+    store.attach("emails", np.array([OTHER_DIGEST, b""], dtype="S32"), 2)
+    assert store.lookup([OTHER_DIGEST]) == [("emails", 0)]
+    assert store.state("emails", 2).dtype == DIGEST_DTYPE
+
+
+def test_snapshot_keeps_digests_ending_in_nul(open_rag, make_email, monkeypatch):
+    monkeypatch.setattr(outlook_rag, "content_digest",
+                        lambda text: hashlib.sha256(text.encode('utf-8')).digest()[:31] + b"\x00")
+    emails = [make_email(number) for number in range(3)]
+    rag = open_rag()
+    rag.add_emails(emails)
+    rag.save_embeddings_cache()
+    rag.close()
+
+    rag = open_rag()
+    rag.add_emails([dict(email, id=f"copy-{email['id']}") for email in emails])
+    assert rag.get_stats()["content_store"]["hits"] == 3
+    assert rag.get_stats()["content_store"]["misses"] == 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([os.path.abspath(__file__), "-q"]))
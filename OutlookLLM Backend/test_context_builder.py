@@ -0,0 +1,76 @@
+"""
+Tests for token-budgeted context packing
+Run with
+    python -m pytest test_context_builder.py
+"""
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from context_builder import ContextBuilder, ContextSource, approximate_tokens
+from outlook_rag import OutlookRAGSystem
+
+
+@pytest.fixture
+def rag(tmp_path):
+    system = OutlookRAGSystem(snapshot_dir=str(tmp_path), embedder_backend="hashing")
+    yield system
+    system.close()
+
+
+def test_identical_bodies_keep_every_source():
+    sources = [ContextSource(f"email-{number}", f"From: sender{number}@company.com\nSubject: Invoice {number}\n",
+                             ["Thanks, see attached."], len("Thanks, see attached."))
+               for number in range(4)]
+    context, report = ContextBuilder(budget_tokens=1024).build("Relevant emails:\n", sources, "Email")
+
+    assert [source["id"] for source in report["sources"]] == [f"email-{number}" for number in range(4)]
+    assert report["duplicates_skipped"] == 3
+    # The text is packed once, every header is kept and points at it
+    assert context.count("Thanks, see attached.") == 1
+    for number in range(4):
+        assert f"Subject: Invoice {number}" in context
+    assert context.count("Body: same as Email 1") == 3
+    assert [source["duplicate_of"] for source in report["sources"]] == [None, "email-0", "email-0", "email-0"]
+    assert report["used_tokens"] == approximate_tokens("Relevant emails:\n") + sum(source["tokens"] for source in report["sources"])
+
+
+def test_duplicate_headers_still_respect_the_budget():
+    sources = [ContextSource(f"email-{number}", f"Subject: Invoice {number}\n", ["Thanks, see attached."])
+               for number in range(50)]
+    _, report = ContextBuilder(budget_tokens=100).build("", sources, "Email")
+    assert 0 < len(report["sources"]) < 50
+    assert report["used_tokens"] <= 100
+
+
+def test_query_inbox_returns_distinct_emails_with_identical_bodies(rag):
+    rag.add_emails([{
+        "id": f"email-{number}", "subject": f"Invoice {number} for March", "body": "Thanks, see attached.",
+        "sender": f"billing{number}@vendor.net", "date": datetime(2024, 3, 1 + number, 9).isoformat()
+    } for number in range(4)])
+
+    result = rag.query_inbox("invoice see attached")
+
+    assert {email["id"] for email in result["relevant_emails"]} == {f"email-{number}" for number in range(4)}
+    for number in range(4):
+        assert f"billing{number}@vendor.net" in result["context"]
+
+
+def test_calendar_window_keeps_meetings_with_the_same_description(rag):
+    start = datetime(2024, 3, 4, 9)
+    rag.add_calendar_events([{
+        "id": f"event-{number}", "subject": f"Meeting {number}", "body": "agenda",
+        "start_time": (start + timedelta(hours=2 * number)).isoformat(),
+        "end_time": (start + timedelta(hours=2 * number + 1)).isoformat()
+    } for number in range(3)])
+
+    for mode in ("window", "upcoming"):
+        result = rag.query_calendar("what is on", mode=mode, start=start, end=start + timedelta(days=1))
+        assert [event["id"] for event in result["relevant_events"]] == ["event-0", "event-1", "event-2"]
+        assert result["context_tokens"]["duplicates_skipped"] == 2
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([os.path.abspath(__file__), "-q"]))
@@ -0,0 +1,123 @@
+"""
+Tests for the pluggable embedding backends
+Run with
+    python -m pytest test_embedders.py
+"""
+
+import os
+import sys
+import logging
+
+import numpy as np
+import pytest
+
+import embedders
+from embedders import (DEFAULT_EMBEDDING_MODEL, Embedder, HashingEmbedder, available_backend, create_embedder,
+                       embedding_space)
+from outlook_rag import OutlookRAGSystem
+
+
+class FakeModelEmbedder(Embedder):
+    """Stands in for a model backend that cannot be imported here"""
+
+    backend = "transformers"
+
+    def __init__(self, model_name: str, **options):
+        self.model_name = model_name
+        self.options = options
+
+    def encode(self, texts, batch_size=32):
+        return np.zeros((len(texts), 8), dtype=np.float32)
+
+
+def test_hashing_embedder_is_deterministic():
+    # Reopened systems rely on the same text mapping to the same vector in every process
+    first = create_embedder("hashing").encode(["budget review topic7"])
+    second = create_embedder("hashing").encode(["budget review topic7"])
+    assert np.array_equal(first, second)
+
+
+def test_backend_selection():
+    embedder = create_embedder("hashing", dim=64)
+    assert isinstance(embedder, HashingEmbedder)
+    assert embedder.encode(["one", "two words"]).shape == (2, 64)
+    with pytest.raises(ValueError):
+        create_embedder("word2vec")
+    with pytest.raises(ValueError):
+        OutlookRAGSystem(embedder_backend="word2vec")
+
+    # Vectors of different backends never share an embedding space unless they are the same vectors
+    assert embedding_space("hashing", DEFAULT_EMBEDDING_MODEL) == "hashing-384"
+    assert embedding_space("onnx", DEFAULT_EMBEDDING_MODEL) == f"{DEFAULT_EMBEDDING_MODEL}+int8"
+    assert embedding_space("onnx", DEFAULT_EMBEDDING_MODEL, quantize=False) == DEFAULT_EMBEDDING_MODEL
+    assert embedding_space("transformers", DEFAULT_EMBEDDING_MODEL) == DEFAULT_EMBEDDING_MODEL
+
+
+def test_incomplete_backend_fails_when_created():
+    class NoEncode(Embedder):
+        backend = "incomplete"
+
+    with pytest.raises(TypeError):
+        NoEncode()
+
+
+def test_auto_uses_transformers_without_sentence_transformers(monkeypatch):
+    def missing(*args, **kwargs):
+        raise ImportError("No module named 'sentence_transformers'")
+
+    monkeypatch.setattr(embedders, "SentenceTransformerEmbedder", missing)
+    monkeypatch.setattr(embedders, "TransformersEmbedder", FakeModelEmbedder)
+    assert isinstance(create_embedder("auto"), FakeModelEmbedder)
+
+
+def test_onnx_falls_back_without_onnxruntime(monkeypatch, caplog, tmp_path):
+    monkeypatch.setitem(sys.modules, "onnxruntime", None)
+    monkeypatch.setattr(embedders, "SentenceTransformerEmbedder", FakeModelEmbedder)
+
+    with caplog.at_level(logging.WARNING):
+        assert available_backend("onnx", {"intra_op_threads": 4}) == ("auto", {})
+    assert "onnxruntime is not installed" in caplog.text
+    # The ONNX-only options are not passed on to the fallback
+    embedder = create_embedder("onnx", intra_op_threads=4, quantize=True)
+    assert isinstance(embedder, FakeModelEmbedder) and embedder.options == {}
+
+    # The float vectors of the fallback are not stored as int8 ONNX ones
+    rag = OutlookRAGSystem(snapshot_dir=str(tmp_path), embedder_backend="onnx", retrieval_mode="keyword",
+                           embedder_options={"intra_op_threads": 4})
+    try:
+        assert (rag.embedder_backend, rag.embedder_options) == ("auto", {})
+        assert rag.embedding_space == DEFAULT_EMBEDDING_MODEL
+    finally:
+        rag.close()
+
+    assert available_backend("hashing", {"dim": 64}) == ("hashing", {"dim": 64})
+
+
+def test_reopen_with_another_backend_serves_the_snapshot(open_rag, make_email, caplog):
+    rag = open_rag()
+    rag.add_emails([make_email(number) for number in range(6)])
+    rag.save_embeddings_cache()
+    rag.close()
+
+    with caplog.at_level(logging.WARNING):
+        reopened = open_rag(embedder_options={"dim": 128})
+    assert "Snapshot holds hashing-384 vectors" in caplog.text
+    # The snapshot keeps being searched with the embedder that built it until a reindex
+    assert reopened.pending_migration == {"backend": "hashing", "model_name": DEFAULT_EMBEDDING_MODEL, "options": {"dim": 128}}
+    assert reopened.get_stats()["pending_migration"] == reopened.pending_migration
+    assert reopened.embedding_space == "hashing-384"
+    assert reopened.search_emails("topic4 workstream4", top_k=1)[0].id == "email-4"
+    # Documents added meanwhile go into the snapshot's space too
+    reopened.add_emails([make_email(7)])
+    assert reopened.search_emails("topic7 workstream7", top_k=1)[0].id == "email-7"
+    reopened.close()
+
+    caplog.clear()
+    with caplog.at_level(logging.WARNING):
+        same = open_rag()
+    assert same.pending_migration is None
+    assert "Snapshot holds" not in caplog.text
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([os.path.abspath(__file__), "-q"]))
@@ -0,0 +1,67 @@
+"""
+Tests for the append-only ingestion journal and its replay at startup
+Run with
+    python -m pytest test_ingest_journal.py
+"""
+
+import os
+import threading
+
+import numpy as np
+import pytest
+
+import ingest_journal
+from ingest_journal import RECORD_HEADER, IngestJournal, journal_generations, journal_path
+
+
+def live_ids(rag):
+    return set(rag.reindex_source()[1]["emails"])
+
+
+def test_replay_ignores_record_torn_mid_write(open_rag, make_email, tmp_path):
+    rag = open_rag()
+    for number in range(5):
+        rag.add_emails([make_email(number)])
+    rag.close()
+
+    # Cut the last record in half, as a crash inside its write would
+    path = journal_path(str(tmp_path), journal_generations(str(tmp_path))[-1])
+    with open(path, 'rb') as f:
+        data = f.read()
+    offsets, position = [], 0
+    while position < len(data):
+        offsets.append(position)
+        length, _ = RECORD_HEADER.unpack_from(data, position)
+        position += RECORD_HEADER.size + length
+    last = offsets[-1]
+    with open(path, 'r+b') as f:
+        f.truncate(last + RECORD_HEADER.size + (len(data) - last - RECORD_HEADER.size) // 2)
+
+    rag = open_rag()
+    assert live_ids(rag) == {f"email-{number}" for number in range(4)}
+    assert rag.search_emails("topic2 workstream2", top_k=1)[0].id == "email-2"
+    # New records go to a fresh generation, not behind the torn tail where replay would never reach them
+    rag.add_emails([make_email(9)])
+    rag.close()
+
+    rag = open_rag()
+    assert live_ids(rag) == {f"email-{number}" for number in (0, 1, 2, 3, 9)}
+    assert rag.search_emails("topic9 workstream9", top_k=1)[0].id == "email-9"
+
+
+def test_zero_interval_fsyncs_inline_without_a_flusher(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(ingest_journal.os, "fsync", synced.append)
+    journal = IngestJournal(str(tmp_path), 0, "model", group_commit_records=256, group_commit_interval=0)
+    try:
+        assert not any(thread.name == "journal-flusher" for thread in threading.enumerate())
+        journal.append("emails", {"id": "email-0"}, np.ones((1, 4), dtype=np.float32))
+        journal.append_delete("emails", "email-0")
+        assert len(synced) == 2
+        assert os.path.getsize(journal_path(str(tmp_path), 0)) == journal.size
+    finally:
+        journal.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([os.path.abspath(__file__), "-q"]))
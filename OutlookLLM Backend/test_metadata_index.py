@@ -0,0 +1,53 @@
+"""
+Tests for the columnar metadata filters of email and calendar search
+Run with
+    python -m pytest test_metadata_index.py
+"""
+
+import os
+from dataclasses import dataclass
+from datetime import date, datetime
+
+import pytest
+
+from metadata_index import MetadataIndex
+
+
+@dataclass
+class Item:
+    date: datetime
+    sender: str = "team@company.com"
+    folder: str = "Inbox"
+
+
+def test_single_day_date_to_includes_the_whole_day(rag, make_email):
+    times = {"midnight": "2024-05-06T00:00:00", "noon": "2024-05-06T12:30:00", "late": "2024-05-06T23:59:59",
+             "next": "2024-05-07T00:00:00", "before": "2024-05-05T23:59:59"}
+    rag.add_emails([make_email(number, id=name, date=date) for number, (name, date) in enumerate(times.items())])
+
+    def found(filters):
+        return {email.id for email in rag.search_emails("project update", top_k=10, filters=filters)}
+
+    assert found({"date_from": "2024-05-06", "date_to": "2024-05-06"}) == {"midnight", "noon", "late"}
+    assert found({"date_to": "2024-05-06"}) == {"before", "midnight", "noon", "late"}
+    # A date_to with a time stays inclusive to the second
+    assert found({"date_to": "2024-05-06T12:30:00"}) == {"before", "midnight", "noon"}
+
+
+def test_date_and_categorical_filters():
+    index = MetadataIndex("date", ("sender", "folder"), substring_fields=("sender",))
+    index.add_batch(0, [Item(datetime(2024, 5, 6, 18), "finance-team@contoso.com"),
+                        Item(datetime(2024, 5, 7, 9), folder="Archive"),
+                        Item(datetime(2024, 5, 5, 8), "Finance@contoso.com", "Archive")])
+
+    assert index.select(None) is None
+    assert index.select({"date_to": date(2024, 5, 6)}).tolist() == [0, 2]
+    assert index.select({"sender": "finance"}).tolist() == [0, 2]
+    assert index.select({"sender": "finance", "folder": "archive"}).tolist() == [2]
+    assert index.select({"folder": ["inbox", "Archive"], "date_from": "2024-05-06"}).tolist() == [0, 1]
+    with pytest.raises(ValueError):
+        index.select({"subject": "budget"})
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([os.path.abspath(__file__), "-q"]))
@@ -0,0 +1,76 @@
+"""
+Tests for upsert, delete and purging tombstoned documents
+Run with
+    python -m pytest test_upsert_delete.py
+"""
+
+import os
+import threading
+
+import pytest
+
+import outlook_rag
+
+
+def live_ids(rag):
+    return set(rag.reindex_source()[1]["emails"])
+
+
+def test_purge_keeps_inserts_and_deletes_made_while_it_runs(open_rag, make_email, monkeypatch):
+    rag = open_rag()
+    rag.add_emails([make_email(number) for number in range(12)])
+    for number in (1, 4, 7):
+        assert rag.delete_email(f"email-{number}")
+
+    write_snapshot = outlook_rag.write_snapshot
+
+    def concurrent_writes():
+        # Lands between the purge capturing the corpora and installing the purged snapshot
+        rag.add_emails([make_email(number) for number in (20, 21)])
+        assert rag.delete_email("email-2")
+        assert rag.delete_email("email-20")
+
+    def slow_write_snapshot(*args, **kwargs):
+        result = write_snapshot(*args, **kwargs)
+        writer = threading.Thread(target=concurrent_writes)
+        writer.start()
+        writer.join()
+        return result
+
+    monkeypatch.setattr(outlook_rag, "write_snapshot", slow_write_snapshot)
+    assert rag.purge_deleted() == 3
+    monkeypatch.setattr(outlook_rag, "write_snapshot", write_snapshot)
+
+    expected = {f"email-{number}" for number in (0, 3, 5, 6, 8, 9, 10, 11, 21)}
+    assert live_ids(rag) == expected
+    assert rag.get_stats()["tombstones"]["purges"] == 1
+    for number in (0, 3, 11, 21):
+        hits = rag.search_emails(f"topic{number} workstream{number}", top_k=3)
+        assert hits[0].id == f"email-{number}"
+        assert hits[0].subject == f"Project topic{number} update"
+    for number in (1, 2, 4, 7, 20):
+        hits = rag.search_emails(f"topic{number} workstream{number}", top_k=len(expected))
+        assert f"email-{number}" not in {email.id for email in hits}
+    for mode in ("keyword", "hybrid"):
+        assert rag.search_emails("topic21 workstream21", top_k=1, mode=mode)[0].id == "email-21"
+
+    # The purged snapshot and the journal written after it restore the same corpus
+    rag.close()
+    reopened = open_rag()
+    assert live_ids(reopened) == expected
+    assert reopened.search_emails("topic21 workstream21", top_k=1)[0].id == "email-21"
+
+
+def test_upsert_replaces_and_delete_hides(rag, make_email):
+    rag.add_emails([make_email(number) for number in range(3)])
+    rag.upsert_email(make_email(1, subject="Rescheduled topic99 review", body="Moved to Friday, workstream99 agreed."))
+
+    assert rag.search_emails("topic99 workstream99", top_k=1)[0].subject == "Rescheduled topic99 review"
+    assert live_ids(rag) == {"email-0", "email-1", "email-2"}
+    assert rag.delete_email("email-1")
+    assert not rag.delete_email("email-1")
+    assert "email-1" not in {email.id for email in rag.search_emails("topic99 workstream99", top_k=3)}
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([os.path.abspath(__file__), "-q"]))
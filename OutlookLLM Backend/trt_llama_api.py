@@ -23,24 +23,42 @@ import os
 import flask
 from flask import jsonify
 
-from transformers import AutoTokenizer
 import gc
 import json
-import torch
+import logging
+import queue
+import threading
 import numpy as np
-from tensorrt_llm.runtime import ModelConfig, SamplingConfig
-import tensorrt_llm
 from pathlib import Path
 import uuid
 import time
-from typing import Any, Callable, Optional, Dict
-from utils import EOS
+from typing import Any, Callable, Optional, Dict, List
+from completion_batcher import CompletionBatcher
+from prefix_cache import PrefixCache
+from detokenizer import IncrementalDetokenizer
 
 EOS_TOKEN = 2
 PAD_TOKEN = 2
 
 DEFAULT_CONTEXT_WINDOW = 3900
 DEFAULT_NUM_OUTPUTS = 256
+# The session is set up for input lengths rounded up to a multiple of this
+DEFAULT_INPUT_BUCKET = 256
+# Fraction of GPU memory in use above which cached allocations are released after a request
+DEFAULT_MEMORY_WATERMARK = 0.9
+
+# torch and tensorrt_llm take seconds to import; they are bound by _import_runtime() when the
+# first engine is loaded, so importing this module (and app.py) stays cheap
+torch = None
+tensorrt_llm = None
+
+
+def _import_runtime():
+    global torch, tensorrt_llm
+    if tensorrt_llm is None:
+        import torch
+        import tensorrt_llm
+        import tensorrt_llm.runtime
 
 try:
     from pydantic.v1 import (
@@ -72,6 +90,20 @@ except ImportError:
     from pydantic.error_wrappers import ValidationError
 
 
+class PhaseTimer:
+    """Milliseconds spent in each phase of a request, timed back to back"""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def lap(self, phase: str):
+        """Charge the time since the previous lap to `phase`"""
+        now = time.perf_counter()
+        self.timings[phase] = self.timings.get(phase, 0.0) + (now - self._last) * 1000
+        self._last = now
+
+
 def make_resData(data, chat=False, promptToken=[]):
     resData = {
         "id": f"chatcmpl-{str(uuid.uuid4())}" if (chat) else f"cmpl-{str(uuid.uuid4())}",
@@ -87,6 +119,8 @@ def make_resData(data, chat=False, promptToken=[]):
     }
     if (len(promptToken) != 0):
         resData["promptToken"] = promptToken
+    if "timings" in data:
+        resData["timings"] = data["timings"]
     if (chat):
         # only one choice is supported
         resData["choices"] = [{
@@ -177,6 +211,18 @@ class TrtLlmAPI(BaseModel):
         default_factory=dict, description="Kwargs used for model initialization."
     )
     verbose: bool = Field(description="Whether to print verbose output.")
+    persistent_session: bool = Field(
+        default=True,
+        description="Keep the generation session set up across requests and release GPU memory only above the watermark; "
+                    "False sets it up and empties the cache on every request."
+    )
+    input_bucket: int = Field(
+        default=DEFAULT_INPUT_BUCKET, description="The session is set up for input lengths rounded up to a multiple of this."
+    )
+    memory_watermark: float = Field(
+        default=DEFAULT_MEMORY_WATERMARK,
+        description="Fraction of GPU memory in use above which cached allocations are released after a request."
+    )
 
     _model: Any = PrivateAttr()
     _model_config: Any = PrivateAttr()
@@ -184,6 +230,18 @@ class TrtLlmAPI(BaseModel):
     _max_new_tokens = PrivateAttr()
     _sampling_config = PrivateAttr()
     _verbose = PrivateAttr()
+    # (batch size, max context length) the session is set up for, None before the first request
+    _session_shape = PrivateAttr()
+    # Set when the runtime rejects a session set up for longer inputs than the request's
+    _exact_shapes = PrivateAttr()
+    _stats = PrivateAttr()
+    _stats_lock = PrivateAttr()
+    # One decode at a time: the batcher's worker, or the request thread when batching is off
+    _session_lock = PrivateAttr()
+    _batcher = PrivateAttr()
+    # max_batch_size the engine was built with, None if its config does not say
+    _engine_max_batch = PrivateAttr()
+    _prefix_cache = PrivateAttr()
 
     def __init__(
             self,
@@ -197,13 +255,33 @@ class TrtLlmAPI(BaseModel):
             completion_to_prompt: Optional[Callable] = None,
             generate_kwargs: Optional[Dict[str, Any]] = None,
             model_kwargs: Optional[Dict[str, Any]] = None,
-            verbose: bool = False
+            verbose: bool = False,
+            persistent_session: bool = True,
+            input_bucket: int = DEFAULT_INPUT_BUCKET,
+            memory_watermark: float = DEFAULT_MEMORY_WATERMARK,
+            max_batch_size: int = 1,
+            batch_window: float = 0.01,
+            batch_token_budget: Optional[int] = None,
+            prefix_cache_size: int = 32
     ) -> None:
 
+        _import_runtime()
+        from transformers import AutoTokenizer
+        from tensorrt_llm.runtime import ModelConfig, SamplingConfig
+
         model_kwargs = model_kwargs or {}
         model_kwargs.update({"n_ctx": context_window, "verbose": verbose})
         self._max_new_tokens = max_new_tokens
         self._verbose = verbose
+        self._session_shape = None
+        self._exact_shapes = False
+        self._stats = {"requests": 0, "setups": 0, "cleanups": 0, "timings": {}}
+        self._stats_lock = threading.Lock()
+        self._session_lock = threading.Lock()
+        self._batcher = None
+        self._engine_max_batch = None
+        self._prefix_cache = PrefixCache(lambda text: self._tokenizer.encode(text, add_special_tokens=False),
+                                         capacity=prefix_cache_size)
         # check if model is cached
         if model_path is not None:
             if not os.path.exists(model_path):
@@ -221,6 +299,7 @@ class TrtLlmAPI(BaseModel):
                     config = json.load(f)
                 use_gpt_attention_plugin = config['plugin_config']['gpt_attention_plugin']
                 remove_input_padding = config['plugin_config']['remove_input_padding']
+                self._engine_max_batch = config['builder_config'].get('max_batch_size')
                 tp_size = config['builder_config']['tensor_parallel']
                 pp_size = config['builder_config']['pipeline_parallel']
                 world_size = tp_size * pp_size
@@ -288,7 +367,11 @@ class TrtLlmAPI(BaseModel):
             generate_kwargs=generate_kwargs,
             model_kwargs=model_kwargs,
             verbose=verbose,
+            persistent_session=persistent_session,
+            input_bucket=input_bucket,
+            memory_watermark=memory_watermark,
         )
+        self.configure_batching(max_batch_size, batch_window, batch_token_budget)
 
     @classmethod
     def class_name(cls) -> str:
@@ -314,56 +397,161 @@ class TrtLlmAPI(BaseModel):
         assert len(prompt) > 0
         is_formatted = kwargs.pop("formatted", False)
         temperature = kwargs.pop("temperature", 1.0)
+        max_new_tokens = min(kwargs.pop("max_new_tokens", self._max_new_tokens), self._max_new_tokens)
+        # Leading text shared by many prompts (system prompt framing), whose token ids are cached
+        prompt_prefix = kwargs.pop("prompt_prefix", None)
         #TODO: need to respect (truncate output after) stop strings.
         stop_strings = kwargs.pop("stop_strings", "")
         if not is_formatted:
             prompt = self.completion_to_prompt(prompt)
 
-        input_text = prompt
-        input_ids, input_lengths = self.parse_input(input_text, self._tokenizer,
-                                                    EOS_TOKEN,
-                                                    self._model_config)
-
-        max_input_length = torch.max(input_lengths).item()
-        self._model.setup(input_lengths.size(0), max_input_length, self._max_new_tokens, 1)  # beam size is set to 1
-        if self._verbose:
-            start_time = time.time()
-
-        self._sampling_config.temperature = temperature
-        output_ids = self._model.decode(input_ids, input_lengths, self._sampling_config)
-        torch.cuda.synchronize()
-
-        elapsed_time = None
-        if self._verbose:
-            end_time = time.time()
-            elapsed_time = end_time - start_time
+        # Tokenized on the request thread, so concurrent requests do not tokenize one after another
+        timer = PhaseTimer()
+        input_tokens = self._prefix_cache.encode(prompt, prompt_prefix)
+        timer.lap("tokenize")
 
-        output_txt, output_token_ids = self.get_output(output_ids,
-                                                       input_lengths,
-                                                       self._max_new_tokens,
-                                                       self._tokenizer)
+        request = dict(input_ids=input_tokens, temperature=temperature, max_new_tokens=max_new_tokens)
+        if self._batcher is not None:
+            result = self._batcher.submit(request)
+        else:
+            started = time.perf_counter()
+            result = self.generate([request])[0]
+            result.update(queue_ms=0.0, compute_ms=(time.perf_counter() - started) * 1000, batch_size=1)
+        timings = {**timer.timings, "queue": result["queue_ms"], **result["timings"], "compute": result["compute_ms"]}
+        output_txt, output_token_ids = result["content"], result["output_ids"]
 
         if self._verbose:
-            print(f"Input context length  : {input_ids.shape[1]}")
+            elapsed_time = timings["decode"] / 1000
+            print(f"Input context length  : {len(input_tokens)}")
+            print(f"Batch size            : {result['batch_size']}")
             print(f"Inference time        : {elapsed_time:.2f} seconds")
             print(f"Output context length : {len(output_token_ids)} ")
             print(f"Inference token/sec   : {(len(output_token_ids) / elapsed_time):2f}")
 
-        # call garbage collected after inference
-        torch.cuda.empty_cache()
-        gc.collect()
+        self._record(timings)
 
         thisdict = dict(truncated=False,
-                        prompt_tokens=input_ids.shape[1],
+                        prompt_tokens=len(input_tokens),
                         completion_tokens=len(output_token_ids),
                         content=str(output_txt),
                         stopped=False,
                         slot_id=1,
-                        stop=True)
+                        stop=True,
+                        timings={phase: round(ms, 3) for phase, ms in timings.items()})
 
         resData = make_resData(thisdict, chat=chat)
         return jsonify(resData)
 
+    def generate(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Decode tokenized requests as one batch; returns {output_ids, content, timings} per request
+
+        Each request is a dict with input_ids, temperature and max_new_tokens; they
+        share one sampling config, so the batch must share the temperature. Each
+        output is cut at its own max_new_tokens.
+        """
+        if len({request["temperature"] for request in requests}) > 1:
+            raise ValueError("Requests decoded in one batch must share the temperature")
+        with self._session_lock:
+            timer = PhaseTimer()
+            input_ids, input_lengths = self._pack([request["input_ids"] for request in requests], EOS_TOKEN,
+                                                  self._model_config.remove_input_padding)
+            self._sampling_config.temperature = requests[0]["temperature"]
+            output_ids = self._decode(input_ids, input_lengths, max(request["max_new_tokens"] for request in requests), timer)
+            torch.cuda.synchronize()
+            timer.lap("decode")
+
+            outputs = self._split_output(output_ids, [len(request["input_ids"]) for request in requests],
+                                         [request["max_new_tokens"] for request in requests])
+            texts = [self._tokenizer.decode(output) for output in outputs]
+            timer.lap("detokenize")
+
+            self._release_memory()
+            timer.lap("cleanup")
+        return [dict(output_ids=output, content=text, timings=timer.timings) for output, text in zip(outputs, texts)]
+
+    def configure_batching(self, max_batch_size: int = 1, batch_window: float = 0.01, token_budget: Optional[int] = None):
+        """Decode concurrent completions together, up to max_batch_size (capped at the engine's); 1 decodes each alone"""
+        if self._batcher is not None:
+            self._batcher.close()
+            self._batcher = None
+        if self._engine_max_batch:
+            max_batch_size = min(max_batch_size, self._engine_max_batch)
+        if max_batch_size > 1:
+            self._batcher = CompletionBatcher(self.generate, max_batch_size, batch_window, token_budget)
+
+    def _setup_session(self, batch_size: int, input_length: int, output_length: int) -> bool:
+        """Set the session up for a batch unless its buffers already fit it; True if it was set up
+        
+        A persistent session is set up for the input length rounded up to input_bucket
+        and never for a shorter one than before, and for the output length rounded up
+        to a power of two, so it is only set up again for a new batch size or output bin.
+        """
+        shape = self._session_shape
+        if self.persistent_session and not self._exact_shapes:
+            output_length = min(max(32, 1 << (output_length - 1).bit_length()), self._max_new_tokens)
+            if shape is not None and shape[0] == batch_size and shape[2] == output_length and input_length <= shape[1]:
+                return False
+            context_length = min(-(-input_length // self.input_bucket) * self.input_bucket, self.context_window)
+            context_length = max(context_length, input_length, shape[1] if shape is not None else 0)
+        elif self.persistent_session and shape == (batch_size, input_length, output_length):
+            return False
+        else:
+            context_length = input_length
+        self._model.setup(batch_size, context_length, output_length, 1)  # beam size is set to 1
+        self._session_shape = (batch_size, context_length, output_length)
+        self._stats["setups"] += 1
+        return True
+
+    def _decode(self, input_ids, input_lengths, max_new_tokens: int, timer: PhaseTimer, **kwargs: Any):
+        """GenerationSession.decode on a session set up for the batch (call with the session lock held)"""
+        max_input_length = torch.max(input_lengths).item()
+        self._setup_session(input_lengths.size(0), max_input_length, max_new_tokens)
+        timer.lap("setup")
+        try:
+            return self._model.decode(input_ids, input_lengths, self._sampling_config, **kwargs)
+        except AssertionError as e:
+            if self._exact_shapes or not self.persistent_session:
+                raise
+            # Runtimes that require the exact set-up length can still reuse a session for repeated shapes
+            logging.warning(f"TensorRT session rejected a bucketed setup ({e}); setting it up per input length")
+            self._exact_shapes = True
+            self._setup_session(input_lengths.size(0), max_input_length, max_new_tokens)
+            timer.lap("setup")
+            return self._model.decode(input_ids, input_lengths, self._sampling_config, **kwargs)
+
+    def _release_memory(self) -> bool:
+        """Return cached GPU memory to the device; with a persistent session only above the watermark"""
+        if self.persistent_session:
+            free, total = torch.cuda.mem_get_info()
+            if (total - free) / total < self.memory_watermark:
+                return False
+        torch.cuda.empty_cache()
+        gc.collect()
+        self._stats["cleanups"] += 1
+        return True
+
+    def _record(self, timings: Dict[str, float]):
+        with self._stats_lock:
+            self._stats["requests"] += 1
+            for phase, ms in timings.items():
+                self._stats["timings"][phase] = self._stats["timings"].get(phase, 0.0) + ms
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Session reuse, memory cleanups, batching and mean milliseconds per request phase"""
+        with self._stats_lock:
+            requests = self._stats["requests"]
+            return {
+                "persistent_session": self.persistent_session,
+                "session_shape": self._session_shape,
+                "exact_shapes": self._exact_shapes,
+                "requests": requests,
+                "setups": self._stats["setups"],
+                "cleanups": self._stats["cleanups"],
+                "mean_ms": {phase: round(ms / requests, 3) for phase, ms in self._stats["timings"].items()} if requests else {},
+                "batching": self._batcher.get_stats() if self._batcher is not None else None,
+                "prefix_cache": self._prefix_cache.get_stats()
+            }
+
     def parse_input(self, input_text: str, tokenizer, end_id: int,
                     remove_input_padding: bool):
         input_tokens = []
@@ -371,6 +559,10 @@ class TrtLlmAPI(BaseModel):
         input_tokens.append(
             tokenizer.encode(input_text, add_special_tokens=False))
 
+        return self._pack(input_tokens, end_id, remove_input_padding)
+
+    def _pack(self, input_tokens: List[List[int]], end_id: int, remove_input_padding: bool):
+        """(input_ids, input_lengths) GPU tensors of a batch: packed into one row, or padded with end_id"""
         input_lengths = torch.tensor([len(x) for x in input_tokens],
                                      dtype=torch.int32,
                                      device='cuda')
@@ -385,6 +577,12 @@ class TrtLlmAPI(BaseModel):
 
         return input_ids, input_lengths
 
+    def _split_output(self, output_ids, input_lengths: List[int], max_new_tokens: List[int]) -> List[List[int]]:
+        """Generated ids of every sequence of a batch (first beam), cut at its own max_new_tokens"""
+        rows = output_ids[:, 0].tolist()
+        return [self.remove_extra_eos_ids(row[length:length + limit])
+                for row, length, limit in zip(rows, input_lengths, max_new_tokens)]
+
     def remove_extra_eos_ids(self, outputs):
         outputs.reverse()
         while outputs and outputs[0] == 2:
@@ -417,19 +615,15 @@ class TrtLlmAPI(BaseModel):
         assert len(prompt) > 0
         is_formatted = kwargs.pop("formatted", False)
         temperature = kwargs.pop("temperature", 1.0)
+        prompt_prefix = kwargs.pop("prompt_prefix", None)
         stop_strings = kwargs.pop("stop_strings", "")
         if not is_formatted:
             prompt = self.completion_to_prompt(prompt)
 
-        input_text = prompt
-        input_ids, input_lengths = self.parse_input(input_text, self._tokenizer,
-                                                    EOS_TOKEN,
-                                                    self._model_config)
+        input_ids, input_lengths = self._pack([self._prefix_cache.encode(prompt, prompt_prefix)], EOS_TOKEN,
+                                              self._model_config.remove_input_padding)
 
         max_input_length = torch.max(input_lengths).item()
-        self._model.setup(input_lengths.size(0), max_input_length, self._max_new_tokens, 1)  # beam size is set to 1
-        self._sampling_config.temperature = temperature
-        output_ids = self._model.decode(input_ids, input_lengths, self._sampling_config, streaming=True)
 
         def gen() -> flask.Response:
             thisdict = dict(truncated=False,
@@ -442,7 +636,12 @@ class TrtLlmAPI(BaseModel):
             resData = make_resData_stream(thisdict, chat=chat, start=True)
             yield 'data: {}\n'.format(json.dumps(resData))
 
-            text = ""
+            # Only the new token of every step is read back and decoded, so a step costs the same at any length
+            detokenizer = IncrementalDetokenizer(self._tokenizer)
+            finished = False
+            # Enough recent text to find a stop string spanning chunks
+            stop_window = max((len(stop_string) for stop_string in stop_strings), default=1) - 1
+            tail = ""
             dictForDelta = dict(truncated=False,
                                 prompt_tokens=max_input_length,
                                 completion_tokens=0,
@@ -451,26 +650,62 @@ class TrtLlmAPI(BaseModel):
                                 slot_id=1,
                                 stop=False)
 
-            for output_ids_delta in output_ids:
-                output_txt, output_token_ids = self.get_output(output_ids_delta,
-                                                               input_lengths,
-                                                               self._max_new_tokens,
-                                                               self._tokenizer)
-
-                if not dictForDelta["truncated"]:
-                    delta_text = output_txt[len(text):]
-                    text = output_txt.removesuffix(EOS)
-
-                    dictForDelta["content"] = delta_text.removesuffix(EOS)
-                    dictForDelta["completion_tokens"] = len(output_token_ids)
+            # The session is held by a decode thread until the last step, and the tokens are
+            # yielded from a queue outside the lock: a slow or gone client never blocks other requests
+            tokens = queue.Queue()
+            stopped = threading.Event()
+
+            def decode():
+                try:
+                    with self._session_lock:
+                        self._sampling_config.temperature = temperature
+                        output_ids = self._decode(input_ids, input_lengths, self._max_new_tokens, PhaseTimer(),
+                                                  streaming=True)
+                        for step, output_ids_delta in enumerate(output_ids):
+                            if not stopped.is_set():
+                                tokens.put(int(output_ids_delta[0][0][max_input_length + step]))
+                except Exception as e:
+                    tokens.put(e)
+                finally:
+                    tokens.put(None)
+
+            threading.Thread(target=decode, name="stream-decode", daemon=True).start()
+            try:
+                while not finished and not dictForDelta["truncated"]:
+                    token = tokens.get()
+                    if token is None:
+                        break
+                    if isinstance(token, Exception):
+                        raise token
+                    if token == EOS_TOKEN:
+                        finished = True
+                        stopped.set()
+                        delta_text = detokenizer.flush()
+                    else:
+                        delta_text = detokenizer.add([token])
+
+                    dictForDelta["content"] = delta_text
+                    # Counted with the end token, as get_output() does
+                    dictForDelta["completion_tokens"] = len(detokenizer.ids) + 1
                     resData = make_resData_stream(dictForDelta, chat=chat)
                     yield 'data: {}\n'.format(json.dumps(resData))
 
+                    recent = tail + delta_text
                     for stop_string in stop_strings:
-                        if stop_string in text:
+                        if stop_string in recent:
                             dictForDelta["truncated"] = True
                             break
-
+                    tail = recent[-stop_window:] if stop_window > 0 else ""
+            finally:
+                # Also on a client disconnect: the decode thread runs the session out without queueing
+                stopped.set()
+
+            if not finished and not dictForDelta["truncated"]:
+                # Stopped at max_new_tokens: send what the detokenizer still holds back
+                dictForDelta["content"] = detokenizer.flush()
+                if dictForDelta["content"]:
+                    resData = make_resData_stream(dictForDelta, chat=chat)
+                    yield 'data: {}\n'.format(json.dumps(resData))
 
             # close last message
             dictForDelta["content"] = ""
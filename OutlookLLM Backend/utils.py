@@ -122,10 +122,15 @@ def messages_to_prompt(
     return "".join(string_messages)
 
 
-def completion_to_prompt(completion: str, system_prompt: Optional[str] = None) -> str:
+def completion_prompt_prefix(system_prompt: Optional[str] = None) -> str:
+    """Start of every completion_to_prompt() prompt with this system prompt, up to the completion"""
     system_prompt_str = system_prompt or DEFAULT_SYSTEM_PROMPT
 
+    return f"{BOS} {B_INST} {B_SYS} {system_prompt_str.strip()} {E_SYS}"
+
+
+def completion_to_prompt(completion: str, system_prompt: Optional[str] = None) -> str:
     return (
-        f"{BOS} {B_INST} {B_SYS} {system_prompt_str.strip()} {E_SYS} "
+        f"{completion_prompt_prefix(system_prompt)} "
         f"{completion.strip()} {E_INST}"
     )
@@ -0,0 +1,202 @@
+"""
+Contiguous embedding matrix for the OutlookLLM RAG system
+Keeps every vector of a corpus in one float32 matrix with L2-normalized rows
+"""
+
+from typing import Iterator, Optional, Tuple
+import numpy as np
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize a vector or the rows of a matrix as float32"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Return the indices of the top_k highest scores, best first"""
+    if top_k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < scores.size:
+        candidates = np.argpartition(scores, -top_k)[-top_k:]
+    else:
+        candidates = np.arange(scores.size)
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+class VectorIndex:
+    """Float32 matrix of L2-normalized embeddings with a parallel row -> document mapping
+
+    Rows live in two segments: an optional read-only base (typically a memory-mapped
+    snapshot, see embedding_snapshot.py) followed by an in-memory tail that grows as
+    documents are added. Row numbers are global across both segments. Rows are
+    appended in document order, so owners never decrease.
+    """
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 1024,
+                 base_vectors: Optional[np.ndarray] = None, base_owners: Optional[np.ndarray] = None):
+        self._base_vectors = base_vectors
+        self._base_owners = base_owners
+        self._base_size = 0 if base_vectors is None else base_vectors.shape[0]
+        if dim is None and base_vectors is not None:
+            dim = base_vectors.shape[1]
+        self.dim = dim
+        self._capacity = max(1, initial_capacity)
+        self._size = 0
+        self._vectors: Optional[np.ndarray] = None
+        self._owners = np.empty(self._capacity, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self._base_size + self._size
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes allocated for the in-memory tail (a memory-mapped base is not counted)"""
+        vectors = self._vectors.nbytes if self._vectors is not None else 0
+        return int(vectors + self._owners.nbytes)
+
+    def segments(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Yield (vectors, owners) for the base and tail segments in row order"""
+        if self._base_size:
+            yield self._base_vectors, self._base_owners
+        if self._size:
+            yield self._vectors[:self._size], self._owners[:self._size]
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """All populated rows (a view without a base segment, a copy with one)"""
+        parts = [vectors for vectors, _ in self.segments()]
+        if not parts:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    @property
+    def owners(self) -> np.ndarray:
+        """Document position for every row of the matrix"""
+        parts = [owners for _, owners in self.segments()]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def rows_from(self, start: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Copies of (vectors, owners) for every row from `start` to the end"""
+        vectors, owners, offset = [], [], 0
+        for segment_vectors, segment_owners in self.segments():
+            begin = max(start - offset, 0)
+            offset += segment_vectors.shape[0]
+            if begin < segment_vectors.shape[0]:
+                vectors.append(segment_vectors[begin:])
+                owners.append(segment_owners[begin:])
+        if not vectors:
+            return np.empty((0, self.dim or 0), dtype=np.float32), np.empty(0, dtype=np.int64)
+        return np.concatenate(vectors), np.concatenate(owners)
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        """Gather the vectors of the given rows"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if not self._base_size:
+            return self._vectors[rows]
+        vectors = np.empty((rows.shape[0], self.dim), dtype=np.float32)
+        in_base = rows < self._base_size
+        vectors[in_base] = self._base_vectors[rows[in_base]]
+        if self._size:
+            vectors[~in_base] = self._vectors[rows[~in_base] - self._base_size]
+        return vectors
+
+    def owners_of(self, rows: np.ndarray) -> np.ndarray:
+        """Document positions of the given rows without materializing the full mapping"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if not self._base_size:
+            return self._owners[rows]
+        owners = np.empty(rows.shape, dtype=np.int64)
+        in_base = rows < self._base_size
+        owners[in_base] = self._base_owners[rows[in_base]]
+        owners[~in_base] = self._owners[rows[~in_base] - self._base_size]
+        return owners
+
+    def rows_of_owners(self, positions: np.ndarray) -> np.ndarray:
+        """Rows owned by the given ascending document positions, by bisecting the owners"""
+        positions = np.asarray(positions, dtype=np.int64)
+        rows, offset = [], 0
+        for _, segment_owners in self.segments():
+            starts = np.searchsorted(segment_owners, positions, side='left')
+            ends = np.searchsorted(segment_owners, positions, side='right')
+            counts = ends - starts
+            if counts.any():
+                # Expand every [start, end) range without a Python loop
+                run_starts = np.repeat(starts - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+                rows.append(offset + run_starts + np.arange(counts.sum()))
+            offset += segment_owners.shape[0]
+        return np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+
+    def _reserve(self, rows: int):
+        """Grow the tail arrays (amortized doubling) to hold `rows` rows"""
+        if self._vectors is None:
+            self._capacity = max(self._capacity, rows)
+            self._vectors = np.empty((self._capacity, self.dim), dtype=np.float32)
+            self._owners = np.empty(self._capacity, dtype=np.int64)
+            return
+        if rows <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < rows:
+            capacity *= 2
+        vectors = np.empty((capacity, self.dim), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        owners = np.empty(capacity, dtype=np.int64)
+        owners[:self._size] = self._owners[:self._size]
+        self._vectors, self._owners, self._capacity = vectors, owners, capacity
+
+    def add(self, vector: np.ndarray, owner: int) -> int:
+        """Append one embedding owned by document position `owner`, returns its row"""
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if self.dim is None:
+            self.dim = vector.shape[0]
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"Embedding dimension {vector.shape[0]} does not match index dimension {self.dim}")
+
+        self._reserve(self._size + 1)
+        row = self._size
+        self._vectors[row] = normalize_rows(vector)
+        self._owners[row] = owner
+        self._size += 1
+        return self._base_size + row
+
+    def add_batch(self, vectors: np.ndarray, owners: np.ndarray) -> np.ndarray:
+        """Append many embeddings at once, returns their rows"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[0] == 0:
+            return np.empty(0, dtype=np.int64)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {self.dim}")
+
+        start, end = self._size, self._size + vectors.shape[0]
+        self._reserve(end)
+        self._vectors[start:end] = normalize_rows(vectors)
+        self._owners[start:end] = owners
+        self._size = end
+        return np.arange(self._base_size + start, self._base_size + end, dtype=np.int64)
+
+    def search(self, query_vector: np.ndarray, top_k: int, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Cosine search: one matrix-vector product per segment plus an argpartition top-k
+
+        With `rows`, only those rows are gathered and scored (filtered search).
+        Returns (scores, rows) ordered from best to worst match.
+        """
+        if len(self) == 0 or (rows is not None and len(rows) == 0):
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        query = normalize_rows(np.asarray(query_vector).reshape(-1))
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            scores = self.take(rows) @ query
+            best = top_k_indices(scores, top_k)
+            return scores[best], rows[best]
+        parts = [vectors @ query for vectors, _ in self.segments()]
+        scores = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        rows = top_k_indices(scores, top_k)
+        return scores[rows], rows